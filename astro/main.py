@@ -3,6 +3,8 @@
 GENERAL DESCRIPTION
     This script will run aboard the ISS taking pictures of the Earth surface depending if there is enough light or free storage.
     The program will also save for each image the ISS location at the time it was taken, and the time itself as metadata.
+    The altitude of the ISS and its ground-track heading are saved as well, so that the footprint of each image
+    can be computed on Earth without looking the ISS up again.
     The script will automatically stop its execution to not exceed the maximum allowed runtime (3 hours).
 
 EXCEPTION HANDLING
@@ -37,6 +39,25 @@ STORAGE MANAGEMENT
 
     The files created by the program have names that satisfy the third requirement.
 
+CRASH RECOVERY
+    If the program restarts mid-mission it must not overwrite the images already taken, nor lose track of the filled storage and of the run time.
+
+    Every capture is appended to a journal ('captures.journal') as a fixed-size binary record holding the image number, its size,
+    the time and position of the capture, and the running totals of the filled storage and of the elapsed run time, followed by a CRC32.
+    The journal is flushed after each record and synced to disk every few records, to spare the SD card.
+    At startup only the last record is read, so the image counter, the filled storage and the start time are recovered without walking
+    the output folder. A record cut by a crash fails its CRC32 and is dropped, and the few images taken after the last synced record
+    are found by checking whether the next file names exist, a few missing names being skipped as errors leave them.
+
+LOOP TELEMETRY
+    The time spent by each iteration of the main loop is recorded to a ring buffer file ('telemetry.ring') of fixed size:
+    the light check, the ISS position, the capture, the journal write, the requested and actual sleep, and the resident memory.
+
+    Every record has a fixed size and a sequence number, and is written at the slot of its sequence number modulo the number of
+    slots, overwriting the oldest record once the file is full. Records are handed to a background thread through a bounded queue,
+    so that the loop never waits for the SD card, a record being dropped rather than blocking when the queue is full.
+    The file is preallocated and counted in the filled storage from the start. 'orbit/utils/telemetry.py' decodes it on Earth.
+
 CODE STYLE AND DOCUMENTATION
     Requirements:
         - The program is documented and easy to understand, and that there is no attempt to hide or obfuscate what a piece of code does.
@@ -48,16 +69,24 @@ CODE STYLE AND DOCUMENTATION
 # IMPORTS
 # --------------------------------------
 
+import os  # Sync the journal to disk
 import cv2  # Image processing
 import exif  # Embed GPS and time data into any images
+import zlib  # Checksum of the journal records
+import struct  # Binary journal records
+import math  # Ground-track heading
+import queue  # Hand the telemetry records to their thread
+import threading  # Write the telemetry in the background
 
 import numpy as np  # Array manipulation
 
 from pathlib import Path  # Path utilities
+from collections import namedtuple  # Journal records
 from picamera import PiCamera  # Take images
 from skyfield.timelib import Timescale
-from skyfield.api import load  # Load timescale data
-from time import sleep  # Sleep function to supspend the execution of the program
+from skyfield.api import load, wgs84  # Load timescale data, geographic position of the ISS
+from skyfield.units import Angle  # Latitude and longitude of the ISS
+from time import sleep, perf_counter  # Sleep function to supspend the execution of the program, loop timings
 
 from datetime import datetime, timedelta  # Time recognition
 from logzero import logger, logfile  # Debug purposes
@@ -70,14 +99,56 @@ from orbit import ISS, ephemeris  # Import ISS and load the JPL ephemeris DE421
 # How long to run the program for
 RUN_TIME: timedelta = timedelta(minutes=177)
 
+# Journal record: image number, image size, timestamp, latitude, longitude, filled storage, elapsed run time in seconds
+JOURNAL_RECORD = struct.Struct("<IQdddQd")
+# CRC32 of the record, to detect records cut by a crash
+JOURNAL_CRC = struct.Struct("<I")
+JOURNAL_RECORD_SIZE = JOURNAL_RECORD.size + JOURNAL_CRC.size
+
+# How many records are written between two syncs to disk
+JOURNAL_SYNC_EVERY = 10
+
+# Consecutive image numbers that may be missing after the last record, as an error adds 2 to the image counter
+RESUME_MAX_GAP = 2
+
+JournalRecord = namedtuple("JournalRecord", ["image", "size", "timestamp", "latitude", "longitude", "storage", "elapsed"])
+
+# Offset in days of the second position of the ISS, whose bearing from the first is the ground-track heading
+HEADING_OFFSET = np.array([0, 1 / 86400])
+
+IssState = namedtuple("IssState", ["latitude", "longitude", "altitude", "heading"])
+
+# Telemetry file header: magic, version, record size, number of slots
+TELEMETRY_HEADER = struct.Struct("<4sHHI")
+TELEMETRY_MAGIC = b"TLMR"
+TELEMETRY_VERSION = 1
+
+# Telemetry record: sequence number (from 1), image number, timestamp, event, then in seconds the light check,
+# the ISS position, the capture, the journal write, the requested and the actual sleep, and the resident memory in bytes
+TELEMETRY_RECORD = struct.Struct("<IIdBffffffQ")
+TELEMETRY_SLOTS = 32768
+TELEMETRY_SIZE = TELEMETRY_HEADER.size + TELEMETRY_SLOTS * TELEMETRY_RECORD.size
+
+# Records waiting for the telemetry thread, the next ones are dropped when it is full
+TELEMETRY_QUEUE_SIZE = 256
+# How many records are written between two syncs to disk
+TELEMETRY_SYNC_EVERY = 256
+
+# Telemetry events
+EVENT_DARK = 0
+EVENT_CAPTURE = 1
+EVENT_ERROR = 2
+
+TelemetryRecord = namedtuple("TelemetryRecord", ["image", "timestamp", "event", "light", "position", "capture", "journal", "sleep", "slept"])
+
 # --------------------------------------
 # VARIABLES
 # --------------------------------------
 
 # images counters
 image_counter: int = 0
-# 30 MB used by the log file
-astro_memory: float = 30e6
+# 30 MB used by the log file, and the telemetry file
+astro_memory: float = 30e6 + TELEMETRY_SIZE
 
 # Defining initial time variables to know when to stop the program
 start_time: datetime = datetime.now()
@@ -92,6 +163,14 @@ out_folder = base_folder / "out"
 out_folder.mkdir(parents=True, exist_ok=True)
 
 
+# Journal of the captures, to resume after a restart
+journal_path = base_folder / "captures.journal"
+
+
+# Ring buffer of the loop telemetry
+telemetry_path = base_folder / "telemetry.ring"
+
+
 # Timescale object for building and converting time
 timescale: Timescale = load.timescale()
 
@@ -106,6 +185,36 @@ camera.resolution = (4056, 3040)
 # FUNCTIONS
 # --------------------------------------
 
+def iss_state() -> IssState:
+    """Compute where the ISS is now and where it heads to.
+
+    The positions now and one second later are computed in one vectorised call, the heading being
+    the bearing from the first subpoint to the second one.
+
+    Return the latitude and longitude as `skyfield` Angles, the altitude in meters above the WGS84 ellipsoid,
+    and the heading in degrees clockwise from true north.
+    """
+
+    now = timescale.now()
+    position = wgs84.geographic_position_of(ISS.at(timescale.tt_jd(now.tt + HEADING_OFFSET)))
+
+    latitude, latitude_next = position.latitude.radians
+    longitude, longitude_next = position.longitude.radians
+    delta = longitude_next - longitude
+
+    heading = math.degrees(math.atan2(
+        math.sin(delta) * math.cos(latitude_next),
+        math.cos(latitude) * math.sin(latitude_next) - math.sin(latitude) * math.cos(latitude_next) * math.cos(delta),
+    )) % 360
+
+    return IssState(
+        Angle(radians=latitude),
+        Angle(radians=longitude),
+        float(position.elevation.m[0]),
+        heading,
+    )
+
+
 def light_level() -> bool:
     """Check if the light level is sufficient for the camera to take a picture.
 
@@ -145,7 +254,17 @@ def convert_time(time: datetime) -> str:
     return time.strftime("%Y:%m:%d %H:%M:%S")
 
 
-def add_metadata(lat: str, latr: str, long: str, longr: str, t: str) -> None:
+def convert_rational(value: float, denominator: int) -> str:
+    """Convert a positive number to an EXIF-appropriate rational
+    e.g. 412345.67 with a denominator of 10 to "4123457/10"
+
+    Return a string containing the converted number.
+    """
+
+    return f"{round(value * denominator)}/{denominator}"
+
+
+def add_metadata(lat: str, latr: str, long: str, longr: str, t: str, altitude: str, heading: str) -> None:
     """Add the metadata tags to the camera
     so that we know the location and can identify the
     area on a map when we analyse the images on Earth.
@@ -161,11 +280,17 @@ def add_metadata(lat: str, latr: str, long: str, longr: str, t: str) -> None:
     camera.exif_tags["GPS.GPSLongitude"] = long
     camera.exif_tags["GPS.GPSLongitudeRef"] = longr
 
+    # Altitude above sea level and ground-track heading, for the footprint of the image
+    camera.exif_tags["GPS.GPSAltitude"] = altitude
+    camera.exif_tags["GPS.GPSAltitudeRef"] = "0"
+    camera.exif_tags["GPS.GPSTrack"] = heading
+    camera.exif_tags["GPS.GPSTrackRef"] = "T"
+
     # Time
     camera.exif_tags["DateTimeOriginal"] = t
 
 
-def take_image() -> Path:
+def take_image(location: IssState) -> Path:
     """Take a picture, write metadata and return the path to the image
 
     Return the path to the image taken as a Path object.
@@ -177,21 +302,22 @@ def take_image() -> Path:
     # Define output file
     out_file = out_folder / f"img_{image_counter:04d}.jpg"
 
-    # Get location
-    location = ISS.coordinates()
+    # Location, altitude and heading
     south, exif_lat = convert_cords(location.latitude)
     west, exif_long = convert_cords(location.longitude)
     
     # Get time
     t = convert_time(now_time)
 
-    # Add location and time 
+    # Add location, time, altitude and heading
     add_metadata(
       exif_lat,
       "S" if south else "N",
       exif_long,
       "W" if west else "E",
-      t
+      t,
+      convert_rational(location.altitude, 10),
+      convert_rational(location.heading, 100)
     )
 
     # Take image
@@ -200,6 +326,200 @@ def take_image() -> Path:
     return out_file
 
 
+class CaptureJournal:
+    """Append-only journal of the captures, made of JOURNAL_RECORD_SIZE bytes records.
+
+    Attributes:
+        path (Path): The path of the journal file.
+        unsynced (int): The number of records written since the last sync to disk.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.unsynced = 0
+        self.file = None
+
+    def recover(self) -> JournalRecord:
+        """Read the last valid record of the journal, dropping a record cut by a crash.
+
+        Only the end of the file is read. Return None if there is no valid record.
+        """
+
+        if not self.path.exists():
+            return None
+
+        with open(self.path, "r+b") as f:
+            # Records are fixed-size, so the end of the last complete one is known from the file size
+            end = f.seek(0, os.SEEK_END) // JOURNAL_RECORD_SIZE * JOURNAL_RECORD_SIZE
+
+            while end > 0:
+                f.seek(end - JOURNAL_RECORD_SIZE)
+                data = f.read(JOURNAL_RECORD_SIZE)
+                fields, (crc,) = data[:JOURNAL_RECORD.size], JOURNAL_CRC.unpack(data[JOURNAL_RECORD.size:])
+
+                if zlib.crc32(fields) == crc:
+                    break
+
+                end -= JOURNAL_RECORD_SIZE
+
+            # Drop the partial or corrupted records, new ones are appended after the last valid one
+            f.truncate(end)
+
+            if end == 0:
+                return None
+
+            return JournalRecord(*JOURNAL_RECORD.unpack(fields))
+
+    def append(self, record: JournalRecord) -> None:
+        """Append a record, syncing the journal to disk every JOURNAL_SYNC_EVERY records."""
+
+        if self.file is None:
+            self.file = open(self.path, "ab")
+
+        fields = JOURNAL_RECORD.pack(*record)
+        self.file.write(fields + JOURNAL_CRC.pack(zlib.crc32(fields)))
+        self.file.flush()
+
+        self.unsynced += 1
+        if self.unsynced >= JOURNAL_SYNC_EVERY:
+            self.sync()
+
+    def sync(self) -> None:
+        """Make sure the records written so far are on disk."""
+
+        if self.file is not None and self.unsynced:
+            os.fsync(self.file.fileno())
+            self.unsynced = 0
+
+    def close(self) -> None:
+        if self.file is not None:
+            self.sync()
+            self.file.close()
+            self.file = None
+
+
+class TelemetryRing(threading.Thread):
+    """Background thread writing the loop telemetry to a fixed-size ring buffer file.
+
+    Attributes:
+        path (Path): The path of the ring buffer file.
+        sequence (int): The sequence number of the last record queued.
+        dropped (int): The number of records dropped because the queue was full.
+    """
+
+    def __init__(self, path: Path) -> None:
+        super().__init__(daemon=True)
+        self.path = path
+        self.records = queue.Queue(maxsize=TELEMETRY_QUEUE_SIZE)
+        self.dropped = 0
+        self.page_size = os.sysconf("SC_PAGE_SIZE")
+
+        # Keep the records of a previous run, numbering the new ones after them
+        self.sequence = self.last_sequence()
+        if self.sequence == 0:
+            with open(self.path, "wb") as f:
+                f.write(TELEMETRY_HEADER.pack(TELEMETRY_MAGIC, TELEMETRY_VERSION, TELEMETRY_RECORD.size, TELEMETRY_SLOTS))
+                f.truncate(TELEMETRY_SIZE)
+
+        self.fd = os.open(self.path, os.O_WRONLY)
+
+    def last_sequence(self) -> int:
+        """Return the highest sequence number of the file, 0 if it does not exist or has another layout."""
+
+        if not self.path.exists() or self.path.stat().st_size != TELEMETRY_SIZE:
+            return 0
+
+        with open(self.path, "rb") as f:
+            data = f.read()
+
+        if data[:TELEMETRY_HEADER.size] != TELEMETRY_HEADER.pack(TELEMETRY_MAGIC, TELEMETRY_VERSION, TELEMETRY_RECORD.size, TELEMETRY_SLOTS):
+            return 0
+
+        # The sequence number is the first field of each record
+        records = np.dtype([("sequence", "<u4"), ("fields", f"V{TELEMETRY_RECORD.size - 4}")])
+        return int(np.frombuffer(data, dtype=records, offset=TELEMETRY_HEADER.size)["sequence"].max())
+
+    def record(self, record: TelemetryRecord) -> None:
+        """Queue a record without blocking, dropping it if the thread is behind."""
+
+        try:
+            self.records.put_nowait((self.sequence + 1, record))
+            self.sequence += 1
+        except queue.Full:
+            self.dropped += 1
+
+    def rss(self) -> int:
+        """Return the resident memory of the program in bytes."""
+
+        with open("/proc/self/statm", "rb") as f:
+            return int(f.read().split()[1]) * self.page_size
+
+    def run(self) -> None:
+        unsynced = 0
+        while True:
+            item = self.records.get()
+            if item is None:
+                break
+
+            sequence, record = item
+            offset = TELEMETRY_HEADER.size + (sequence - 1) % TELEMETRY_SLOTS * TELEMETRY_RECORD.size
+            os.pwrite(self.fd, TELEMETRY_RECORD.pack(sequence, *record, self.rss()), offset)
+
+            unsynced += 1
+            if unsynced >= TELEMETRY_SYNC_EVERY:
+                os.fsync(self.fd)
+                unsynced = 0
+
+    def close(self) -> None:
+        """Write the queued records and close the file."""
+
+        self.records.put(None)
+        self.join()
+        os.fsync(self.fd)
+        os.close(self.fd)
+
+
+def pause(seconds: float, timings: dict) -> None:
+    """Suspend the execution of the program, recording the requested and the actual sleep in the timings."""
+
+    start = perf_counter()
+    sleep(seconds)
+    timings["sleep"] = seconds
+    timings["slept"] = perf_counter() - start
+
+
+def resume(journal: CaptureJournal) -> None:
+    """Recover the image counter, the filled storage and the start time of a previous run from the journal."""
+
+    global image_counter
+    global astro_memory
+    global start_time
+
+    last = journal.recover()
+    if last is not None:
+        image_counter = last.image + 1
+        astro_memory = last.storage
+        start_time = datetime.now() - timedelta(seconds=last.elapsed)
+
+    # Images taken after the last record that reached the disk, probing the next names only, past the numbers
+    # skipped by errors
+    missing = 0
+    number = image_counter
+    while missing <= RESUME_MAX_GAP:
+        out_file = out_folder / f"img_{number:04d}.jpg"
+        number += 1
+        if not out_file.exists():
+            missing += 1
+            continue
+
+        astro_memory += out_file.stat().st_size + JOURNAL_RECORD_SIZE
+        image_counter = number
+        missing = 0
+
+    if last is not None or image_counter > 0:
+        logger.info(f"Resumed at image {image_counter} with {astro_memory:.0f} bytes used and {datetime.now() - start_time} elapsed")
+
+
 # --------------------------------------
 # ENTRY
 # --------------------------------------
@@ -207,6 +527,14 @@ def take_image() -> Path:
 if __name__ == "__main__":
 
     logger.info("Started")
+
+    # Continue a previous run instead of overwriting its images
+    journal = CaptureJournal(journal_path)
+    resume(journal)
+
+    # Record the timings of each iteration in the background
+    telemetry = TelemetryRing(telemetry_path)
+    telemetry.start()
     
     # Run until the program exceeds the specified RUN_TIME
     while now_time - start_time < RUN_TIME:
@@ -219,40 +547,80 @@ if __name__ == "__main__":
             logger.error(f"Storage limit reached with {image_counter} images")
             break
 
+        # Timings of the iteration in seconds, for the telemetry
+        timings = dict.fromkeys(["light", "position", "capture", "journal", "sleep", "slept"], 0.0)
+        event = EVENT_CAPTURE
+        image = image_counter
+
         # Ensure errors don't break anything
         try:
             # Check if the light level is sufficient
-            if light_level() == False:
+            start = perf_counter()
+            sunlit = light_level()
+            timings["light"] = perf_counter() - start
+
+            if sunlit == False:
                 # Suspend the program execution
-                sleep(2)
+                event = EVENT_DARK
+                pause(2, timings)
                 continue
 
+            # Get location, altitude and heading
+            start = perf_counter()
+            location = iss_state()
+            timings["position"] = perf_counter() - start
+
             # Take picture
-            path: Path = take_image()
+            start = perf_counter()
+            path = take_image(location)
+            size = path.stat().st_size
+            timings["capture"] = perf_counter() - start
+
+            # Update the astro_memory variable representing the filled storage, journal record included
+            astro_memory += size + JOURNAL_RECORD_SIZE
+
+            # Record the capture to resume from it after a restart
+            start = perf_counter()
+            journal.append(JournalRecord(
+                image_counter,
+                size,
+                now_time.timestamp(),
+                location.latitude.degrees,
+                location.longitude.degrees,
+                int(astro_memory),
+                (now_time - start_time).total_seconds(),
+            ))
+            timings["journal"] = perf_counter() - start
 
             # Increase image counter
             image_counter += 1
-            
-            # Update the astro_memory variable representing the filled storage
-            astro_memory += path.stat().st_size
 
             # Sleep to decrease memory usage over time
-            sleep(5)
+            pause(5, timings)
 
         except Exception as e:
             # Log the exception/error to the log file
             logger.exception(e)
             
             # Suspend the program execution to recover from the exception/error
-            sleep(1)
+            event = EVENT_ERROR
+            pause(1, timings)
             
             # Make the occurence of the exception/error obvious
             image_counter += 2
 
+        finally:
+            telemetry.record(TelemetryRecord(image, now_time.timestamp(), event, **timings))
+
     logger.info(f"execution completed with {image_counter} images")
 
-    # Ensure the camera is correctly closed
+    if telemetry.dropped:
+        logger.warning(f"{telemetry.dropped} telemetry records dropped")
+
+    # Ensure the camera, the journal and the telemetry are correctly closed
     camera.close()
+    journal.close()
+    telemetry.close()
 
     """
      ____  _                ____             
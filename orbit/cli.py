@@ -0,0 +1,87 @@
+"""
+ORBIT COMMAND LINE
+
+A single entry point for the programs run on Earth:
+    python3 cli.py filter <path> [--watch]
+    python3 cli.py analyse <path> [historic NDVI rasters path]
+    python3 cli.py boxes <path>
+    python3 cli.py extract <path/to/image or folder> [output name]
+    python3 cli.py render <path> <out> [--scale SCALE] [--workers WORKERS]
+    python3 cli.py charts <results> <out> [--workers WORKERS]
+    python3 cli.py sweep <path> [--grid GRID] [--labels LABELS] [--stats STATS] [--out OUT]
+    python3 cli.py queue {enqueue,work,status,merge} <db> ...
+    python3 cli.py catalog [--db DB] {ingest,query} ...
+    python3 cli.py telemetry <telemetry.ring> [--timeline TIMELINE]
+    python3 cli.py vignette <path> [--out OUT] [--sample SAMPLE] [--preview PREVIEW]
+    python3 cli.py pipeline <path> [--json YEAR=PATH ...] [--rasters YEAR=FOLDER ...] [--tiles] [--out OUT]
+
+Each subcommand is the main function of an existing program, whose module is only imported
+when the subcommand is run, so that OpenCV, NumPy or requests are never loaded for nothing.
+"""
+
+import sys
+import importlib
+from pathlib import Path
+
+# --------------------------------------
+# CONSTANTS
+# --------------------------------------
+
+# Resolve absolute path to the current code directory
+base_folder: Path = Path(__file__).parent.resolve()
+
+# Module and description of each subcommand, the module is relative to base_folder
+COMMANDS = {
+    "filter": ("filter", "filter the images to ensure data quality"),
+    "analyse": ("main", "calculate the NDVI and VCI of the selected images"),
+    "boxes": ("utils.bounding_box", "calculate the bounding boxes of the ROIs"),
+    "extract": ("extract", "extract the coordinates of an image or the ground track of a folder"),
+    "render": ("graphs.ndvi_render", "render the colour-mapped NDVI images of a folder"),
+    "charts": ("graphs.charts", "render the NDVI evolution and VCI charts of every ROI"),
+    "sweep": ("utils.sweep", "evaluate grids of filter thresholds against labelled images"),
+    "queue": ("utils.workqueue", "spread filter or analyse over worker processes and hosts"),
+    "catalog": ("utils.catalog", "ingest image metadata once and query images by time and area"),
+    "telemetry": ("utils.telemetry", "summarise the loop telemetry recorded aboard the ISS"),
+    "vignette": ("utils.vignette", "estimate the porthole valid region of the frames of a mission"),
+    "pipeline": ("pipeline", "filter the images and calculate their NDVI and VCI in a single pass"),
+}
+
+# --------------------------------------
+# LIB
+# --------------------------------------
+
+def load(command: str):
+    """Import the module of a subcommand."""
+    module_name = COMMANDS[command][0]
+
+    # Scripts of a folder import their siblings directly
+    module_dir = base_folder.joinpath(*module_name.split(".")[:-1])
+    for folder in (base_folder, module_dir):
+        if str(folder) not in sys.path:
+            sys.path.insert(0, str(folder))
+
+    return importlib.import_module(module_name)
+
+
+def usage() -> None:
+    print("Usage: python3 cli.py <command> [arguments]")
+    print()
+    for command, (_, description) in COMMANDS.items():
+        print(f"  {command:<11}{description}")
+
+
+def main(argc, argv):
+    # check arguments
+    if argc < 2 or argv[1] not in COMMANDS:
+        usage()
+        sys.exit(1)
+
+    command = argv[1]
+    module = load(command)
+
+    # The program sees its own name as argv[0]
+    module.main(argc - 1, [f"cli.py {command}"] + argv[2:argc])
+
+
+if __name__ == "__main__":
+    main(len(sys.argv), sys.argv)
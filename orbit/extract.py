@@ -1,5 +1,6 @@
 import sys
 from os import path
+from pathlib import Path
 from exif import Image
 
 def decimal_coords(coords, ref):
@@ -8,16 +9,34 @@ def decimal_coords(coords, ref):
         decimal_degrees = -decimal_degrees
     return decimal_degrees
 
+def export_track(folder: Path, out: Path):
+    """Write the ground track of all the images of a folder to <out>.csv and <out>.geojson"""
+    from utils.track import ground_track, write_csv, write_geojson  # NumPy and PIL are only needed in bulk mode
+
+    track = ground_track(sorted(folder.glob("*.jpg")))
+
+    write_csv(track, out.with_suffix(".csv"))
+    write_geojson(track, out.with_suffix(".geojson"))
+
+    print(f'Exported {len(track["path"])} frames to {out.with_suffix(".csv")} and {out.with_suffix(".geojson")}')
+
+
 def main(argc : int, argv : list[str]):
     # check arguments
-    if argc != 2:
+    if argc not in (2, 3):
         print("Usage: python3 extract.py <path/to/image>")
+        print("       python3 extract.py <path/to/folder> [output name, default ground_track]")
         return
     
     # check if the file exists
     if(not path.exists(argv[1])):
         print("File does not exist")
         return
+
+    # bulk mode: ground track of a whole folder
+    if path.isdir(argv[1]):
+        export_track(Path(argv[1]), Path(argv[2] if argc == 3 else "ground_track"))
+        return
     
     # extract exif data
     with open(argv[1], 'rb') as src:
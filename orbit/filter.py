@@ -4,13 +4,22 @@
 
 from pathlib import Path  # Path utilities
 import sys # System-specific parameters and functions
+import time # Latency measurement
 import shutil # High-level file operations
 
 from logzero import logger, logfile  # Debug purposes
 from datetime import datetime, timedelta  # Time recognition
 from utils.gsd import gsd # Ground sampling distance
 from utils.ndvi import ndvi, mean_ndvi # Normalized Difference Vegetation Index
-from utils.classifiers import OtsuThresholdClassifier, ThresholdClassifier, NDVIClassifier, DarkImageClassifier # Classifiers
+from utils.classifiers import OtsuThresholdClassifier, ThresholdClassifier, NDVIClassifier, DarkImageClassifier, DuplicateClassifier, SunElevationClassifier, TileClassifier # Classifiers
+from utils.masks import CLOUD # Bit-packed masks
+from utils.watch import FolderWatcher # Watch a folder for new images
+from utils.manifest import Manifest, LINK, SYMLINK, COPY, new_record, append_record # Hand-off between stages
+from utils.stages import Stage, order_stages, expected_cost # Ordering of the stages
+from utils.catalog import Catalog # Measurements shared with the other tools
+from utils.vignette import ValidRegion, estimate_region, region_path # Porthole valid region
+from utils.sampling import RANDOM, STRATIFIED # Sampled percentage estimates
+from utils.tiles import tiles_path # Tile grids
 
 # --------------------------------------
 # CONSTANTS
@@ -22,11 +31,22 @@ FOCAL_LENGTH = 4.735  # mm
 IMAGE_WIDTH = 4056  # pixels
 IMAGE_HEIGHT = 3040  # pixels
 
+DUPLICATE_DISTANCE = 4
 DARK_THRESHOLD = 30
+NIGHT_ELEVATION = -6 # degrees, Sun elevation under which the ground is too dark
+DAY_ELEVATION = 10 # degrees, Sun elevation over which the dark check is skipped
 THRESHOLD = 26
 PIXEL_THRESHOLD = 0.76
 NDVI_RANGE = [-1, 0.1]
 NDVI_THRESHOLD = 32.2
+NDVI_EXCLUDE = [] # Stored masks left out of the sea coverage, e.g. [CLOUD]
+SAMPLING = None # RANDOM or STRATIFIED to reject cloudy and sea images from sampled blocks of pixels, None to count them all
+
+TILE_MODE = False # Judge each tile instead of the whole image, keeping the usable part of partly cloudy images
+MIN_VALID_TILES = 30 # Minimum percentage of the image covered by usable tiles in TILE_MODE
+TILE_ARGS = (DARK_THRESHOLD, PIXEL_THRESHOLD, THRESHOLD, NDVI_RANGE, NDVI_THRESHOLD, MIN_VALID_TILES)
+
+SELECTION_MODE = LINK # How the selected images appear in out/selected: LINK, SYMLINK or COPY
 
 # --------------------------------------
 # VARIABLES
@@ -40,17 +60,166 @@ base_folder: Path = Path(__file__).parent.resolve()
 
 # Define output folder for images
 out_folder = base_folder / "out"
-shutil.rmtree(out_folder, ignore_errors=True)
+
+# Define output folder for cloud and water masks, kept between runs
+masks_folder = base_folder / "masks"
 
 # Set log file
 logfile(base_folder / "filter.log", backupCount=0, maxBytes=30e6)
 
+def record_measurements(record: dict) -> dict:
+    """The numeric verdicts of a manifest record and whether the image was selected, as catalog measurements."""
+    measurements = {name: value for name, value in record["verdicts"].items() if isinstance(value, (int, float))}
+    measurements["selected"] = record["selected"]
+    return measurements
+
+
+def mission_region(path: Path, frames: list = None) -> ValidRegion:
+    """The valid region of the frames of a folder, estimated from a sample of the given frames taken by day and
+    stored with the masks of the folder the first time, night frames being dark everywhere.
+
+    Return None if the region of the folder is not stored and no frame is given or could be decoded.
+    """
+    stored = region_path(masks_folder, path)
+    region = ValidRegion.load(stored)
+
+    if region is None and frames:
+        region = estimate_region(frames)
+        if region is not None:
+            region.save(stored)
+            logger.info(f"Estimated the valid region from {path}: {region.count / (region.shape[0] * region.shape[1]):.1%} of the pixels")
+
+    return region
+
+
+def image_stages(path, region: ValidRegion = None) -> list:
+    """The classifiers judging each image on its own, with their parameters, in the order they are applied."""
+    if TILE_MODE:
+        return [(TileClassifier(path, None, masks_folder, region=region), TILE_ARGS)]
+
+    return [
+        (DarkImageClassifier(path, None, region=region), (DARK_THRESHOLD,)),
+        (ThresholdClassifier(path, None, masks_folder, region=region, sampling=SAMPLING), (PIXEL_THRESHOLD, THRESHOLD)),
+        (NDVIClassifier(path, None, masks_folder, NDVI_EXCLUDE, region=region, sampling=SAMPLING), (NDVI_RANGE, NDVI_THRESHOLD)),
+    ]
+
+
+def classify_image(stages: list, image_path: Path, image, elevation: float = None) -> dict:
+    """Classify a decoded image, stopping at the first stage rejecting it, and return its manifest record.
+
+    The dark stage is skipped for images taken with the Sun over DAY_ELEVATION.
+    """
+    record = new_record(image_path)
+    record["selected"] = image is not None
+
+    if elevation is not None:
+        record["verdicts"][SunElevationClassifier.name] = elevation
+        if elevation >= DAY_ELEVATION:
+            stages = [(classifier, args) for classifier, args in stages if classifier.name != DarkImageClassifier.name]
+
+    for classifier, args in stages:
+        if not record["selected"]:
+            break
+        keep, value = classifier.classify(image_path, image, *args)
+        record["verdicts"][classifier.name] = float(value)
+        record["selected"] = bool(keep)
+
+    return record
+
+
+def queue_task():
+    """The work of the filter on each image for the workers of utils/workqueue.py, whose results are manifest records.
+
+    Near-duplicates are not removed, as that needs all the images at once. Each image is judged with the stored
+    valid region of its folder.
+    """
+    stages = {}
+
+    def classify(image_path, image):
+        folder = Path(image_path).parent
+        if folder not in stages:
+            stages[folder] = image_stages(None, mission_region(folder))
+        return classify_image(stages[folder], image_path, image)
+
+    return classify
+
+
+def watch(path: Path):
+    """Classify each image written into path as soon as it is complete, until interrupted.
+
+    The verdicts are appended to out/manifest.jsonl, one record per image with the value each stage
+    judged it on and the latency between its detection and its verdict, and selected images are linked
+    into out/selected. Images already in the manifest are skipped, so the daemon can be restarted.
+    """
+    selected_out = out_folder / "selected"
+    manifest_path = out_folder / "manifest.jsonl"
+    out_folder.mkdir(parents=True, exist_ok=True)
+
+    # Resume from the images already classified
+    classified = Manifest.load(manifest_path)
+
+    catalog = Catalog()
+    sun_cls = SunElevationClassifier(path, catalog)
+
+    # Porthole of the frames already there taken by day, shared with the analysis of the selected images
+    frames = sorted(path.glob("*.jpg"))
+    region = mission_region(path, [frame for frame, elevation in zip(frames, sun_cls.elevations(frames)) if elevation is None or elevation >= NIGHT_ELEVATION])
+    if region is not None:
+        region.save(region_path(masks_folder, selected_out))
+    stages = image_stages(path, region)
+
+    watcher = FolderWatcher(path)
+    logger.info(f"Watching {path} {'with inotify' if watcher.use_inotify else 'by polling'}, {len(classified)} images already classified")
+
+    latencies = []
+    with open(manifest_path, "a") as manifest:
+        try:
+            for image_path, detected in watcher:
+                if image_path in classified:
+                    continue
+
+                # Night images are removed without being decoded
+                elevation = sun_cls.elevations([image_path])[0]
+                if elevation is not None and elevation < NIGHT_ELEVATION:
+                    record = new_record(image_path)
+                    record["verdicts"][sun_cls.name] = elevation
+                    record["selected"] = False
+                else:
+                    # Decode once and stop at the first stage rejecting the image
+                    image = stages[0][0].read(image_path)
+                    record = classify_image(stages, image_path, image, elevation)
+
+                    # A grid left by an earlier tile-mode run would restrict the analysis of a whole-frame verdict
+                    if not TILE_MODE:
+                        tiles_path(masks_folder, image_path).unlink(missing_ok=True)
+
+                if record["selected"]:
+                    Manifest([record]).materialise(selected_out, SELECTION_MODE)
+
+                record["latency"] = time.monotonic() - detected
+                append_record(manifest, record)
+                catalog.set_measurements({record["path"]: record_measurements(record)})
+
+                classified.records[record["path"]] = record
+                latencies.append(record["latency"])
+                logger.info(f"{image_path.name}: {'selected' if record['selected'] else 'removed'} {record['verdicts']} in {record['latency']:.3f}s")
+
+        except KeyboardInterrupt:
+            watcher.close()
+
+    catalog.close()
+
+    if latencies:
+        latencies.sort()
+        logger.info(f"Classified {len(latencies)} images, latency median {latencies[len(latencies) // 2]:.3f}s, max {latencies[-1]:.3f}s")
+
+
 # entry point
 def main(argc, argv):
 
     # Check command-line arguments
-    if argc != 2:
-        logger.error("Usage: orbit <path>")
+    if argc not in (2, 3) or (argc == 3 and argv[2] != "--watch"):
+        logger.error("Usage: orbit <path> [--watch]")
         sys.exit(1)
     
     # Get the path to the folder containing the images
@@ -61,44 +230,84 @@ def main(argc, argv):
         logger.error("Path not found")
         sys.exit(1)
 
-    image_counter = len(list(path.glob("*.jpg")))
+    # Daemon mode: keep the previous results and classify new images as they arrive
+    if argc == 3:
+        watch(path)
+        return
+
+    # Batch mode: start from scratch, masks computed by earlier runs with other thresholds included
+    shutil.rmtree(out_folder, ignore_errors=True)
+    shutil.rmtree(masks_folder, ignore_errors=True)
+    out_folder.mkdir(parents=True, exist_ok=True)
+
+    manifest = Manifest.from_folder(path)
+    image_counter = len(manifest)
     logger.info(f"Found {image_counter} images")
-    
+
     # IMAGE PROCESSING
-    # 1) Remove black pictures
-    dark_out = out_folder / "dark_out"
-    dark_out.mkdir(parents=True, exist_ok=True)
+    # Each stage only looks at the images kept by the previous one, through the manifest
+    # 0) Keep one image out of each group of near-duplicate frames
+    unique_cls = DuplicateClassifier(manifest)
+    unique = unique_cls.start(DUPLICATE_DISTANCE, out_folder / "duplicates.json")
+
+    logger.info(f"Skipped {image_counter - len(unique) - len(unique_cls.unreadable)} near-duplicate and {len(unique_cls.unreadable)} unreadable images")
+    image_counter = len(unique)
+
+    # 1) Remove night pictures from the elevation of the Sun at their time and position, without decoding them,
+    # then black pictures among the twilight ones only
+    catalog = Catalog()
+    sun_cls = SunElevationClassifier(unique, catalog)
+    lit = sun_cls.start(NIGHT_ELEVATION, DAY_ELEVATION)
+
+    logger.info(f"Removed {image_counter - len(lit)} night images, {len(sun_cls.twilight)} left to the dark check")
+
+    # Pixels outside the porthole are left out of every following stage, estimated from the images taken by day
+    region = mission_region(path, list(lit))
 
-    dark_cls = DarkImageClassifier(path, dark_out)
-    dark_cls.start(DARK_THRESHOLD)
+    if TILE_MODE:
+        # 2) Judge each tile for dark, cloud and sea coverage and keep the images with enough usable tiles
+        daylight = lit
+        image_counter = len(lit)
+        stages = [Stage(TileClassifier(None, None, masks_folder, region=region), TILE_ARGS, "unusable")]
+    else:
+        Stage(DarkImageClassifier(None, region=region), (DARK_THRESHOLD,), "dark").run(sun_cls.twilight)
+        daylight = lit.selected()
 
-    filtered = len(list(dark_out.glob("*.jpg")))
-    logger.info(f"Removed {image_counter - filtered} dark images")
-    image_counter = filtered
+        logger.info(f"Removed {len(lit) - len(daylight)} dark images")
+        image_counter = len(daylight)
 
-    # 2) Remove images with cloud coverage through Thresholding
-    threshold_out = out_folder / "threshold_out"
-    threshold_out.mkdir(parents=True, exist_ok=True)
+        # 2) Remove images with cloud coverage through Thresholding
+        # 3) Remove images with sea coverage through NDVI
+        # The order does not change the selection, so the stages rejecting the most images
+        # per second spent are run first, measured on a sample
+        stages = [
+            Stage(ThresholdClassifier(None, None, masks_folder, region=region, sampling=SAMPLING), (PIXEL_THRESHOLD, THRESHOLD), "cloudy"),
+            Stage(NDVIClassifier(None, None, masks_folder, NDVI_EXCLUDE, region=region, sampling=SAMPLING), (NDVI_RANGE, NDVI_THRESHOLD), "sea"),
+        ]
+        stages = order_stages(stages, list(daylight))
 
-    threshold_cls = ThresholdClassifier(dark_out, threshold_out)
-    threshold_cls.start(PIXEL_THRESHOLD, THRESHOLD)
+    if stages[0].cost is not None:
+        for stage in stages:
+            logger.info(f"Stage {stage.label}: {stage.cost:.3f}s per image, {stage.rejection:.0%} rejected")
+        logger.info(f"Expected {expected_cost(stages):.3f}s per image")
 
-    filtered = len(list(threshold_out.glob("*.jpg")))
-    logger.info(f"Removed {image_counter - filtered} cloudy images")
-    image_counter = filtered
-    shutil.rmtree(dark_out, ignore_errors=True)
+    selected = daylight
+    for stage in stages:
+        kept = stage.run(selected)
 
-    # 3) Remove images with sea coverage through NDVI
-    ndvi_out = out_folder / "ndvi_out"
-    ndvi_out.mkdir(parents=True, exist_ok=True)
+        logger.info(f"Removed {image_counter - len(kept)} {stage.label} images")
+        image_counter = len(kept)
+        selected = kept
 
-    ndvi_cls = NDVIClassifier(threshold_out, ndvi_out)
-    ndvi_cls.start(NDVI_RANGE, NDVI_THRESHOLD)
+    # Save the verdicts of every image and materialise only the final selection
+    manifest.save(out_folder / "manifest.jsonl")
+    selected.materialise(out_folder / "selected", SELECTION_MODE)
+    if region is not None:
+        region.save(region_path(masks_folder, out_folder / "selected"))
 
-    filtered = len(list(ndvi_out.glob("*.jpg")))
-    logger.info(f"Removed {image_counter - filtered} sea images")
-    image_counter = filtered
-    shutil.rmtree(threshold_out, ignore_errors=True)
+    catalog.ingest(list(manifest))
+    catalog.set_measurements({record["path"]: record_measurements(record) for record in manifest.records.values()})
+    catalog.close()
     
     logger.info(f"execution completed in {(datetime.now() - start_time)}, with {image_counter} images")
 
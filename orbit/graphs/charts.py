@@ -0,0 +1,228 @@
+"""
+BATCH CHARTS
+
+Render the NDVI evolution and the VCI chart of every ROI of the results written by main.py,
+headless with the Agg backend and in parallel.
+
+Building and laying out a figure costs far more than drawing a few lines on it, so each worker process
+builds the two figures once, keeps their static background rendered, and for every ROI only restores it
+and draws the values, labels and title that change.
+"""
+
+import sys
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+from utils.results import load_results, load_columns
+
+# --------------------------------------
+# CONSTANTS
+# --------------------------------------
+
+# Year of the images taken aboard the ISS, the last point of the NDVI evolution
+LATEST_YEAR = 2023
+
+LINE_COLOR = "#0173b2"
+MEAN_COLOR = "#fbbb04"
+BACKGROUND_COLOR = "#e6f2ff"
+
+VALUE = ["90-100%", "80-90%", "70-80%", "60-70%", "50-60%", "40-50%", "30-40%", "20-30%", "10-20%", "0-10%"]
+CATEGORY = ["No drought", "No drought", "No drought", "No drought", "No drought", "No drought", "Light drought", "Moderate drought", "Severe drought", "Extreme drought"]
+GREEN_TO_RED_COLOR = ["#027148", "#027148", "#027148", "#027148", "#027148", "#027148", "#FFA500", "#FFA500", "#FF0000", "#FF0000"]
+
+DPI = 100
+PNG_COMPRESSION = 1  # zlib level, the default 6 takes longer than drawing the chart
+CHUNK_SIZE = 16
+
+# --------------------------------------
+# LIB
+# --------------------------------------
+
+def read_results(path: Path) -> tuple:
+    """Read the results written by main.py with the loaders of utils/results.py, from the .ndjson file or the
+    columnar .npz or .parquet one.
+
+    Returns:
+        tuple: The historic years, and a (path, NDVI values over the years, VCI) tuple per ROI, None and NaN when unknown.
+    """
+    if path.suffix == ".ndjson":
+        records = load_results(path)
+        years = [int(year) for year in records[0]["historic"]] if records else []
+        values = [[record["historic"].get(str(year)) for year in years] + [record["latest_ndvi"]] for record in records]
+        return years, [(record["path"], np.array(ndvi, dtype=np.float64), record["vci"]) for record, ndvi in zip(records, values)]
+
+    columns = load_columns(path)
+    values = np.column_stack([columns["historic"], columns["latest_ndvi"]])
+    return [int(year) for year in columns["years"]], list(zip(columns["path"].tolist(), values, columns["vci"].tolist()))
+
+
+def save_canvas(canvas: FigureCanvasAgg, out_file: Path) -> None:
+    """Save what is drawn on a canvas as PNG, favouring speed over size."""
+    Image.fromarray(np.asarray(canvas.buffer_rgba())).save(out_file, compress_level=PNG_COMPRESSION)
+
+
+class NDVIEvolutionChart:
+    """Line chart of the NDVI of a ROI over the years.
+
+    Everything but the values is drawn once, all the charts sharing the same axes so that they can be compared,
+    then the background is restored and only the line, the mean and the labels are drawn for each ROI.
+    """
+
+    def __init__(self, years: list, ylim: tuple) -> None:
+        labels = [f"{year}/04" for year in years + [LATEST_YEAR]]
+        self.x = np.arange(len(labels))
+
+        self.figure = Figure(figsize=(8, 6), dpi=DPI)
+        self.canvas = FigureCanvasAgg(self.figure)
+        ax = self.figure.add_subplot()
+        self.ax = ax
+
+        # Animated artists are left out of the background
+        self.line, = ax.plot(self.x, np.zeros(len(self.x)), marker="o", color=LINE_COLOR, animated=True)
+        self.mean_line = ax.axhline(y=0, color=MEAN_COLOR, linestyle="--", label="Mean NDVI", animated=True)
+        self.labels = [ax.text(x, 0, "", ha="center", va="bottom", animated=True) for x in self.x]
+        ax.axhline(y=0.5, color="gray", linestyle="--", alpha=0.7)
+
+        ax.set_xticks(self.x, labels)
+        ax.set_xlim(self.x[0], self.x[-1])
+        ax.set_ylim(*ylim)
+        ax.set_xlabel("Year", fontsize=12)
+        ax.set_ylabel("NDVI Value", fontsize=12)
+        ax.set_title("NDVI Evolution", fontsize=14)
+        ax.set_facecolor(BACKGROUND_COLOR)
+        ax.grid(color="white")
+        ax.legend()
+        self.figure.tight_layout()
+
+        self.canvas.draw()
+        self.background = self.canvas.copy_from_bbox(self.figure.bbox)
+
+    def render(self, values: np.ndarray, out_file: Path) -> None:
+        """Draw the NDVI values of a ROI, NaN for unknown years, and save the chart."""
+        known = ~np.isnan(values)
+        self.canvas.restore_region(self.background)
+
+        self.line.set_ydata(values)
+        self.mean_line.set_ydata([np.mean(values[known])] * 2)
+        self.ax.draw_artist(self.line)
+        self.ax.draw_artist(self.mean_line)
+
+        for label, x, value in zip(self.labels, self.x[known], values[known]):
+            label.set_position((x, value))
+            label.set_text(f"{value:.2f}")
+            self.ax.draw_artist(label)
+
+        save_canvas(self.canvas, out_file)
+
+
+class VCIChart:
+    """Table of the VCI categories titled with the VCI of a ROI, whose category is outlined.
+
+    The table is drawn once, then the background is restored and only the title and the outlined row are drawn for each ROI.
+    """
+
+    def __init__(self) -> None:
+        self.figure = Figure(figsize=(8, 6), dpi=DPI)
+        self.canvas = FigureCanvasAgg(self.figure)
+        ax = self.figure.add_subplot()
+        ax.axis("off")
+
+        self.table = ax.table(
+            cellText=list(zip(VALUE, CATEGORY)),
+            colLabels=["Value", "Category"],
+            colWidths=[0.3, 0.7],
+            cellColours=[["azure", color] for color in GREEN_TO_RED_COLOR],
+            colColours=["azure", "azure"],
+            cellLoc="center",
+            loc="center",
+        )
+        self.table.scale(1, 2)
+        for row in range(len(VALUE)):
+            self.table[row + 1, 1].get_text().set_color("white")
+
+        self.title = ax.set_title("", fontsize=16, fontweight="bold", animated=True)
+
+        self.canvas.draw()
+        self.background = self.canvas.copy_from_bbox(self.figure.bbox)
+
+    def render(self, vci: float, out_file: Path) -> None:
+        """Draw the VCI of a ROI, None or NaN when unknown, and save the chart."""
+        self.canvas.restore_region(self.background)
+        renderer = self.canvas.get_renderer()
+
+        if vci is None or np.isnan(vci):
+            self.title.set_text("Vegetation Condition Index (VCI=n/a)")
+        else:
+            self.title.set_text(f"Vegetation Condition Index (VCI={vci:.2f}%)")
+
+            # Outline the category of the VCI, drawing its cells again with a thicker edge
+            row = len(VALUE) - min(int(vci // 10), len(VALUE) - 1)
+            for cell in (self.table[row, 0], self.table[row, 1]):
+                cell.set_linewidth(3)
+                cell.draw(renderer)
+                cell.set_linewidth(1)
+
+        self.title.draw(renderer)
+        save_canvas(self.canvas, out_file)
+
+
+# Charts of the current worker process
+charts = {}
+
+
+def init_worker(years: list, ylim: tuple) -> None:
+    """Build the chart templates once per worker process."""
+    charts["ndvi"] = NDVIEvolutionChart(years, ylim)
+    charts["vci"] = VCIChart()
+
+
+def render_roi(roi: tuple, out_dir: Path) -> Path:
+    """Render the charts of a ROI as <name>_ndvi.png and <name>_vci.png, return the stem of the files."""
+    path, values, vci = roi
+    stem = out_dir / Path(path).stem
+
+    if np.any(~np.isnan(values)):
+        charts["ndvi"].render(values, stem.with_name(f"{stem.name}_ndvi.png"))
+    charts["vci"].render(vci, stem.with_name(f"{stem.name}_vci.png"))
+
+    return stem
+
+
+def render_results(results_path: Path, out_dir: Path, workers: int = None) -> int:
+    """Render the charts of every ROI of a result file in a process pool, return the number of ROIs."""
+    years, rois = read_results(results_path)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    # NDVI axes shared by all the charts
+    values = np.concatenate([roi[1] for roi in rois]) if rois else np.zeros(1)
+    ylim = (np.nanmin(values) - 0.1, np.nanmax(values) + 0.1)
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(years, ylim)) as executor:
+        rendered = list(executor.map(render_roi, rois, [out_dir] * len(rois), chunksize=CHUNK_SIZE))
+
+    return len(rendered)
+
+
+def main(argc, argv):
+    parser = argparse.ArgumentParser(prog="charts.py", description="Render the NDVI evolution and VCI charts of every ROI")
+    parser.add_argument("results", type=Path, help="main_results.ndjson, .npz or .parquet written by main.py")
+    parser.add_argument("out", type=Path, help="output folder")
+    parser.add_argument("--workers", type=int, default=None, help="number of processes")
+    args = parser.parse_args(argv[1:argc])
+
+    # Check if the path exists
+    if not args.results.exists():
+        print("Results not found")
+        sys.exit(1)
+
+    print(f"Rendered the charts of {render_results(args.results, args.out, args.workers)} ROIs")
+
+
+if __name__ == "__main__":
+    main(len(sys.argv), sys.argv)
@@ -0,0 +1,201 @@
+"""
+BATCH NDVI RENDERER
+
+Render fastiecm colour-mapped NDVI images for a whole folder, headless and in parallel.
+
+Every step works on uint8 data through lookup tables: NDVI only depends on the (blue, red)
+pair of a pixel, so both contrast stretches and the colour map are folded into a single
+65536-entry table indexed by `blue << 8 | red`. Percentiles come from histograms instead of
+sorting float copies of the frame.
+"""
+
+import sys
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from pathlib import Path
+
+import cv2
+import numpy as np
+from fastiecm import fastiecm
+
+# --------------------------------------
+# CONSTANTS
+# --------------------------------------
+
+LOW_PERCENTILE = 5
+HIGH_PERCENTILE = 95
+
+# Scales that libjpeg can produce directly while decoding
+REDUCED_READ_FLAGS = {
+    0.5: cv2.IMREAD_REDUCED_COLOR_2,
+    0.25: cv2.IMREAD_REDUCED_COLOR_4,
+    0.125: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+FASTIECM_LUT = fastiecm.reshape(256, 3)
+
+# --------------------------------------
+# FUNCTIONS
+# --------------------------------------
+
+def weighted_percentile(values: np.ndarray, counts: np.ndarray, percentile: float) -> float:
+    """Compute a percentile from a histogram, matching `np.percentile` with linear interpolation.
+
+    Args:
+        values (np.ndarray): the sorted values of the histogram bins.
+        counts (np.ndarray): how many samples fall in each bin.
+        percentile (float): the percentile to compute, between 0 and 100.
+
+    Returns:
+        float: The percentile of the samples described by the histogram.
+    """
+    cumulative = np.cumsum(counts)
+    total = int(cumulative[-1])
+
+    rank = percentile / 100 * (total - 1)
+    lower = int(np.floor(rank))
+    upper = min(lower + 1, total - 1)
+
+    lower_value = values[np.searchsorted(cumulative, lower, side="right")]
+    upper_value = values[np.searchsorted(cumulative, upper, side="right")]
+
+    return float(lower_value + (rank - lower) * (upper_value - lower_value))
+
+
+def stretch(values: np.ndarray, in_min: float, in_max: float) -> np.ndarray:
+    """Apply the same transfer function as `contrast_stretch` in ndvi_image.py to the given values."""
+    out_min = 0.0
+    out_max = 255.0
+
+    if in_max == in_min:
+        return np.full_like(values, in_min, dtype=float)
+
+    return (values - in_min) * ((out_min - out_max) / (in_min - in_max)) + in_min
+
+
+def ndvi_colour_lut(image: np.ndarray) -> np.ndarray:
+    """Build the table mapping every (blue, red) pair of the given image to its fastiecm colour.
+
+    Args:
+        image (np.ndarray): the BGR uint8 image to be rendered.
+
+    Returns:
+        np.ndarray: A (65536, 3) uint8 table indexed by `blue << 8 | red`.
+    """
+    levels = np.arange(256, dtype=float)
+
+    # 1) Contrast stretch of the original image, percentiles over all the channels
+    histogram = np.bincount(image.ravel(), minlength=256)
+    in_min = weighted_percentile(levels, histogram, LOW_PERCENTILE)
+    in_max = weighted_percentile(levels, histogram, HIGH_PERCENTILE)
+    stretched = stretch(levels, in_min, in_max)
+
+    # 2) NDVI of every possible (blue, red) pair of the stretched image
+    blue = stretched[:, np.newaxis]
+    red = stretched[np.newaxis, :]
+    bottom = blue + red
+    bottom[bottom == 0] = 0.01  # Avoid zero division error
+    ndvi = ((blue - red) / bottom).ravel()
+
+    # 3) Contrast stretch of the NDVI, percentiles over the joint (blue, red) histogram
+    pairs = np.bincount(pair_index(image).ravel(), minlength=65536)
+    order = np.argsort(ndvi, kind="stable")
+    in_min = weighted_percentile(ndvi[order], pairs[order], LOW_PERCENTILE)
+    in_max = weighted_percentile(ndvi[order], pairs[order], HIGH_PERCENTILE)
+    codes = np.clip(stretch(ndvi, in_min, in_max), 0, 255).astype(np.uint8)
+
+    # 4) Colour map
+    return FASTIECM_LUT[codes]
+
+
+def pair_index(image: np.ndarray) -> np.ndarray:
+    """Return the `blue << 8 | red` index of every pixel of a BGR image."""
+    index = image[:, :, 0].astype(np.uint16)
+    index <<= 8
+    index |= image[:, :, 2]
+    return index
+
+
+def render_ndvi(image: np.ndarray) -> np.ndarray:
+    """Render the fastiecm colour-mapped NDVI of a BGR uint8 image.
+
+    Args:
+        image (np.ndarray): the image to be rendered.
+
+    Returns:
+        np.ndarray: The BGR colour-mapped NDVI image.
+    """
+    return ndvi_colour_lut(image)[pair_index(image)]
+
+
+def read_image(path: Path, scale: float = 1.0) -> np.ndarray:
+    """Read an image, downscaling it first when a preview scale is given.
+
+    Scales of 1/2, 1/4 and 1/8 are applied by the JPEG decoder itself, any other one is resized after decoding.
+    """
+    if scale in REDUCED_READ_FLAGS:
+        return cv2.imread(str(path), REDUCED_READ_FLAGS[scale])
+
+    image = cv2.imread(str(path), cv2.IMREAD_COLOR)
+    if image is not None and scale != 1.0:
+        image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+    return image
+
+
+def render_file(path: Path, out_dir: Path, scale: float = 1.0) -> Path:
+    """Render the NDVI of a single image file into out_dir.
+
+    Returns:
+        Path: The path of the rendered image, None if the image could not be read.
+    """
+    image = read_image(path, scale)
+    if image is None:
+        return None
+
+    out_file = out_dir / f"fastiecm_{path.stem}.jpg"
+    cv2.imwrite(str(out_file), render_ndvi(image))
+
+    return out_file
+
+
+def render_folder(images_path: Path, out_dir: Path, scale: float = 1.0, workers: int = None) -> list:
+    """Render the NDVI of every JPEG in images_path into out_dir using a pool of processes.
+
+    Args:
+        images_path (Path): the folder containing the images.
+        out_dir (Path): the folder that will contain the rendered images.
+        scale (float): the downscale factor applied before rendering, 1.0 for full resolution.
+        workers (int): the number of processes, defaults to the number of CPUs.
+
+    Returns:
+        list: The paths of the rendered images.
+    """
+    out_dir.mkdir(parents=True, exist_ok=True)
+    paths = sorted(images_path.glob("*.jpg"))
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        rendered = executor.map(partial(render_file, out_dir=out_dir, scale=scale), paths)
+        return [out_file for out_file in rendered if out_file is not None]
+
+
+def main(argc, argv):
+    parser = argparse.ArgumentParser(prog="ndvi_render.py", description="Render fastiecm NDVI images for a folder")
+    parser.add_argument("path", type=Path, help="folder containing the images")
+    parser.add_argument("out", type=Path, help="output folder")
+    parser.add_argument("--scale", type=float, default=1.0, help="downscale factor for previews, e.g. 0.25")
+    parser.add_argument("--workers", type=int, default=None, help="number of processes")
+    args = parser.parse_args(argv[1:argc])
+
+    # Check if the path exists
+    if not args.path.exists():
+        print("Path not found")
+        sys.exit(1)
+
+    rendered = render_folder(args.path, args.out, args.scale, args.workers)
+    print(f"Rendered {len(rendered)} images")
+
+
+if __name__ == "__main__":
+    main(len(sys.argv), sys.argv)
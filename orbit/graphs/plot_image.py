@@ -1,3 +1,5 @@
+import sys
+import cv2
 from PIL import Image
 from matplotlib.colors import ListedColormap
 import matplotlib.pyplot as plt
@@ -5,23 +7,44 @@ import matplotlib.transforms as transforms
 import matplotlib.cm as cm
 from fastiecm import fastiecm
 from pathlib import Path
+from pyramid import build_image_pyramids, read_level
+
+# The utils package of the programs run on Earth, one folder up
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from utils.track import read_headings
 
 IMAGES = Path(__file__).parent.parent.parent / 'images'
-INPUT = IMAGES / 'out/fastiecm_img05.jpg'
+INPUT = IMAGES / 'ndvi_out/img_0005.jpg'
+PYRAMIDS = IMAGES / 'pyramids'
+TRACK = Path(__file__).parent.parent / 'ground_track.csv'  # written by extract.py <folder>
+DEFAULT_ROTATION = -10  # degrees, used when the heading of the image is unknown
+FIGSIZE = (9, 8)
+DPI = 100
 colormap = ListedColormap(fastiecm / 255)
 
-# Open the image
-image_path = str(INPUT)  # Replace with the actual path to your image
-image = Image.open(image_path)
+# Build the pyramids of the image and its NDVI rendering only once
+pyramid_dir = PYRAMIDS / INPUT.stem / 'ndvi'
+if not (pyramid_dir / 'pyramid.json').exists():
+    build_image_pyramids(INPUT, PYRAMIDS)
+
+# Read only the level matching the size of the figure
+pixels = read_level(pyramid_dir, FIGSIZE[0] * DPI, FIGSIZE[1] * DPI)
+image = Image.fromarray(cv2.cvtColor(pixels, cv2.COLOR_BGR2RGB))
+
+# Rotate the image so that north is up, through the ISS heading when it was taken
+rotation = DEFAULT_ROTATION
+if TRACK.exists():
+    headings = read_headings(TRACK)
+    if INPUT.name in headings:
+        rotation = -headings[INPUT.name]
 
-# Rotate the image by 45 degrees
-rotated_image = image.rotate(-10, expand=True)
+rotated_image = image.rotate(rotation, expand=True)
 
 # Create a figure and axes with custom figsize
-fig, ax = plt.subplots(figsize=(9, 8))
+fig, ax = plt.subplots(figsize=FIGSIZE, dpi=DPI)
 
 # Apply the rotation transformation to the axes
-trans = transforms.Affine2D().rotate_deg(-10)
+trans = transforms.Affine2D().rotate_deg(rotation)
 ax.set_transform(trans)
 
 # Calculate the padding for the rotated image
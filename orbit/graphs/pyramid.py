@@ -0,0 +1,187 @@
+"""
+MULTI-RESOLUTION TILE PYRAMID
+
+Write power-of-two downsampled levels of an image, and of its NDVI rendering, cut into fixed-size tiles,
+so that plots only read the level and the tiles matching the output size instead of the full frame.
+
+Layout of a pyramid folder:
+    pyramid.json              size of the source, tile size and size of each level
+    <level>/<row>_<col>.jpg   the tiles, level 0 being the full resolution
+"""
+
+import sys
+import json
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from pathlib import Path
+
+import cv2
+import numpy as np
+from ndvi_render import render_ndvi
+
+# --------------------------------------
+# CONSTANTS
+# --------------------------------------
+
+TILE_SIZE = 256  # pixels
+TILE_EXTENSION = ".jpg"
+TILE_QUALITY = 95
+
+# --------------------------------------
+# FUNCTIONS
+# --------------------------------------
+
+def build_pyramid(image: np.ndarray, out_dir: Path, tile_size: int = TILE_SIZE) -> dict:
+    """Write the pyramid of the given image into out_dir.
+
+    Each level halves the previous one until the whole image fits in a single tile.
+
+    Args:
+        image (np.ndarray): the image to be tiled.
+        out_dir (Path): the pyramid folder.
+        tile_size (int): the width and height of a tile in pixels.
+
+    Returns:
+        dict: The pyramid description, also saved as pyramid.json.
+    """
+    height, width = image.shape[:2]
+    info = {"width": width, "height": height, "tile_size": tile_size, "levels": []}
+
+    level = 0
+    while True:
+        level_dir = out_dir / str(level)
+        level_dir.mkdir(parents=True, exist_ok=True)
+
+        level_height, level_width = image.shape[:2]
+        rows = -(-level_height // tile_size)
+        cols = -(-level_width // tile_size)
+
+        for row in range(rows):
+            for col in range(cols):
+                tile = image[row * tile_size:(row + 1) * tile_size, col * tile_size:(col + 1) * tile_size]
+                cv2.imwrite(str(level_dir / f"{row}_{col}{TILE_EXTENSION}"), tile, [cv2.IMWRITE_JPEG_QUALITY, TILE_QUALITY])
+
+        info["levels"].append({"level": level, "width": level_width, "height": level_height, "rows": rows, "cols": cols})
+
+        if max(level_width, level_height) <= tile_size:
+            break
+
+        image = cv2.resize(image, ((level_width + 1) // 2, (level_height + 1) // 2), interpolation=cv2.INTER_AREA)
+        level += 1
+
+    with open(out_dir / "pyramid.json", "w") as f:
+        json.dump(info, f, indent=2)
+
+    return info
+
+
+def build_image_pyramids(path: Path, out_dir: Path, tile_size: int = TILE_SIZE) -> Path:
+    """Build the pyramids of an image file and of its NDVI rendering.
+
+    They are written to out_dir/<image name>/image and out_dir/<image name>/ndvi.
+
+    Returns:
+        Path: The folder containing both pyramids, None if the image could not be read.
+    """
+    image = cv2.imread(str(path), cv2.IMREAD_COLOR)
+    if image is None:
+        return None
+
+    image_dir = out_dir / path.stem
+    build_pyramid(image, image_dir / "image", tile_size)
+    build_pyramid(render_ndvi(image), image_dir / "ndvi", tile_size)
+
+    return image_dir
+
+
+def load_info(pyramid_dir: Path) -> dict:
+    """Load the description of a pyramid."""
+    with open(pyramid_dir / "pyramid.json", "r") as f:
+        return json.load(f)
+
+
+def select_level(info: dict, width: int, height: int) -> dict:
+    """Select the smallest level that is still at least width x height pixels.
+
+    The full resolution level is returned when none is big enough.
+    """
+    for level in reversed(info["levels"]):
+        if level["width"] >= width and level["height"] >= height:
+            return level
+
+    return info["levels"][0]
+
+
+def read_level(pyramid_dir: Path, width: int, height: int, region: tuple = None) -> np.ndarray:
+    """Read an image from a pyramid at the resolution matching the requested output size.
+
+    Only the tiles of the selected level overlapping the region are read.
+
+    Args:
+        pyramid_dir (Path): the pyramid folder.
+        width (int): the width in pixels the image will be displayed at.
+        height (int): the height in pixels the image will be displayed at.
+        region (tuple): optional (x0, y0, x1, y1) region in full resolution pixels, the whole image by default.
+
+    Returns:
+        np.ndarray: The BGR pixels of the region at the selected level.
+    """
+    info = load_info(pyramid_dir)
+    tile_size = info["tile_size"]
+
+    if region is None:
+        region = (0, 0, info["width"], info["height"])
+
+    # The output size refers to the region, so scale it back to the whole image
+    x0, y0, x1, y1 = region
+    level = select_level(
+        info,
+        -(-width * info["width"] // max(x1 - x0, 1)),
+        -(-height * info["height"] // max(y1 - y0, 1)),
+    )
+
+    # Region in the pixels of the selected level
+    scale = 2 ** level["level"]
+    x0, y0 = x0 // scale, y0 // scale
+    x1, y1 = min(-(-x1 // scale), level["width"]), min(-(-y1 // scale), level["height"])
+
+    out = np.zeros((y1 - y0, x1 - x0, 3), dtype=np.uint8)
+    level_dir = pyramid_dir / str(level["level"])
+
+    for row in range(y0 // tile_size, -(-y1 // tile_size)):
+        for col in range(x0 // tile_size, -(-x1 // tile_size)):
+            tile = cv2.imread(str(level_dir / f"{row}_{col}{TILE_EXTENSION}"), cv2.IMREAD_COLOR)
+
+            # Intersection between the tile and the region, in level pixels
+            tx0, ty0 = col * tile_size, row * tile_size
+            ix0, iy0 = max(tx0, x0), max(ty0, y0)
+            ix1, iy1 = min(tx0 + tile.shape[1], x1), min(ty0 + tile.shape[0], y1)
+
+            out[iy0 - y0:iy1 - y0, ix0 - x0:ix1 - x0] = tile[iy0 - ty0:iy1 - ty0, ix0 - tx0:ix1 - tx0]
+
+    return out
+
+
+def main(argc, argv):
+    parser = argparse.ArgumentParser(prog="pyramid.py", description="Build tile pyramids for a folder of images")
+    parser.add_argument("path", type=Path, help="folder containing the selected images")
+    parser.add_argument("out", type=Path, help="output folder")
+    parser.add_argument("--tile-size", type=int, default=TILE_SIZE, help="tile width and height in pixels")
+    parser.add_argument("--workers", type=int, default=None, help="number of processes")
+    args = parser.parse_args(argv[1:argc])
+
+    # Check if the path exists
+    if not args.path.exists():
+        print("Path not found")
+        sys.exit(1)
+
+    paths = sorted(args.path.glob("*.jpg"))
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        built = [d for d in executor.map(partial(build_image_pyramids, out_dir=args.out, tile_size=args.tile_size), paths) if d]
+
+    print(f"Built pyramids for {len(built)} images")
+
+
+if __name__ == "__main__":
+    main(len(sys.argv), sys.argv)
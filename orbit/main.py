@@ -1,14 +1,36 @@
 import sys
-import cv2
 import json
+import numpy as np
 
 from logzero import logger, logfile
 from pathlib import Path
 
-from utils.ndvi import mean_ndvi
+from utils.ndvi import ndvi, mean_ndvi
+from utils.masks import CLOUD, WATER, load_exclusion
 from utils.vci import vci_calculate, vci_classify
+from utils.results import ResultWriter, new_result
+from utils.vci_raster import HistoricRange
+from utils.phash import MAX_DISTANCE, HashIndex, save_clusters
+from utils.prefetch import PrefetchReader
+from utils.catalog import Catalog, catalog_key
+from utils.vignette import ValidRegion, region_path
+from utils.tiles import TileGrid, tiles_path
 
 
+# --------------------------------------
+# CONSTANTS
+# --------------------------------------
+
+# Year of the images taken aboard the ISS
+LATEST_YEAR = 2023
+
+# Years of the historic NDVI data in past_ndvi_data
+HISTORIC_YEARS = [2019, 2020, 2021, 2022]
+
+# Stored masks left out of the mean NDVI. The water mask also holds bare soil and desert, which the historic
+# Earth Engine means include, so add WATER only for results not compared with them
+ANALYSIS_EXCLUDE = [CLOUD]
+
 # --------------------------------------
 # VARIABLES
 # --------------------------------------
@@ -16,6 +38,12 @@ from utils.vci import vci_calculate, vci_classify
 # Resolve absolute path to the current code directory
 base_folder: Path = Path(__file__).parent.resolve()
 
+# Folder of the cloud and water masks stored by filter.py
+masks_folder = base_folder / "masks"
+
+# Folder of the per-pixel NDVI range and VCI rasters of each ROI
+rasters_folder = base_folder / "vci_rasters"
+
 # Set log file
 logfile(base_folder / "main.log", backupCount=0, maxBytes=30e6)
 
@@ -28,12 +56,79 @@ def load_json_data(path: str):
         return result
 
 
+def roi_result(roi: str, latest_ndvi: float, historic_ndvi: dict) -> dict:
+    """Compute the VCI of a ROI over the historic years and the latest one.
+
+    The VCI is None when the NDVI of the ROI never changed, and its class None when the VCI falls outside VCI_RANGES.
+    A ROI missing from every historic year is logged, as the historic files may not be the ones of these images.
+    """
+    historic = {year: ndvi_by_roi.get(roi) for year, ndvi_by_roi in historic_ndvi.items()}
+    if historic and all(value is None for value in historic.values()):
+        logger.warning(f"No historic NDVI for {roi} in years {sorted(historic)}, check the historic NDVI files")
+    ndvi_values = [value for value in historic.values() if value is not None] + [latest_ndvi]
+
+    vci_min, vci_max = min(ndvi_values), max(ndvi_values)
+    vci = vci_calculate(latest_ndvi, vci_min, vci_max) if vci_max > vci_min else None
+    vci_class = vci_classify(vci) if vci is not None else None
+
+    return new_result(roi, latest_ndvi, historic, vci, vci_class)
+
+
+def queue_task():
+    """The work of main() on each image for the workers of utils/workqueue.py: its mean NDVI, over the valid region
+    filter.py stored for the folder of the image."""
+    regions = {}
+
+    def analyse(image_path, image):
+        folder = Path(image_path).parent
+        if folder not in regions:
+            regions[folder] = ValidRegion.load(region_path(masks_folder, folder))
+        region = regions[folder]
+
+        excluded = load_exclusion(masks_folder, image_path, ANALYSIS_EXCLUDE, image.shape[1])
+        return {"path": str(image_path), "latest_ndvi": float(mean_ndvi(image, remove_negatives=excluded is None, exclude=excluded, region=region, tiles=TileGrid.load(tiles_path(masks_folder, image_path))))}
+
+    return analyse
+
+
+def pixel_vci(image_path: str, image, historic_path: Path, region: ValidRegion = None):
+    """Compute the per-pixel VCI of the ROI of an image.
+
+    The per-pixel NDVI range of the ROI is updated with the years of historic_path it does not include yet,
+    read from historic_path/<year>/<image name>.npy, and with the latest image. Excluded pixels and the pixels
+    outside the valid region are left out.
+    """
+    name = Path(image_path).stem
+    roi = HistoricRange(rasters_folder / name)
+
+    years = sorted(int(year_dir.name) for year_dir in historic_path.iterdir() if year_dir.name.isdigit())
+    for year in years:
+        raster_path = historic_path / str(year) / f"{name}.npy"
+        if year not in roi.years and raster_path.exists():
+            roi.update(year, np.load(raster_path, mmap_mode="r"))
+
+    latest = ndvi(image).astype(np.float32)
+    excluded = load_exclusion(masks_folder, image_path, ANALYSIS_EXCLUDE, image.shape[1])
+    if excluded is not None:
+        latest[excluded] = np.nan
+    if region is not None and region.fits(image):
+        latest[~region.mask] = np.nan
+    tiles = TileGrid.load(tiles_path(masks_folder, image_path))
+    if tiles is not None and tiles.fits(image):
+        latest[tiles.invalid_pixels()] = np.nan
+
+    roi.update(LATEST_YEAR, latest)
+    roi.vci(latest)
+
+    logger.info(f"Per-pixel VCI of {name} calculated over years {roi.years}")
+
+
 # entry point
 def main(argc, argv):
 
     # Check command-line arguments
-    if argc != 2:
-        logger.error("Usage: orbit <path>")
+    if argc not in (2, 3):
+        logger.error("Usage: orbit <path> [historic NDVI rasters path]")
         sys.exit(1)
     
     # Get the path to the folder containing the images
@@ -44,48 +139,55 @@ def main(argc, argv):
         logger.error("Path not found")
         sys.exit(1)
 
-    filtered_images = {str(image_path): cv2.imread(str(image_path)) for image_path in path.iterdir()}
-    logger.info(f"{len(filtered_images)}, images loaded")
+    # Valid region of the frames estimated by filter.py for this folder, None to read every pixel
+    region = ValidRegion.load(region_path(masks_folder, path))
 
-    # Calculate average NDVI not including cloud pixels which have negative NDVI values
-    latest_ndvi = {image_path: mean_ndvi(image, remove_negatives=True) for image_path, image in filtered_images.items()}
-    
-    logger.info("Average NDVI values calculated for each image")
-    
-    ndvi_2019 = load_json_data("./past_ndvi_data/2019_ndvi.json")
-    ndvi_2020 = load_json_data("./past_ndvi_data/2020_ndvi.json")
-    ndvi_2021 = load_json_data("./past_ndvi_data/2021_ndvi.json")
-    ndvi_2022 = load_json_data("./past_ndvi_data/2022_ndvi.json")
+    # Group near-duplicate frames so that only one image of each group is decoded and analysed
+    clusters = HashIndex.from_paths(sorted(path.iterdir())).clusters(MAX_DISTANCE)
+    save_clusters(clusters, base_folder / "main_duplicates.json")
+    logger.info(f"{sum(len(members) for members in clusters.values())} images in {len(clusters)} groups of near-duplicates")
 
-    historic_ndvi = [ndvi_2019, ndvi_2020, ndvi_2021, ndvi_2022]
+    # Historic NDVI of each ROI by year
+    historic_ndvi = {year: load_json_data(f"./past_ndvi_data/{year}_ndvi.json") for year in HISTORIC_YEARS}
 
     logger.info("Loaded ndvi values from past years")
 
-    ndvi_by_roi = {roi: [] for roi, _ in filtered_images.items()}
-    
-    for year in historic_ndvi:
-        for roi, ndvi in year.items():
-            ndvi_by_roi[roi].append(ndvi)
-
-    for roi, ndvi in latest_ndvi.items():
-        ndvi_by_roi[roi].append(ndvi)
-
-    min_max_ndvi_by_roi = {roi: (min(ndvi_values), max(ndvi_values)) for roi, ndvi_values in ndvi_by_roi.items()}
-
-    vci_by_roi = {roi: vci_calculate(latest_ndvi[roi], min, max) for roi, (min, max) in min_max_ndvi_by_roi.items()}
-    vci_classes_by_roi = {roi: vci_classify(vci) for roi, vci in vci_by_roi.items()}
-
-    # Save results
-    with open("main_results.txt", "w+") as f:
-        f.write("LATEST NDVI\n")
-        f.write(str(latest_ndvi)+"\n")
-        f.write("NDVI BY ROI OVER YEARS (2019-2023)\n")
-        f.write(str(ndvi_by_roi)+"\n")
-        f.write("VCI BY ROI\n")
-        f.write(str(vci_by_roi)+"\n")
-        f.write("VCI CLASSES BY ROI\n")
-        f.write(str(vci_classes_by_roi))
-
+    # Images are decoded ahead in background threads, one at a time is processed
+    filtered_images = PrefetchReader(clusters)
+    logger.info(f"{len(filtered_images)}, images to analyse")
+
+    # Results are written as soon as each ROI is processed
+    measurements = {}
+    with ResultWriter(base_folder, HISTORIC_YEARS) as results:
+        for image_path, image in filtered_images:
+            image_path = str(image_path)
+
+            # Calculate average NDVI not including cloud pixels, using the stored masks when filter.py saved them
+            # or else leaving out cloud pixels which have negative NDVI values, and only over the usable tiles
+            # when filter.py judged the image tile by tile
+            excluded = load_exclusion(masks_folder, image_path, ANALYSIS_EXCLUDE, image.shape[1])
+            tiles = TileGrid.load(tiles_path(masks_folder, image_path))
+            latest_ndvi = mean_ndvi(image, remove_negatives=excluded is None, exclude=excluded, region=region, tiles=tiles)
+
+            # Per-pixel VCI when historic NDVI rasters are given
+            if argc == 3:
+                pixel_vci(image_path, image, Path(argv[2]), region)
+
+            # Near-duplicates share the NDVI of the image representing them
+            for member in clusters[Path(image_path)]:
+                result = roi_result(str(member), latest_ndvi, historic_ndvi)
+                results.write(result)
+                measurements[str(member)] = {"latest_ndvi": result["latest_ndvi"], "vci": result["vci"]}
+
+    logger.info(f"Results of {results.count} ROIs saved to {results.columnar_path}")
+
+    # Share the NDVI and VCI of each ROI with the other tools, under the images the selected links stand for
+    catalog = Catalog()
+    paths = list(measurements)
+    sources = catalog.sources(paths)
+    catalog.ingest([path for path, source in zip(paths, sources) if source == catalog_key(path)])
+    catalog.set_measurements({source: measurements[path] for path, source in zip(paths, sources)})
+    catalog.close()
     logger.info("Completed")
 
 if __name__ == "__main__":
@@ -0,0 +1,260 @@
+"""
+IN-MEMORY PIPELINE
+
+Chain the whole analysis of a set of frames, from the files taken aboard the ISS to their VCI, without the
+hand-offs of the separate programs (out/selected, boxes/bounding_boxes.csv, the Earth Engine upload and the masks):
+    duplicates  one frame of each group of near-duplicates, hashed from a reduced decode as filter.py
+    sun         night frames removed from their capture time and position, without decoding them
+    filter      the classifiers of filter.py, run on the frame decoded once
+    footprint   the bounding box of the ROI of the frame from its catalog row, as bounding_box.py
+    historic    the historic mean NDVI of the ROI, read from a pluggable provider
+    ndvi, vci   the mean NDVI of the usable pixels of the same decoded frame and the VCI of the ROI, as main.py
+
+Each frame is decoded at full resolution at most once. The masks computed by the classifiers are kept in memory
+and dropped as soon as the frame is analysed, and the records of the frames are returned instead of being written:
+
+    pipeline = Pipeline(JsonHistoric({2022: "past_ndvi_data/2022_ndvi.json"}))
+    manifest = pipeline.run(sorted(Path("images").glob("*.jpg")))
+    results = [record["result"] for record in manifest.records.values() if "result" in record]
+
+From the command line, `python3 cli.py pipeline <path>` writes the records and the results next to this file.
+"""
+
+import sys
+import time
+import argparse
+from pathlib import Path
+
+from logzero import logger, logfile
+
+from filter import (
+    DUPLICATE_DISTANCE, DARK_THRESHOLD, NIGHT_ELEVATION, DAY_ELEVATION, THRESHOLD, PIXEL_THRESHOLD,
+    NDVI_RANGE, NDVI_THRESHOLD, NDVI_EXCLUDE, SAMPLING, TILE_MODE, TILE_ARGS, classify_image, record_measurements,
+)
+from main import HISTORIC_YEARS, ANALYSIS_EXCLUDE, load_json_data, roi_result
+from utils.ndvi import mean_ndvi
+from utils.masks import combine_masks
+from utils.manifest import Manifest, new_record
+from utils.classifiers import DarkImageClassifier, ThresholdClassifier, NDVIClassifier, DuplicateClassifier, SunElevationClassifier, TileClassifier
+from utils.prefetch import PrefetchReader
+from utils.catalog import Catalog
+from utils.bounding_box import roi_bounds
+from utils.historic import find_tiles, roi_mean_ndvi
+from utils.results import ResultWriter
+from utils.tiles import TILES
+from utils.vignette import ValidRegion, estimate_region
+
+# --------------------------------------
+# CONSTANTS
+# --------------------------------------
+
+# Resolve absolute path to the current code directory
+base_folder: Path = Path(__file__).parent.resolve()
+
+# Historic NDVI exported from Earth Engine, used when no provider is given on the command line
+PAST_NDVI_FOLDER = base_folder / "past_ndvi_data"
+
+# Set log file
+logfile(base_folder / "pipeline.log", backupCount=0, maxBytes=30e6)
+
+# --------------------------------------
+# HISTORIC NDVI PROVIDERS
+# --------------------------------------
+
+class HistoricProvider:
+    """A source of the historic mean NDVI of the ROIs.
+
+    Attributes:
+        years (list): The years the provider has data for.
+    """
+
+    def __init__(self, years) -> None:
+        self.years = sorted(years)
+
+    def lookup(self, path: str, bounds: tuple) -> dict:
+        """Return the mean NDVI of the ROI of an image by year.
+
+        Args:
+            path (str): The path of the image of the ROI.
+            bounds (tuple): (xmin, ymin, xmax, ymax) of the ROI in longitude/latitude degrees, None if unknown.
+
+        Returns:
+            dict: The mean NDVI by year, None for the years without data on the ROI.
+        """
+        raise NotImplementedError
+
+
+class JsonHistoric(HistoricProvider):
+    """The FeatureCollections exported by earth_engine/ndvi.js or written by utils/historic.py, one per year.
+    ROIs are looked up by the path of their image, or else by its file name.
+    """
+
+    def __init__(self, paths: dict) -> None:
+        super().__init__(paths)
+        self.values = {year: load_json_data(path) for year, path in paths.items()}
+        self.by_name = {year: {Path(roi).name: value for roi, value in values.items()} for year, values in self.values.items()}
+
+    def lookup(self, path, bounds):
+        return {
+            year: self.values[year].get(str(path), self.by_name[year].get(Path(path).name))
+            for year in self.years
+        }
+
+
+class RasterHistoric(HistoricProvider):
+    """Red and near-infrared rasters stored locally, one folder per year (see utils/historic.py),
+    read over the footprint of each ROI when it is analysed.
+    """
+
+    def __init__(self, folders: dict) -> None:
+        super().__init__(folders)
+        self.tiles = {year: find_tiles(Path(folder)) for year, folder in folders.items()}
+
+    def lookup(self, path, bounds):
+        return {year: roi_mean_ndvi(self.tiles[year], bounds) if bounds is not None else None for year in self.years}
+
+# --------------------------------------
+# PIPELINE
+# --------------------------------------
+
+class Pipeline:
+    """The analysis of frames from their files to their VCI, in memory.
+
+    Attributes:
+        historic (HistoricProvider): The source of the historic NDVI, None to only compute the latest NDVI.
+        region (ValidRegion): The valid region of the frames, None to estimate it from the frames taken by day of each run.
+        tile_mode (bool): Whether the frames are judged tile by tile, as TILE_MODE in filter.py.
+    """
+
+    def __init__(self, historic: HistoricProvider = None, region: ValidRegion = None, tile_mode: bool = TILE_MODE) -> None:
+        self.historic = historic
+        self.region = region
+        self.tile_mode = tile_mode
+
+    def stages(self, kept_masks: dict, region: ValidRegion) -> list:
+        """The classifiers of filter.py with their parameters, keeping their masks in memory."""
+        if self.tile_mode:
+            return [(TileClassifier(None, region=region, kept_masks=kept_masks), TILE_ARGS)]
+
+        return [
+            (DarkImageClassifier(None, region=region), (DARK_THRESHOLD,)),
+            (ThresholdClassifier(None, region=region, kept_masks=kept_masks, sampling=SAMPLING), (PIXEL_THRESHOLD, THRESHOLD)),
+            (NDVIClassifier(None, exclude=NDVI_EXCLUDE, region=region, kept_masks=kept_masks, sampling=SAMPLING), (NDVI_RANGE, NDVI_THRESHOLD)),
+        ]
+
+    def result(self, path: str, latest_ndvi: float, bounds: tuple) -> dict:
+        """The result record of the ROI of an image, as written by main.py."""
+        historic = self.historic.lookup(path, bounds) if self.historic is not None else {}
+        return roi_result(path, latest_ndvi, {year: {path: value} for year, value in historic.items()})
+
+    def run(self, paths: list) -> Manifest:
+        """Analyse frames.
+
+        Args:
+            paths (list): The paths of the frames.
+
+        Returns:
+            Manifest: The record of every frame, with the verdicts of the filter. The selected frames and their
+            near-duplicates also hold the "bounds" of their ROI and the "result" of main.py.
+        """
+        paths = [Path(path) for path in paths]
+        manifest = Manifest([new_record(path) for path in paths])
+
+        # Capture time and position of every frame, near-duplicates included, for their footprint
+        catalog = Catalog()
+        catalog.ingest(paths)
+        rows = dict(zip(map(str, paths), catalog.lookup(paths)))
+
+        # One frame out of each group of near-duplicates, then the frames taken by day
+        duplicate_cls = DuplicateClassifier(manifest)
+        unique = duplicate_cls.start(DUPLICATE_DISTANCE)
+        lit = SunElevationClassifier(unique, catalog).start(NIGHT_ELEVATION, DAY_ELEVATION)
+        catalog.close()
+        logger.info(f"{len(paths)} frames, {len(paths) - len(unique)} near-duplicates or unreadable, {len(unique) - len(lit)} night frames")
+
+        # The porthole of these frames, estimated from the ones taken by day, night frames being dark everywhere
+        region = self.region if self.region is not None else estimate_region(lit)
+
+        # The masks of a frame only live until it is analysed
+        kept_masks = {}
+        stages = self.stages(kept_masks, region)
+
+        for path, image in PrefetchReader(lit):
+            record = manifest.record(path)
+            verdict = classify_image(stages, path, image, record["verdicts"].get(SunElevationClassifier.name))
+            record["verdicts"].update(verdict["verdicts"])
+            record["selected"] = verdict["selected"]
+
+            masks = kept_masks.pop(str(path), {})
+            if not record["selected"]:
+                continue
+
+            # Mean NDVI without the excluded pixels of main.py, over the usable tiles in tile mode
+            excluded = combine_masks([masks.get(kind) for kind in ANALYSIS_EXCLUDE])
+            latest_ndvi = float(mean_ndvi(image, remove_negatives=excluded is None, exclude=excluded, region=region, tiles=masks.get(TILES)))
+
+            # Near-duplicates share the NDVI of the frame representing them, each over its own footprint
+            for member in duplicate_cls.clusters[path]:
+                member_record = manifest.record(member)
+                member_record["bounds"] = roi_bounds(rows[str(member)])
+                member_record["result"] = self.result(str(member), latest_ndvi, member_record["bounds"])
+
+        logger.info(f"{len(manifest.selected())} frames selected")
+
+        return manifest
+
+
+def year_path(text: str) -> tuple:
+    """Parse a YEAR=PATH command-line argument."""
+    year, _, path = text.partition("=")
+    if not year.isdigit() or not path:
+        raise argparse.ArgumentTypeError(f"expected YEAR=PATH, got {text}")
+
+    return int(year), Path(path)
+
+
+def main(argc, argv):
+    parser = argparse.ArgumentParser(prog="pipeline", description="Filter the images and calculate their NDVI and VCI in a single pass")
+    parser.add_argument("path", type=Path, help="folder containing the images")
+    parser.add_argument("--json", type=year_path, nargs="+", default=None, metavar="YEAR=PATH", help="historic NDVI exported from Earth Engine")
+    parser.add_argument("--rasters", type=year_path, nargs="+", default=None, metavar="YEAR=FOLDER", help="historic red and near-infrared rasters")
+    parser.add_argument("--tiles", action="store_true", help="judge the images tile by tile")
+    parser.add_argument("--out", type=Path, default=base_folder, help="output folder")
+    args = parser.parse_args(argv[1:argc])
+
+    # Check if the path exists
+    if not args.path.exists():
+        logger.error("Path not found")
+        sys.exit(1)
+
+    if args.rasters is not None:
+        historic = RasterHistoric(dict(args.rasters))
+    elif args.json is not None:
+        historic = JsonHistoric(dict(args.json))
+    else:
+        historic = JsonHistoric({year: PAST_NDVI_FOLDER / f"{year}_ndvi.json" for year in HISTORIC_YEARS})
+
+    start = time.monotonic()
+    pipeline = Pipeline(historic, tile_mode=args.tiles or TILE_MODE)
+    manifest = pipeline.run(sorted(args.path.glob("*.jpg")))
+
+    args.out.mkdir(parents=True, exist_ok=True)
+    manifest.save(args.out / "pipeline_manifest.jsonl")
+
+    measurements = {}
+    with ResultWriter(args.out, historic.years, name="pipeline_results") as results:
+        for record in manifest.records.values():
+            measurements[record["path"]] = record_measurements(record)
+            if "result" in record:
+                results.write(record["result"])
+                measurements[record["path"]].update({"latest_ndvi": record["result"]["latest_ndvi"], "vci": record["result"]["vci"]})
+
+    catalog = Catalog()
+    catalog.set_measurements(measurements)
+    catalog.close()
+
+    logger.info(f"Results of {results.count} ROIs saved to {results.columnar_path} in {time.monotonic() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main(len(sys.argv), sys.argv)
@@ -0,0 +1,80 @@
+"""
+STARTUP BENCHMARK
+
+Measure how long each subcommand of cli.py takes to import, in a fresh interpreter every time,
+and fail when one goes over its budget. Run it after adding imports to any of the programs:
+    python3 startup_benchmark.py [repeats]
+"""
+
+import sys
+import subprocess
+from statistics import median
+from pathlib import Path
+
+# --------------------------------------
+# CONSTANTS
+# --------------------------------------
+
+# Resolve absolute path to the current code directory
+base_folder: Path = Path(__file__).parent.resolve()
+
+# Import time budget of each subcommand in seconds, "cli" being the entry point alone
+BUDGETS = {
+    "cli": 0.05,
+    "extract": 0.25,
+    "boxes": 0.3,
+    "filter": 0.6,
+    "analyse": 0.6,
+    "render": 0.6,
+    "charts": 1.0,  # matplotlib
+    "sweep": 0.6,
+    "queue": 0.6,
+    "catalog": 0.3,
+    "telemetry": 0.3,
+    "vignette": 0.3,
+    "pipeline": 0.6,
+}
+
+REPEATS = 5
+
+# Run in the child interpreter, prints the seconds spent importing
+PROBE = """
+import time
+start = time.perf_counter()
+import cli
+if {command!r} != "cli":
+    cli.load({command!r})
+print(time.perf_counter() - start)
+"""
+
+# --------------------------------------
+# LIB
+# --------------------------------------
+
+def import_time(command: str) -> float:
+    """Seconds spent importing a subcommand in a fresh interpreter."""
+    result = subprocess.run(
+        [sys.executable, "-c", PROBE.format(command=command)],
+        cwd=base_folder, capture_output=True, text=True, check=True,
+    )
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def main(argc, argv):
+    repeats = int(argv[1]) if argc == 2 else REPEATS
+
+    over_budget = []
+    for command, budget in BUDGETS.items():
+        seconds = median(import_time(command) for _ in range(repeats))
+        print(f"{command:<10}{seconds * 1000:8.1f} ms   budget {budget * 1000:.0f} ms")
+
+        if seconds > budget:
+            over_budget.append(command)
+
+    if over_budget:
+        print(f"Over budget: {', '.join(over_budget)}, see python3 -X importtime cli.py")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(len(sys.argv), sys.argv)
@@ -2,14 +2,12 @@ import sys
 import csv
 import shutil
 from logzero import logger
-from datetime import datetime
 from pathlib import Path
 from math import radians, degrees
 
-from gsd import gsd
-from better_gsd import better_gsd
-from iss import iss_altitude
-from metadata import get_image_metadata, get_coordinates
+from .better_gsd import better_gsd
+from .iss import iss_altitude
+from .catalog import Catalog, capture_time
 
 
 SENSOR_WIDTH = 6.2928  # mm
@@ -19,6 +17,12 @@ IMAGE_WIDTH = 4056  # pixels
 IMAGE_HEIGHT = 3040  # pixels
 HORIZONTAL_AOV = 72.64  # degrees
 VERTICAL_AOV = 57.12  # degrees
+NOMINAL_ALTITUDE = 420 * 10**3  # meters, of the ISS when its altitude cannot be looked up
+
+# Resolve absolute path to the current code directory
+base_folder: Path = Path(__file__).parent.resolve()
+# Define output folder for the bounding boxes
+out_folder = base_folder / "boxes"
 
 def adjust_latitude_longitude(latitude, longitude):
     adjusted_latitude = latitude if latitude <= 90 else latitude - 180
@@ -68,6 +72,36 @@ def bounding_box(iss_latitude, iss_longitude, width, height):
     return top_left, top_right, bottom_left, bottom_right
 
 
+def roi_bounds(row) -> tuple:
+    """Compute the bounding box of the ROI of an image from its catalog row.
+
+    Returns:
+        tuple: (xmin, ymin, xmax, ymax) in longitude/latitude degrees, None for an image without a time or position.
+    """
+    if row is None or row["time"] is None or row["latitude"] is None:
+        return None
+
+    distance_width, distance_height = better_gsd(HORIZONTAL_AOV, VERTICAL_AOV, flight_altitude(row))
+    top_left, top_right, bottom_left, bottom_right = bounding_box(row["latitude"], row["longitude"], distance_width, distance_height)
+
+    return bottom_left[1], bottom_left[0], top_right[1], top_right[0]
+
+
+def flight_altitude(row) -> float:
+    """The altitude of the ISS when an image was taken, in meters.
+
+    The altitude is saved at capture time, the images taken before it was saved need an API request. When the
+    request fails (no network, or the requests package missing), the nominal altitude of the ISS is used instead.
+    """
+    if row["altitude"] is not None:
+        return row["altitude"]
+
+    try:
+        return iss_altitude(capture_time(row).timestamp())
+    except Exception as error:
+        logger.warning(f"ISS altitude of {row['path']} unavailable ({error!r}), using {NOMINAL_ALTITUDE / 10**3:.0f} km")
+        return NOMINAL_ALTITUDE
+
 
 class BoundingBoxMaker:
 
@@ -84,16 +118,19 @@ class BoundingBoxMaker:
             writer.writeheader()
 
     def start(self, sensor_width, sensor_height, focal_length):
-        for path in self.images_path.iterdir():
-            metadata = get_image_metadata(path)
-            date = datetime.strptime(str(metadata["DateTimeOriginal"]), "%Y:%m:%d %H:%M:%S")
-            timestamp = datetime.timestamp(date)
-            flight_height = iss_altitude(timestamp)
-            distance_width, distance_height = better_gsd(HORIZONTAL_AOV, VERTICAL_AOV, flight_height)
-            latitude, longitude = get_coordinates(metadata)
-            top_left, top_right, bottom_left, bottom_right = bounding_box(latitude, longitude, distance_width, distance_height)
+        # Time and position of the images come from the catalog, which only reads the new images
+        paths = sorted(self.images_path.iterdir())
+        catalog = Catalog()
+        catalog.ingest(paths)
+        rows = catalog.lookup(paths)
+        catalog.close()
+
+        for path, row in zip(paths, rows):
+            bounds = roi_bounds(row)
+            if bounds is None:
+                continue
 
-            data = [path, bottom_left[1], bottom_left[0], top_right[1], top_right[0]]
+            data = [path, *bounds]
 
             with open(self.out_dir / "bounding_boxes.csv", 'a') as f:
                 writer = csv.writer(f)
@@ -104,8 +141,9 @@ class BoundingBoxMaker:
 
 def main(argc, argv):
 
-    # Check command-line arguments
+    # Check command-line arguments, the module being run through cli.py as it imports its siblings
     if argc != 2:
+        print("Usage: python3 cli.py boxes <path>")
         sys.exit(1)
     
     # Get the path to the folder containing the images
@@ -113,20 +151,15 @@ def main(argc, argv):
 
     # Check if the path exists
     if not path.exists():
+        print("Path not found")
         sys.exit(1)
 
+    shutil.rmtree(out_folder, ignore_errors=True)
+
     box_maker = BoundingBoxMaker(path, out_folder)
     box_maker.start(SENSOR_WIDTH, SENSOR_HEIGHT, FOCAL_LENGTH)
 
     print("Finished")
 
 if __name__ == "__main__":
-    # Resolve absolute path to the current code directory
-    base_folder: Path = Path(__file__).parent.resolve()
-    # Define output folder for images
-    out_folder = base_folder / "boxes"
-
-    shutil.rmtree(out_folder, ignore_errors=True)
-
-    # Set log file
     main(len(sys.argv), sys.argv)
@@ -0,0 +1,251 @@
+"""
+IMAGE CATALOG
+
+A SQLite catalog of the images, so that their metadata is read from the files only once:
+    images          path, size, modification time, capture time, position, ISS altitude and ground-track heading
+                    of each image, indexed on time and position
+    measurements    the values derived from each image by the programs, e.g. the filter verdicts or the mean NDVI
+
+Ingesting a folder reads the EXIF header of the new or modified images only, the others are skipped from their
+size and modification time. The tools then query the catalog instead of opening the images.
+"""
+
+import sys
+import sqlite3
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+
+from .metadata import get_header_metadata, get_coordinates, get_altitude, get_heading
+from .masks import image_key
+
+# --------------------------------------
+# CONSTANTS
+# --------------------------------------
+
+# Shared by all the programs of the orbit folder
+DEFAULT_PATH = Path(__file__).parent.parent.resolve() / "catalog.db"
+
+EXIF_TIME_FORMAT = "%Y:%m:%d %H:%M:%S"
+
+INGEST_WORKERS = 8
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    path TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    time TEXT,
+    latitude REAL,
+    longitude REAL,
+    altitude REAL,
+    heading REAL
+);
+CREATE INDEX IF NOT EXISTS images_time ON images (time);
+CREATE INDEX IF NOT EXISTS images_position ON images (latitude, longitude);
+CREATE TABLE IF NOT EXISTS measurements (
+    path TEXT NOT NULL,
+    name TEXT NOT NULL,
+    value REAL,
+    PRIMARY KEY (path, name)
+);
+"""
+
+# Columns added to the images table since the first catalogs, with their type
+ADDED_COLUMNS = {"altitude": "REAL", "heading": "REAL"}
+
+# --------------------------------------
+# LIB
+# --------------------------------------
+
+def catalog_key(path) -> str:
+    """The absolute path identifying an image in the catalog, whatever the working directory of the tool."""
+    return str(Path(path).resolve())
+
+
+def capture_time(row) -> datetime:
+    """The capture time of a catalog row, aware of its timezone: EXIF times are UTC, the clock of the Astro Pi."""
+    return datetime.fromisoformat(row["time"]).replace(tzinfo=timezone.utc)
+
+
+def read_image_record(path: Path) -> tuple:
+    """Read the catalog row of an image from its file: path, name, size, mtime, ISO time, latitude, longitude,
+    altitude in meters and heading in degrees."""
+    stat = path.stat()
+    metadata = get_header_metadata(path)
+
+    time = latitude = longitude = altitude = heading = None
+    if "DateTimeOriginal" in metadata:
+        time = datetime.strptime(str(metadata["DateTimeOriginal"]), EXIF_TIME_FORMAT).isoformat(sep=" ")
+    if "GPSInfo" in metadata:
+        latitude, longitude = get_coordinates(metadata)
+        altitude, heading = get_altitude(metadata), get_heading(metadata)
+
+    return catalog_key(path), path.name, stat.st_size, stat.st_mtime, time, latitude, longitude, altitude, heading
+
+
+class Catalog:
+    """The catalog of the images and of their measurements.
+
+    Attributes:
+        db_path (Path): The path of the database.
+    """
+
+    def __init__(self, db_path: Path = DEFAULT_PATH) -> None:
+        self.db_path = Path(db_path)
+        self.connection = sqlite3.connect(str(self.db_path), timeout=60)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.executescript(SCHEMA)
+        self.upgrade()
+
+    def upgrade(self) -> None:
+        """Add the columns missing from a catalog created by an older version, its images being read again at the next ingest."""
+        columns = {row["name"] for row in self.connection.execute("PRAGMA table_info(images)")}
+        missing = [name for name in ADDED_COLUMNS if name not in columns]
+        if not missing:
+            return
+
+        with self.connection:
+            for name in missing:
+                self.connection.execute(f"ALTER TABLE images ADD COLUMN {name} {ADDED_COLUMNS[name]}")
+            self.connection.execute("UPDATE images SET mtime = -1")
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def ingest(self, paths: list, workers: int = INGEST_WORKERS) -> int:
+        """Add the new or modified images to the catalog.
+
+        Returns:
+            int: The number of images whose metadata was read.
+        """
+        known = {
+            row["path"]: (row["size"], row["mtime"])
+            for row in self.connection.execute("SELECT path, size, mtime FROM images")
+        }
+
+        changed = []
+        for path in map(Path, paths):
+            stat = path.stat()
+            if known.get(catalog_key(path)) != (stat.st_size, stat.st_mtime):
+                changed.append(path)
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            rows = list(executor.map(read_image_record, changed))
+
+        with self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+        return len(rows)
+
+    def ingest_folder(self, folder: Path, pattern: str = "*.jpg") -> int:
+        """Add the new or modified images of a folder to the catalog."""
+        return self.ingest(sorted(folder.glob(pattern)))
+
+    def lookup(self, paths: list) -> list:
+        """Return the rows of the given images, in the same order, None for the images not in the catalog."""
+        rows = {}
+        paths = [catalog_key(path) for path in paths]
+
+        # Stay below the limit on the number of SQL parameters
+        for start in range(0, len(paths), 500):
+            chunk = paths[start:start + 500]
+            query = f"SELECT * FROM images WHERE path IN ({', '.join('?' * len(chunk))})"
+            rows.update((row["path"], row) for row in self.connection.execute(query, chunk))
+
+        return [rows.get(path) for path in paths]
+
+    def sources(self, paths: list) -> list:
+        """Return the key of the catalogued image each path stands for: its own key when it is in the catalog, else
+        the one of the catalogued image of the same name and content it is a link or a copy of, e.g. in out/selected,
+        else its own key.
+        """
+        keys = []
+        for path, row in zip(paths, self.lookup(paths)):
+            key = catalog_key(path)
+            if row is None:
+                size = Path(path).stat().st_size
+                candidates = self.connection.execute("SELECT path FROM images WHERE name = ? AND size = ?", (Path(path).name, size))
+                key = next((row["path"] for row in candidates if Path(row["path"]).exists() and image_key(row["path"]) == image_key(path)), key)
+            keys.append(key)
+
+        return keys
+
+    def query(self, start: str = None, end: str = None, bounds: tuple = None) -> list:
+        """Return the rows of the images taken in a time range and area, sorted by time.
+
+        Args:
+            start (str): The earliest time, ISO format, e.g. "2023-05-02 10:00:00".
+            end (str): The latest time, ISO format.
+            bounds (tuple): (min latitude, min longitude, max latitude, max longitude) in degrees.
+
+        """
+        conditions, parameters = ["time IS NOT NULL"], []
+        if start is not None:
+            conditions.append("time >= ?")
+            parameters.append(start)
+        if end is not None:
+            conditions.append("time <= ?")
+            parameters.append(end)
+        if bounds is not None:
+            conditions.append("latitude BETWEEN ? AND ? AND longitude BETWEEN ? AND ?")
+            parameters += [bounds[0], bounds[2], bounds[1], bounds[3]]
+
+        query = f"SELECT * FROM images WHERE {' AND '.join(conditions)} ORDER BY time, path"
+        return self.connection.execute(query, parameters).fetchall()
+
+    def set_measurements(self, measurements: dict) -> None:
+        """Store measurements of images.
+
+        Args:
+            measurements (dict): The {name: value} measurements of each image by path, a value being a number or a bool.
+
+        """
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO measurements VALUES (?, ?, ?)",
+                [
+                    (catalog_key(path), name, None if value is None else float(value))
+                    for path, values in measurements.items()
+                    for name, value in values.items()
+                ],
+            )
+
+    def measurements(self, path: Path) -> dict:
+        """Return the {name: value} measurements of an image."""
+        rows = self.connection.execute("SELECT name, value FROM measurements WHERE path = ?", (catalog_key(path),))
+        return {row["name"]: row["value"] for row in rows}
+
+
+def main(argc, argv):
+    parser = argparse.ArgumentParser(prog="catalog", description="Ingest images into the catalog and query it")
+    parser.add_argument("--db", type=Path, default=DEFAULT_PATH, help="catalog database")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    ingest_parser = commands.add_parser("ingest", help="add the new or modified images of folders")
+    ingest_parser.add_argument("folders", type=Path, nargs="+", help="folders containing the images")
+
+    query_parser = commands.add_parser("query", help="list the images taken in a time range and area")
+    query_parser.add_argument("--start", default=None, help="earliest time, e.g. '2023-05-02 10:00:00'")
+    query_parser.add_argument("--end", default=None, help="latest time")
+    query_parser.add_argument("--bounds", type=float, nargs=4, default=None, metavar=("LAT_MIN", "LON_MIN", "LAT_MAX", "LON_MAX"))
+
+    args = parser.parse_args(argv[1:argc])
+    catalog = Catalog(args.db)
+
+    if args.command == "ingest":
+        for folder in args.folders:
+            print(f"{folder}: read the metadata of {catalog.ingest_folder(folder)} images")
+
+    elif args.command == "query":
+        for row in catalog.query(args.start, args.end, args.bounds):
+            measurements = catalog.measurements(row["path"])
+            print(f"{row['time']}  {row['latitude']:9.4f} {row['longitude']:9.4f}  {row['path']}  {measurements or ''}")
+
+    catalog.close()
+
+
+if __name__ == "__main__":
+    main(len(sys.argv), sys.argv)
@@ -3,20 +3,19 @@
 # --------------------------------------
 import os # Operating system dependent functionality
 import cv2 # Image processing
-import json
-from datetime import datetime
-from shutil import copy as copy_file # Move files
 from pathlib import Path  # Path utilities
 import numpy as np # Array manipulation
-from global_land_mask import globe # reverse geocoding for water
-from PIL import Image
-from PIL.ExifTags import TAGS
 
 from .ndvi import ndvi # Normalized Difference Vegetation Index
-from .gsd import gsd
-from .iss import iss_altitude
-from .bounding_box import bounding_box
-from utils.metadata import get_image_metadata, get_coordinates
+from .masks import CLOUD, WATER, mask_path, save_mask, load_exclusion, combine_masks # Bit-packed masks
+from .phash import HashIndex, save_clusters # Near-duplicate frames
+from .manifest import Manifest, LINK # Hand-off between classifiers
+from .prefetch import PrefetchReader # Read ahead while classifying
+from .catalog import Catalog, capture_time # Capture time and position of the images
+from .sun import solar_elevation # Sun elevation over the ground
+from .vignette import gather_valid, scatter_valid # Porthole valid region
+from .tiles import TILES, score_tiles, tiles_path # Tile-level usable area
+from .sampling import sampled_below, block_valid # Sampled percentage estimates
 
 
 # --------------------------------------
@@ -67,21 +66,43 @@ def load_images(folder: str):
     return images_path
 
 
-def otsu_cloud_mask(path):
+def otsu_cloud_mask(path, masks_dir=None):
     image = cv2.imread(str(path), cv2.IMREAD_GRAYSCALE)
     _, thresholded = cv2.threshold(image, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
     cloud_mask = thresholded != 0
+
+    # Store the cloud pixels so that later runs do not have to compute them again
+    if masks_dir is not None:
+        save_mask(mask_path(masks_dir, path, CLOUD), cloud_mask)
+
     return cloud_mask
 
-def threshold_cloud_mask(path, pixel_threshold):
+def threshold_cloud_mask(path, pixel_threshold, masks_dir=None):
     nir_image = cv2.imread(str(path), cv2.IMREAD_COLOR)
     nir_channel = nir_image[:, :, 1]  # Select the green challenge of each pixel
 
     _, mask = cv2.threshold(nir_channel, int(pixel_threshold * 255), 255, cv2.THRESH_BINARY)
     boolean_mask = mask == 0
+
+    # Store the cloud pixels so that later runs do not have to compute them again
+    if masks_dir is not None:
+        save_mask(mask_path(masks_dir, path, CLOUD), ~boolean_mask)
     
     return boolean_mask
 
+def ndvi_water_mask(image, ndvi_range):
+    """Classify water pixels of an image through its NDVI.
+
+    Args:
+        image (np.array): the BGR image.
+        ndvi_range: The ndvi range to distinguish water pixels.
+
+    Returns:
+        np.array: A boolean mask set on water pixels.
+    """
+    ndvi_values = ndvi(image)
+    return (ndvi_values < ndvi_range[1]) & (ndvi_values > ndvi_range[0])
+
 
 # --------------------------------------
 # CLASSIFIERS
@@ -90,23 +111,125 @@ class BaseClassifier:
     """The base class for a classifier
     
     Attributes:
-        images_path (Path): The path to the folder containing the images to be filtered.
-        out_dir (Path): The output folder that will contain the images filtered.
+        name (str): The name of the verdict the classifier adds to the manifest records.
+        images_path (Path | Manifest): The folder containing the images to be filtered, or the manifest of a previous stage.
+        out_dir (Path): The output folder that will contain the images filtered, None to only return the manifest.
+        masks_dir (Path): The folder where the bit-packed masks are stored, None to not store them.
+        exclude (list): The kinds of stored masks whose pixels are not taken into account.
+        region (ValidRegion): The valid region of the frames, None to take every pixel into account.
+        kept_masks (dict): The masks of each image by path string and kind, kept in memory, None to not keep them.
+        sampling (str): How the percentage classifiers sample blocks of pixels (see sampling.py), None to count every pixel.
     """
 
-    def __init__(self, images_path: Path, out_dir: Path) -> None:
+    name = "base"
+
+    def __init__(self, images_path, out_dir: Path = None, masks_dir: Path = None, exclude: list = (), region=None, kept_masks: dict = None, sampling: str = None) -> None:
         """ Instantiate the classifier.
 
         Args:
-            images_path (Path): The path to the folder containing the images to be filtered.
-            out_dir (Path): The output folder that will contain the images filtered.
+            images_path (Path | Manifest): The folder containing the images to be filtered, or the manifest of a previous stage.
+            out_dir (Path): The output folder that will contain the images filtered, None to only return the manifest.
+            masks_dir (Path): The folder where the bit-packed masks are stored, None to not store them.
+            exclude (list): The kinds of stored masks whose pixels are not taken into account, e.g. [CLOUD].
+            region (ValidRegion): The valid region of the frames (see vignette.py), None to take every pixel into account.
+            kept_masks (dict): A dictionary the masks computed are kept in, e.g. for pipeline.py, None to not keep them.
+            sampling (str): RANDOM or STRATIFIED to reject images from sampled blocks of pixels, the images kept still
+                being counted exactly when their masks are stored or kept, None to count every pixel.
 
         """
         self.images_path = images_path
         self.out_dir = out_dir
+        self.masks_dir = masks_dir
+        self.exclude = exclude
+        self.region = region
+        self.kept_masks = kept_masks
+        self.sampling = sampling
+
+    def manifest(self) -> Manifest:
+        """Return the manifest of the images to be filtered."""
+        if isinstance(self.images_path, Manifest):
+            return self.images_path
+
+        return Manifest.from_folder(self.images_path)
+
+    def start(self, *args) -> Manifest:
+        """Classify every image to be filtered, recording the value each one was judged on in its manifest record.
+
+        Args:
+            args: The parameters of the classifier, passed to classify().
+
+        Returns:
+            Manifest: The manifest of the images to keep, also linked into self.out_dir if given.
+        """
+        manifest = self.manifest()
+        kept = []
+
+        for path, image in PrefetchReader(manifest, self.read):
+            keep, value = self.classify(path, image, *args)
+
+            record = manifest.record(path)
+            record["verdicts"][self.name] = float(value)
+            if keep:
+                kept.append(path)
+            else:
+                record["selected"] = False
+
+        kept = manifest.subset(kept)
+        if self.out_dir is not None:
+            kept.materialise(self.out_dir, LINK)
+
+        return kept
+
+    def read(self, path: Path) -> np.array:
+        """Decode an image to be classified."""
+        return cv2.imread(str(path), cv2.IMREAD_COLOR)
+
+    def classify(self, path: Path, image: np.array, *args) -> tuple:
+        """Classify a single decoded image.
+
+        Args:
+            path (Path): The path of the image, used to store and load its masks.
+            image (np.array): The BGR image.
+            args: The parameters of the classifier.
+
+        Returns:
+            tuple: Whether to keep the image and the value it was judged on.
+        """
+        raise NotImplementedError
 
-    def start(self):
-        pass
+    def save_mask(self, path: Path, kind: str, mask: np.array) -> None:
+        """Store the mask of the given kind computed for an image, if a masks folder was given,
+        and keep it in memory if a dictionary was given."""
+        if self.kept_masks is not None:
+            self.kept_masks.setdefault(str(path), {})[kind] = mask
+
+        if self.masks_dir is not None:
+            save_mask(mask_path(self.masks_dir, path, kind), mask)
+
+    def stores_masks(self) -> bool:
+        """Whether the masks computed are stored or kept in memory."""
+        return self.masks_dir is not None or self.kept_masks is not None
+
+    def region_for(self, image: np.array):
+        """Return the valid region if it was estimated for frames of the size of the image, else None."""
+        if self.region is None or not self.region.fits(image):
+            return None
+
+        return self.region
+
+    def exclusion(self, path: Path, width: int) -> np.array:
+        """Load the union of the excluded masks of an image, None if there is nothing to exclude.
+        The masks kept in memory are used when there are some for the image."""
+        if not self.exclude:
+            return None
+
+        if self.kept_masks is not None and str(path) in self.kept_masks:
+            return combine_masks([self.kept_masks[str(path)].get(kind) for kind in self.exclude])
+
+        if self.masks_dir is None:
+            return None
+
+        return load_exclusion(self.masks_dir, path, self.exclude, width)
 
 
 
@@ -128,25 +251,156 @@ class WaterClassifier(BaseClassifier):
 """
 
 
+class DuplicateClassifier(BaseClassifier):
+    """Classifier to keep a single image out of each group of near-duplicate frames.
+
+    Attributes:
+        clusters (dict): The members of each cluster by representative path, once started.
+        unreadable (list): The images that could not be decoded, removed with an "unreadable" verdict, once started.
+    """
+
+    name = "duplicate"
+
+    def start(self, max_distance, report_path: Path = None) -> Manifest:
+        """Hash the images to be filtered from a reduced decode and cluster the ones whose hashes are
+        within max_distance of each other. Then it keeps the first image of each cluster, the others
+        record the representative they duplicate. The images that cannot be decoded are removed.
+
+        Args:
+            max_distance: The maximum Hamming distance between the hashes of two near-duplicate images.
+            report_path (Path): Where to save the membership of the clusters as JSON, None to not save it.
+
+        Returns:
+            Manifest: The manifest of the representatives, also linked into self.out_dir if given.
+        """
+        manifest = self.manifest()
+        index = HashIndex.from_paths(list(manifest))
+        self.clusters = index.clusters(max_distance)
+
+        hashed = set(map(str, index.paths))
+        self.unreadable = [path for path in manifest if str(path) not in hashed]
+        for path in self.unreadable:
+            record = manifest.record(path)
+            record["verdicts"]["unreadable"] = True
+            record["selected"] = False
+
+        for representative, members in self.clusters.items():
+            for member in members[1:]:
+                record = manifest.record(member)
+                record["verdicts"][self.name] = str(representative)
+                record["selected"] = False
+
+        kept = manifest.subset(self.clusters)
+        if self.out_dir is not None:
+            kept.materialise(self.out_dir, LINK)
+
+        if report_path is not None:
+            save_clusters(self.clusters, report_path)
+
+        return kept
+
+
+class SunElevationClassifier(BaseClassifier):
+    """Classifier to remove images taken at night from the time and position of the capture, without decoding them.
+
+    Attributes:
+        catalog (Catalog): The catalog the time and position of the images are ingested into and read from.
+        twilight (Manifest): The images kept whose darkness is left to a pixel-based check, once started: the ones
+            taken with the Sun between the night and the day elevations, or without a time or position.
+    """
+
+    name = "sun"
+
+    def __init__(self, images_path, catalog: Catalog, out_dir: Path = None) -> None:
+        super().__init__(images_path, out_dir)
+        self.catalog = catalog
+
+    def elevations(self, paths: list) -> list:
+        """Compute the elevation of the Sun over the ground point of each image in one vectorised pass.
+
+        Capture times are UTC, the clock of the Astro Pi.
+
+        Returns:
+            list: The elevation in degrees, None for the images without a time or position.
+        """
+        self.catalog.ingest(paths)
+        rows = self.catalog.lookup(paths)
+
+        known = [i for i, row in enumerate(rows) if row["time"] is not None and row["latitude"] is not None]
+        values = solar_elevation(
+            [capture_time(rows[i]).timestamp() for i in known],
+            [rows[i]["latitude"] for i in known],
+            [rows[i]["longitude"] for i in known],
+        )
+
+        elevations = [None] * len(rows)
+        for i, value in zip(known, values.tolist()):
+            elevations[i] = value
+
+        return elevations
+
+    def start(self, night_elevation, day_elevation) -> Manifest:
+        """Compute the elevation of the Sun for the images to be filtered. Then it removes the images taken
+        with the Sun below night_elevation and leaves the ones below day_elevation to a pixel-based check.
+
+        Args:
+            night_elevation: The elevation of the Sun in degrees under which the ground is too dark.
+            day_elevation: The elevation of the Sun in degrees over which the ground is lit enough.
+
+        Returns:
+            Manifest: The manifest of the images to keep, also linked into self.out_dir if given.
+        """
+        manifest = self.manifest()
+        paths = list(manifest)
+        kept, twilight = [], []
+
+        for path, elevation in zip(paths, self.elevations(paths)):
+            if elevation is None:
+                kept.append(path)
+                twilight.append(path)
+                continue
+
+            record = manifest.record(path)
+            record["verdicts"][self.name] = elevation
+            if elevation < night_elevation:
+                record["selected"] = False
+                continue
+
+            kept.append(path)
+            if elevation < day_elevation:
+                twilight.append(path)
+
+        self.twilight = manifest.subset(twilight)
+
+        kept = manifest.subset(kept)
+        if self.out_dir is not None:
+            kept.materialise(self.out_dir, LINK)
+
+        return kept
+
+
 class DarkImageClassifier(BaseClassifier):
     """Classifier to remove dark images.
     """
 
+    name = "dark"
+
     def start(self, threshold):
         """Analyze the images in self.images_path by turning the images into grayscale and 
-        calculating the average intensity of the pixels. Then it moves the non-dark images into self.out_dir.
+        calculating the average intensity of the pixels. Then it keeps the non-dark images.
 
         Args:
             threshold: The maximum average intensity to keep an image.
 
         """
-        for path in self.images_path.iterdir():
-            image = cv2.imread(str(path))
-            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-            avg_intensity = np.average(gray)
+        return super().start(threshold)
+
+    def classify(self, path, image, threshold):
+        # Only the pixels of the valid region are converted and averaged
+        gray = cv2.cvtColor(gather_valid(self.region_for(image), image), cv2.COLOR_BGR2GRAY)
+        avg_intensity = np.average(gray)
 
-            if avg_intensity > threshold:
-                copy_file(path, self.out_dir)
+        return avg_intensity > threshold, avg_intensity
 
 
 
@@ -154,28 +408,35 @@ class OtsuThresholdClassifier(BaseClassifier):
     """Classifier to remove images taken over clouds using the otsu method.
     """
 
+    name = "otsu"
+
     def start(self, percentage_threshold):
         """Analyze the images in self.images_path by applying the otsu method which is 
         calculating and applying the optimal threshold in order to distinguish the foreground (clouds) from the background for each image.
         After applying the threshold it calculates the percentage of the image covered by clouds and 
-        moves the images with a percentage lower than percentage_threshold into self.out_dir.
+        keeps the images with a percentage lower than percentage_threshold.
 
 
         Args:
             percentage_threshold: The maximum percentage of clouds to keep an image.
 
         """
-        for path in self.images_path.iterdir():
-            image = cv2.imread(str(path), cv2.IMREAD_GRAYSCALE)
-            _, thresholded = cv2.threshold(image, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-            
-            pixel_count = cv2.countNonZero(thresholded)
-            total_pixels = thresholded.size
+        return super().start(percentage_threshold)
+
+    def read(self, path):
+        return cv2.imread(str(path), cv2.IMREAD_GRAYSCALE)
+
+    def classify(self, path, image, percentage_threshold):
+        if image.ndim == 3:
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        _, thresholded = cv2.threshold(image, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+        
+        pixel_count = cv2.countNonZero(thresholded)
+        total_pixels = thresholded.size
 
-            percentage = round((pixel_count / total_pixels) * 100, 1)
+        percentage = round((pixel_count / total_pixels) * 100, 1)
 
-            if percentage < percentage_threshold:
-                copy_file(path, self.out_dir)
+        return percentage < percentage_threshold, percentage
 
 
 
@@ -183,60 +444,153 @@ class ThresholdClassifier(BaseClassifier):
     """A simple threshold classifier to remove images taken over clouds.
     """
 
+    name = "cloud"
+
     def start(self, pixel_threshold, percentage_threshold):
         """Analyze the images in self.images_path by selecting the green channel and applying a pixel_threshold 
         in order to distinguish between cloud pixels and non-cloud pixels.
         It then calculates the percentage of cloud pixels for each image in order to decide whether to discard or 
-        copy the image into self.out_dir.
+        keep the image.
 
         Args:
             pixel_threshold: The threshold to apply to each pixel of each image.
             percentage_threshold: The maximum percentage of clouds to keep an image.
 
         """
-        for path in self.images_path.iterdir():
-            nir_image = cv2.imread(str(path), cv2.IMREAD_COLOR)
-            nir_channel = nir_image[:, :, 1]  # Select the green challenge of each pixel
+        return super().start(pixel_threshold, percentage_threshold)
+
+    def classify(self, path, nir_image, pixel_threshold, percentage_threshold):
+        # Only the pixels of the valid region are classified
+        region = self.region_for(nir_image)
+        excluded = self.exclusion(path, nir_image.shape[1])
+
+        # Decide from sampled blocks when the image is far enough from the threshold
+        if self.sampling is not None:
+            def count(rows, cols):
+                cloud = nir_image[rows, cols, 1] > int(pixel_threshold * 255)
+                valid = block_valid(region, excluded, rows, cols)
+                if valid is None:
+                    return np.count_nonzero(cloud), cloud.size
+                return np.count_nonzero(cloud & valid), np.count_nonzero(valid)
+
+            decision = sampled_below(count, nir_image.shape[:2], percentage_threshold, self.sampling, region)
+            # The images kept are counted exactly below, for the masks their analysis leaves out
+            if decision is not None and not (decision[0] and self.stores_masks()):
+                return decision
 
-            _, mask = cv2.threshold(nir_channel, int(pixel_threshold * 255), 255, cv2.THRESH_BINARY)
+        nir_channel = gather_valid(region, nir_image)[:, :, 1]  # Select the green challenge of each pixel
 
-            red_mask = np.zeros_like(nir_image)  # Array with same size of nir_image filled with 0s
-            red_mask[:, :, 2] = mask  # Set the red channel of the mask to the cloud mask
+        _, mask = cv2.threshold(nir_channel, int(pixel_threshold * 255), 255, cv2.THRESH_BINARY)
+        cloud_mask = mask != 0
+        self.save_mask(path, CLOUD, scatter_valid(region, cloud_mask, False))
 
-            total_pixels = mask.size
+        total_pixels = mask.size
 
-            # Count the number of cloud pixels
-            pixel_count = np.count_nonzero(mask)
+        # Leave out the excluded pixels
+        if excluded is not None:
+            excluded = gather_valid(region, excluded)
+            cloud_mask &= ~excluded
+            total_pixels -= np.count_nonzero(excluded)
 
-            # Calculate the percentage of cloud pixels
-            percentage = round((pixel_count / total_pixels) * 100, 1)
+        # Count the number of cloud pixels
+        pixel_count = np.count_nonzero(cloud_mask)
 
-            if percentage < percentage_threshold:
-                copy_file(path, self.out_dir)
+        # Calculate the percentage of cloud pixels
+        percentage = round((pixel_count / max(total_pixels, 1)) * 100, 1)
+
+        return percentage < percentage_threshold, percentage
 
 
 class NDVIClassifier(BaseClassifier):
     """A classifier to remove images taken over water that makes use of the ndvi in order to distinguish water pixels"""
 
+    name = "sea"
+
     def start(self, ndvi_range, percentage_threshold):
         """Analyze the images in self.images_path by calculating the ndvi over each image and 
         classifying water pixels using the ndvi range provided. Then it calculates the percentage of water pixels for each image 
-        to decide whether to discard it or copy it in self.out_dir.
+        to decide whether to discard it or keep it.
 
         Args:
             ndvi_range: The ndvi range to distinguish water pixels.
             percentage_threshold: The maximum percentage of water to keep an image.
 
         """
-        for path in self.images_path.iterdir():
-            image = cv2.imread(str(path), cv2.IMREAD_COLOR)
-            image_pixels = np.array(image, dtype=float) / float(255)
+        return super().start(ndvi_range, percentage_threshold)
+
+    def classify(self, path, image, ndvi_range, percentage_threshold):
+        # Only the pixels of the valid region are classified
+        region = self.region_for(image)
+        excluded = self.exclusion(path, image.shape[1])
+
+        # Decide from sampled blocks when the image is far enough from the threshold, on the same per-channel scale
+        if self.sampling is not None:
+            def count(rows, cols):
+                water = ndvi_water_mask(np.array(image[rows, cols], dtype=float) / float(255), ndvi_range)
+                valid = block_valid(region, excluded, rows, cols)
+                if valid is None:
+                    return np.count_nonzero(water), water.size * image.shape[2]
+                return np.count_nonzero(water & valid), np.count_nonzero(valid) * image.shape[2]
+
+            decision = sampled_below(count, image.shape[:2], percentage_threshold, self.sampling, region)
+            # The images kept are counted exactly below, for the masks their analysis leaves out
+            if decision is not None and not (decision[0] and self.stores_masks()):
+                return decision
+
+        image_pixels = np.array(gather_valid(region, image), dtype=float) / float(255)
+
+        total_pixels = image_pixels.size
+        water_mask = ndvi_water_mask(image_pixels, ndvi_range)
+        self.save_mask(path, WATER, scatter_valid(region, water_mask, False))
+
+        # Leave out the excluded pixels (e.g. clouds), keeping the per-channel scale the threshold was tuned on
+        if excluded is not None:
+            excluded = gather_valid(region, excluded)
+            water_mask &= ~excluded
+            total_pixels -= np.count_nonzero(excluded) * image_pixels.shape[2]
+
+        pixel_count = np.count_nonzero(water_mask)
+
+        percentage = round((pixel_count / max(total_pixels, 1)) * 100, 1)
+
+        return percentage < percentage_threshold, percentage
+
+
+class TileClassifier(BaseClassifier):
+    """Classifier keeping the images with enough usable tiles, each tile being judged for dark, cloud and sea
+    with the thresholds of DarkImageClassifier, ThresholdClassifier and NDVIClassifier.
+    """
+
+    name = "tiles"
+
+    def start(self, dark_threshold, pixel_threshold, cloud_threshold, ndvi_range, sea_threshold, min_valid):
+        """Analyze the images in self.images_path by scoring each of their tiles for dark, cloud and sea.
+        The grid of valid tiles of each image is stored with its masks, and the images whose valid tiles
+        cover at least min_valid percent of the valid region are kept.
+
+        Args:
+            dark_threshold: The maximum average intensity to keep a tile.
+            pixel_threshold: The threshold to apply to the green value of each pixel to find clouds.
+            cloud_threshold: The maximum percentage of clouds to keep a tile.
+            ndvi_range: The ndvi range to distinguish water pixels.
+            sea_threshold: The maximum percentage of water to keep a tile.
+            min_valid: The minimum percentage of the image covered by valid tiles to keep it.
+
+        """
+        return super().start(dark_threshold, pixel_threshold, cloud_threshold, ndvi_range, sea_threshold, min_valid)
+
+    def classify(self, path, image, dark_threshold, pixel_threshold, cloud_threshold, ndvi_range, sea_threshold, min_valid):
+        grid, cloud_mask, water_mask = score_tiles(image, pixel_threshold, ndvi_range, self.region_for(image))
+        grid.judge(dark_threshold, cloud_threshold, sea_threshold)
 
-            total_pixels = image_pixels.size
-            ndvi_values = ndvi(image_pixels)
-            pixel_count = np.count_nonzero((ndvi_values < ndvi_range[1]) & (ndvi_values > ndvi_range[0]))
+        # The masks and the grid let main.py leave out the cloud and water pixels and the invalid tiles
+        self.save_mask(path, CLOUD, cloud_mask)
+        self.save_mask(path, WATER, water_mask)
+        if self.kept_masks is not None:
+            self.kept_masks.setdefault(str(path), {})[TILES] = grid
+        if self.masks_dir is not None:
+            grid.save(tiles_path(self.masks_dir, path))
 
-            percentage = round((pixel_count / total_pixels) * 100, 1)
+        percentage = round(grid.valid_fraction * 100, 1)
 
-            if percentage < percentage_threshold:
-                copy_file(path, self.out_dir)
+        return percentage >= min_valid, percentage
@@ -0,0 +1,256 @@
+"""
+LOCAL HISTORIC NDVI
+
+Compute the mean NDVI over each ROI of bounding_boxes.csv from red and near-infrared rasters stored locally
+(for example Sentinel-2 B4/B8 extracts), instead of running earth_engine/ndvi.js by hand.
+Only the pixel window intersecting each ROI is read, and ROIs are processed in parallel.
+The output is the same FeatureCollection as the Earth Engine export, so main.py reads it unchanged.
+
+A folder of rasters holds, for each tile, either:
+    <tile>_B4.tif and <tile>_B8.tif     GeoTIFFs, read with rasterio
+    <tile>_B4.npy and <tile>_B8.npy     2D arrays, with <tile>.json holding {"transform": [x0, dx, 0, y0, 0, dy]}
+                                        in the GDAL order and in degrees of longitude/latitude
+"""
+
+import sys
+import csv
+import json
+from math import ceil, floor, sqrt
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+try:
+    import rasterio
+    from rasterio.windows import Window
+    from rasterio.warp import transform_bounds
+except ImportError:  # GeoTIFF support is optional
+    rasterio = None
+
+# --------------------------------------
+# CONSTANTS
+# --------------------------------------
+
+RED_BAND = "B4"
+NIR_BAND = "B8"
+
+# Above this many pixels a window is read with a stride, like bestEffort in Earth Engine
+MAX_PIXELS = 10**7
+
+# Rows of a window processed at once
+CHUNK_ROWS = 1024
+
+# --------------------------------------
+# LIB
+# --------------------------------------
+
+class RasterTile:
+    """A pair of red and near-infrared rasters covering the same area.
+
+    Attributes:
+        name (str): The name of the tile.
+        transform (tuple): The GDAL geotransform (x0, dx, 0, y0, 0, dy).
+        shape (tuple): The (height, width) of the rasters.
+    """
+
+    def __init__(self, name: str, transform: tuple, shape: tuple) -> None:
+        self.name = name
+        self.transform = transform
+        self.shape = shape
+
+    def window(self, bounds: tuple) -> tuple:
+        """Return the (row0, row1, col0, col1) pixel window of the tile intersecting the bounds, None if they do not intersect.
+
+        Args:
+            bounds (tuple): (xmin, ymin, xmax, ymax) in the coordinates of the tile.
+
+        """
+        x0, dx, _, y0, _, dy = self.transform
+        xmin, ymin, xmax, ymax = bounds
+
+        cols = sorted(((xmin - x0) / dx, (xmax - x0) / dx))
+        rows = sorted(((ymin - y0) / dy, (ymax - y0) / dy))
+
+        col0, col1 = max(floor(cols[0]), 0), min(ceil(cols[1]), self.shape[1])
+        row0, row1 = max(floor(rows[0]), 0), min(ceil(rows[1]), self.shape[0])
+
+        if row0 >= row1 or col0 >= col1:
+            return None
+
+        return row0, row1, col0, col1
+
+    def project(self, bounds: tuple) -> tuple:
+        """Convert (xmin, ymin, xmax, ymax) bounds in longitude/latitude degrees to the coordinates of the tile."""
+        return bounds
+
+    def read(self, rows: slice, cols: slice) -> tuple:
+        """Read the red and near-infrared pixels of a window, the slices may have a step."""
+        raise NotImplementedError
+
+
+class NumpyTile(RasterTile):
+    """A tile stored as .npy arrays, memory-mapped so that only the window is read."""
+
+    def __init__(self, red_path: Path, nir_path: Path, georef_path: Path) -> None:
+        self.red = np.load(red_path, mmap_mode="r")
+        self.nir = np.load(nir_path, mmap_mode="r")
+
+        with open(georef_path, "r") as f:
+            transform = tuple(json.load(f)["transform"])
+
+        super().__init__(georef_path.stem, transform, self.red.shape)
+
+    def read(self, rows, cols):
+        return np.asarray(self.red[rows, cols]), np.asarray(self.nir[rows, cols])
+
+
+class GeoTiffTile(RasterTile):
+    """A tile stored as GeoTIFFs, read window by window with rasterio."""
+
+    def __init__(self, red_path: Path, nir_path: Path) -> None:
+        self.red_path = red_path
+        self.nir_path = nir_path
+
+        with rasterio.open(red_path) as src:
+            self.crs = src.crs
+            super().__init__(red_path.stem[:-len(RED_BAND) - 1], src.transform.to_gdal(), (src.height, src.width))
+
+    def project(self, bounds):
+        return transform_bounds("EPSG:4326", self.crs, *bounds)
+
+    def read(self, rows, cols):
+        window = Window(cols.start, rows.start, cols.stop - cols.start, rows.stop - rows.start)
+        out_shape = (len(range(rows.start, rows.stop, rows.step or 1)), len(range(cols.start, cols.stop, cols.step or 1)))
+
+        # rasterio decimates to out_shape, using the overviews when the file has them
+        with rasterio.open(self.red_path) as red, rasterio.open(self.nir_path) as nir:
+            return red.read(1, window=window, out_shape=out_shape), nir.read(1, window=window, out_shape=out_shape)
+
+
+def find_tiles(folder: Path) -> list:
+    """Find the tiles of a folder of rasters."""
+    tiles = []
+
+    for red_path in sorted(folder.glob(f"*_{RED_BAND}.npy")):
+        name = red_path.name[:-len(f"_{RED_BAND}.npy")]
+        nir_path = folder / f"{name}_{NIR_BAND}.npy"
+        if nir_path.exists() and (folder / f"{name}.json").exists():
+            tiles.append(NumpyTile(red_path, nir_path, folder / f"{name}.json"))
+
+    for red_path in sorted(folder.glob(f"*_{RED_BAND}.tif")):
+        nir_path = red_path.with_name(red_path.name.replace(f"_{RED_BAND}.tif", f"_{NIR_BAND}.tif"))
+        if nir_path.exists():
+            if rasterio is None:
+                raise ImportError("rasterio is required to read GeoTIFF rasters")
+            tiles.append(GeoTiffTile(red_path, nir_path))
+
+    return tiles
+
+
+def window_ndvi_sum(tile: RasterTile, window: tuple, max_pixels: int = MAX_PIXELS) -> tuple:
+    """Sum the NDVI of the valid pixels of a window, pixels where red + nir is 0 being no data.
+
+    Returns:
+        tuple: The sum of the NDVI values and the number of pixels summed.
+    """
+    row0, row1, col0, col1 = window
+    step = max(ceil(sqrt((row1 - row0) * (col1 - col0) / max_pixels)), 1)
+
+    total = 0.0
+    count = 0
+
+    for start in range(row0, row1, CHUNK_ROWS * step):
+        rows = slice(start, min(start + CHUNK_ROWS * step, row1), step)
+        red, nir = tile.read(rows, slice(col0, col1, step))
+
+        red = red.astype(np.float32)
+        nir = nir.astype(np.float32)
+        bottom = nir + red
+        valid = bottom > 0
+
+        total += float(np.sum((nir[valid] - red[valid]) / bottom[valid], dtype=np.float64))
+        count += int(np.count_nonzero(valid))
+
+    return total, count
+
+
+def roi_mean_ndvi(tiles: list, bounds: tuple) -> float:
+    """Compute the mean NDVI over a ROI, which may span several tiles.
+
+    Args:
+        tiles (list): The tiles of a year.
+        bounds (tuple): (xmin, ymin, xmax, ymax) of the ROI in longitude/latitude degrees.
+
+    Returns:
+        float: The mean NDVI, None if no tile covers the ROI.
+    """
+    total = 0.0
+    count = 0
+
+    for tile in tiles:
+        window = tile.window(tile.project(bounds))
+        if window is None:
+            continue
+
+        tile_total, tile_count = window_ndvi_sum(tile, window)
+        total += tile_total
+        count += tile_count
+
+    return total / count if count else None
+
+
+def read_boxes(path: Path) -> list:
+    """Read the ROIs written by bounding_box.py as (path, (xmin, ymin, xmax, ymax)) pairs."""
+    with open(path, "r", newline="") as f:
+        return [
+            (row["path"], (float(row["xmin"]), float(row["ymin"]), float(row["xmax"]), float(row["ymax"])))
+            for row in csv.DictReader(f)
+        ]
+
+
+def historic_ndvi(boxes: list, folder: Path, workers: int = None) -> dict:
+    """Compute the mean NDVI of each ROI from the rasters of a folder, processing the ROIs in parallel.
+
+    Returns:
+        dict: The mean NDVI by ROI path, None for the ROIs no raster covers.
+    """
+    tiles = find_tiles(folder)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        means = executor.map(lambda box: roi_mean_ndvi(tiles, box[1]), boxes)
+        return {path: mean for (path, _), mean in zip(boxes, means)}
+
+
+def write_feature_collection(boxes: list, means: dict, path: Path) -> None:
+    """Write the mean NDVI of each ROI in the same FeatureCollection structure as the Earth Engine export."""
+    features = []
+    for roi, (xmin, ymin, xmax, ymax) in boxes:
+        features.append({
+            "type": "Feature",
+            "geometry": {
+                "type": "Polygon",
+                "coordinates": [[[xmin, ymin], [xmax, ymin], [xmax, ymax], [xmin, ymax], [xmin, ymin]]],
+            },
+            "properties": {"path": roi, "mean_ndvi": means[roi]},
+        })
+
+    with open(path, "w") as f:
+        json.dump({"type": "FeatureCollection", "features": features}, f, indent=2)
+
+
+def main(argc, argv):
+    # check arguments
+    if argc != 4:
+        print("Usage: python3 historic.py <bounding_boxes.csv> <rasters folder> <output json>")
+        return
+
+    boxes = read_boxes(Path(argv[1]))
+    means = historic_ndvi(boxes, Path(argv[2]))
+    write_feature_collection(boxes, means, Path(argv[3]))
+
+    print(f"Mean NDVI calculated for {sum(mean is not None for mean in means.values())} of {len(boxes)} ROIs")
+
+
+if __name__ == "__main__":
+    main(len(sys.argv), sys.argv)
@@ -3,10 +3,11 @@ Some functions to get info about ISS
 """
 
 import sys
-import requests
 
 def iss_altitude(timestamp) -> float:
-    """The function to get the ISS altitude given a timestamp"""
+    """The function to get the ISS altitude given a UNIX timestamp (seconds since the epoch, UTC)"""
+    import requests  # only needed when the API is queried
+
     api_url = f"https://api.wheretheiss.at/v1/satellites/25544?timestamp={timestamp}"
     r = requests.get(api_url).json()
     
@@ -0,0 +1,122 @@
+"""
+MANIFEST OF IMAGES AND VERDICTS
+
+The classifiers hand each other a manifest of the images they accepted instead of copying them between folders.
+Each record holds the path of an image, the value every stage judged it on and whether it is still selected.
+Only the final selection is materialised on disk, as links by default.
+
+On disk a manifest is a JSON lines file, one record per line:
+    {"path": "...", "verdicts": {"dark": 72.4, "cloud": 3.1}, "selected": true}
+"""
+
+import os
+import json
+from shutil import copy as copy_file
+from pathlib import Path
+
+# --------------------------------------
+# CONSTANTS
+# --------------------------------------
+
+# How the selected images are materialised
+LINK = "link"  # hard links, symbolic links when the output is on another file system
+SYMLINK = "symlink"
+COPY = "copy"
+
+# --------------------------------------
+# LIB
+# --------------------------------------
+
+def new_record(path: Path) -> dict:
+    """Create the record of an image that has not been judged yet."""
+    return {"path": str(path), "verdicts": {}, "selected": True}
+
+
+def append_record(f, record: dict) -> None:
+    """Append a record to an open manifest file, flushing it so it survives crashes."""
+    f.write(json.dumps(record) + "\n")
+    f.flush()
+
+
+class Manifest:
+    """An ordered collection of image records.
+
+    Records are shared between the manifests derived from each other, so the verdicts added
+    by a stage on the records it accepted are visible from the manifest it started from.
+
+    Attributes:
+        records (dict): The records by path string.
+    """
+
+    def __init__(self, records: list = ()) -> None:
+        self.records = {record["path"]: record for record in records}
+
+    @classmethod
+    def from_folder(cls, folder: Path, pattern: str = "*.jpg") -> "Manifest":
+        """Create a manifest of all the images of a folder."""
+        return cls([new_record(path) for path in sorted(folder.glob(pattern))])
+
+    @classmethod
+    def load(cls, path: Path) -> "Manifest":
+        """Load a manifest from a JSON lines file, an empty one if it does not exist."""
+        if not path.exists():
+            return cls()
+
+        with open(path, "r") as f:
+            return cls([json.loads(line) for line in f if line.strip()])
+
+    def save(self, path: Path) -> None:
+        """Save the manifest as a JSON lines file."""
+        with open(path, "w") as f:
+            for record in self.records.values():
+                f.write(json.dumps(record) + "\n")
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def __iter__(self):
+        """Iterate over the paths of the images."""
+        return (Path(path) for path in self.records)
+
+    def __contains__(self, path) -> bool:
+        return str(path) in self.records
+
+    def record(self, path: Path) -> dict:
+        """Return the record of an image."""
+        return self.records[str(path)]
+
+    def subset(self, paths: list) -> "Manifest":
+        """Return the manifest of the given images, sharing their records."""
+        return Manifest([self.records[str(path)] for path in paths])
+
+    def selected(self) -> "Manifest":
+        """Return the manifest of the images still selected."""
+        return Manifest([record for record in self.records.values() if record["selected"]])
+
+    def materialise(self, out_dir: Path, mode: str = LINK) -> None:
+        """Make the images of the manifest appear in out_dir.
+
+        Args:
+            out_dir (Path): The output folder.
+            mode (str): LINK for hard links (symbolic links across file systems), SYMLINK or COPY.
+
+        """
+        out_dir.mkdir(parents=True, exist_ok=True)
+
+        for path in self:
+            target = out_dir / path.name
+            if target.exists() or target.is_symlink():
+                target.unlink()
+
+            if mode == COPY:
+                copy_file(path, target)
+                continue
+
+            if mode == LINK:
+                try:
+                    os.link(path, target)
+                    continue
+                except OSError:
+                    pass
+
+            target.symlink_to(path.resolve())
@@ -0,0 +1,121 @@
+"""
+BIT-PACKED IMAGE MASKS
+
+Cloud and water masks are computed once per image and stored with `np.packbits`, one bit per pixel,
+next to the other results. Packed masks can be combined and counted without unpacking them.
+
+The masks of an image are named after its name and a digest of its content, so that the links and copies of an image
+share its masks while another image of the same name, e.g. img_0000.jpg of another mission, or a modified file never
+picks them up.
+"""
+
+import hashlib
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+
+# --------------------------------------
+# CONSTANTS
+# --------------------------------------
+
+CLOUD = "cloud"
+WATER = "water"
+
+# Bytes of the digest identifying the content of an image
+KEY_BYTES = 8
+
+# Number of set bits of every byte value
+POPCOUNT = np.array([bin(value).count("1") for value in range(256)], dtype=np.uint8)
+
+# --------------------------------------
+# FUNCTIONS
+# --------------------------------------
+
+@lru_cache(maxsize=4096)
+def content_digest(path: str, size: int, mtime_ns: int) -> str:
+    """Digest of the content of a file, cached as long as its size and modification time do not change."""
+    digest = hashlib.blake2b(digest_size=KEY_BYTES)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(2**20), b""):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def image_key(image_path: Path) -> str:
+    """Return the name identifying an image among the stored masks, e.g. img_0005.3f9a0c1d2e4b5a69"""
+    path = Path(image_path)
+    stat = path.stat()
+    return f"{path.stem}.{content_digest(str(path.resolve()), stat.st_size, stat.st_mtime_ns)}"
+
+
+def mask_path(masks_dir: Path, image_path: Path, kind: str) -> Path:
+    """Return the path of the mask of the given kind for an image, e.g. masks/img_0005.3f9a0c1d2e4b5a69.cloud.npy"""
+    return Path(masks_dir) / f"{image_key(image_path)}.{kind}.npy"
+
+
+def pack_mask(mask: np.ndarray) -> np.ndarray:
+    """Pack a (height, width) boolean mask into a (height, ceil(width / 8)) uint8 array."""
+    return np.packbits(mask, axis=1)
+
+
+def unpack_mask(packed: np.ndarray, width: int) -> np.ndarray:
+    """Unpack a packed mask into a (height, width) boolean array."""
+    return np.unpackbits(packed, axis=1, count=width).view(bool)
+
+
+def save_mask(path: Path, mask: np.ndarray) -> None:
+    """Pack and save a boolean mask."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    np.save(path, pack_mask(mask))
+
+
+def load_mask(path: Path) -> np.ndarray:
+    """Load a packed mask as a read-only memory-mapped view, None if it does not exist."""
+    if not path.exists():
+        return None
+
+    return np.load(path, mmap_mode="r")
+
+
+def combine_masks(masks: list) -> np.ndarray:
+    """Combine packed masks with a bitwise or, ignoring missing ones.
+
+    Returns:
+        np.ndarray: The packed union of the masks, None if all of them are missing.
+    """
+    masks = [mask for mask in masks if mask is not None]
+    if not masks:
+        return None
+
+    combined = np.array(masks[0])
+    for mask in masks[1:]:
+        np.bitwise_or(combined, mask, out=combined)
+
+    return combined
+
+
+def count_mask(packed: np.ndarray) -> int:
+    """Count the pixels set in a packed mask."""
+    return int(POPCOUNT[packed].sum(dtype=np.int64))
+
+
+def load_exclusion(masks_dir: Path, image_path: Path, kinds: list, width: int) -> np.ndarray:
+    """Load the union of the stored masks of the given kinds for an image.
+
+    Args:
+        masks_dir (Path): the folder containing the masks.
+        image_path (Path): the path of the image the masks belong to.
+        kinds (list): the kinds of masks to exclude, e.g. [CLOUD, WATER].
+        width (int): the width of the image in pixels.
+
+    Returns:
+        np.ndarray: A boolean mask set on the pixels to exclude, None if no mask is stored.
+    """
+    packed = combine_masks([load_mask(mask_path(masks_dir, image_path, kind)) for kind in kinds])
+    if packed is None:
+        return None
+
+    return unpack_mask(packed, width)
+
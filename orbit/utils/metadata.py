@@ -1,5 +1,16 @@
+import struct
 from PIL import Image, ExifTags
 
+# JPEG markers
+SOI = b"\xff\xd8"
+APP1 = 0xE1
+SOS = 0xDA
+EOI = 0xD9
+
+# EXIF sub-IFDs
+EXIF_IFD = 0x8769
+GPS_IFD = 0x8825
+
 def get_coordinates(metadata):
     latitude_ref = metadata['GPSInfo'][1]
     latitude = metadata['GPSInfo'][2]
@@ -27,6 +38,29 @@ def get_coordinates(metadata):
     return latitude_decimal, longitude_decimal
 
 
+def get_altitude(metadata):
+    """The altitude in meters above sea level saved by the capture program, None for images without it."""
+    gps = metadata.get('GPSInfo', {})
+    if 6 not in gps:
+        return None
+
+    altitude = float(gps[6])
+    # GPSAltitudeRef 1 means below sea level
+    if gps.get(5) in (1, b'\x01'):
+        altitude *= -1
+
+    return altitude
+
+
+def get_heading(metadata):
+    """The ground-track heading in degrees clockwise from true north saved by the capture program, None for images without it."""
+    gps = metadata.get('GPSInfo', {})
+    if 15 not in gps:
+        return None
+
+    return float(gps[15])
+
+
 def get_image_metadata(image_path):
     with Image.open(image_path) as img:
         metadata = img._getexif()
@@ -41,3 +75,50 @@ def get_image_metadata(image_path):
             decoded_metadata[tag_name] = value
 
     return decoded_metadata
+
+
+def read_exif_segment(image_path):
+    """Read the raw EXIF segment of a JPEG by walking its header markers, without touching the compressed data.
+
+    Return the APP1 segment payload, None if the image has no EXIF data.
+    """
+    with open(image_path, "rb") as f:
+        if f.read(2) != SOI:
+            return None
+
+        while True:
+            marker = f.read(2)
+            if len(marker) < 2 or marker[0] != 0xFF or marker[1] in (SOS, EOI):
+                return None
+
+            length = struct.unpack(">H", f.read(2))[0]
+            if marker[1] == APP1:
+                data = f.read(length - 2)
+                if data.startswith(b"Exif\x00\x00"):
+                    return data
+            else:
+                f.seek(length - 2, 1)
+
+
+def get_header_metadata(image_path):
+    """A faster get_image_metadata reading only the EXIF segment of the file.
+
+    Return the same decoded tags, with GPSInfo and the tags of the EXIF sub-IFD such as DateTimeOriginal.
+    """
+    data = read_exif_segment(image_path)
+    if data is None:
+        return {}  # No metadata found
+
+    exif = Image.Exif()
+    exif.load(data)
+
+    decoded_metadata = {}
+    for tag, value in list(exif.items()) + list(exif.get_ifd(EXIF_IFD).items()):
+        if tag in ExifTags.TAGS:
+            decoded_metadata[ExifTags.TAGS[tag]] = value
+
+    gps = exif.get_ifd(GPS_IFD)
+    if gps:
+        decoded_metadata["GPSInfo"] = dict(gps)
+
+    return decoded_metadata
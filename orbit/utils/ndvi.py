@@ -5,6 +5,9 @@ PYTHON MODULE FOR IMAGE PROCESSING AND NDVI CALCULATIONS
 import cv2
 import numpy as np
 
+from .masks import unpack_mask
+from .vignette import gather_valid
+
 def ndvi(image) -> np.ndarray:
     """Calculate NDVI on the given image.
 
@@ -19,16 +22,33 @@ def ndvi(image) -> np.ndarray:
     
     return ndvi
 
-def mean_ndvi(image, remove_negatives=False) -> float:
+def mean_ndvi(image, remove_negatives=False, exclude=None, region=None, tiles=None) -> float:
     """ Calculate the mean NDVI value over all the pixels of the given image.
 
+    Pixels set in `exclude`, a boolean or bit-packed mask (see masks.py), are not taken into account.
+    With a valid region (see vignette.py), only the pixels inside it are read.
+    With a judged tile grid (see tiles.py), only the pixels of the valid tiles are taken into account.
+
     Return a float representing the mean NDVI value of the image.
     """
 
-    ndvi_array = ndvi(image)
-    
+    width = image.shape[1]
+    if region is not None and not region.fits(image):
+        region = None
+
+    ndvi_array = ndvi(gather_valid(region, image))
+
+    if exclude is not None and exclude.dtype != bool:
+        exclude = unpack_mask(exclude, width)
+
+    if tiles is not None and tiles.fits(image):
+        exclude = tiles.invalid_pixels() if exclude is None else exclude | tiles.invalid_pixels()
+
+    if exclude is not None:
+        ndvi_array = ndvi_array[~gather_valid(region, exclude)]
+
     if remove_negatives:
-        ndvi_array = [ndvi_array[i][j] for i in range(ndvi_array.shape[0]) for j in range(ndvi_array.shape[1]) if ndvi_array[i,j] >= 0]
+        ndvi_array = ndvi_array[ndvi_array >= 0]
     mean_ndvi = np.mean(ndvi_array)
 
     return mean_ndvi
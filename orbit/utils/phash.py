@@ -0,0 +1,129 @@
+"""
+PERCEPTUAL HASHES FOR NEAR-DUPLICATE FRAMES
+
+64-bit dHash and pHash computed from a reduced JPEG decode (1/8 scale, done by libjpeg itself),
+an index to look up hashes by Hamming distance and a clustering of near-duplicate frames.
+"""
+
+import json
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from .masks import POPCOUNT
+
+# --------------------------------------
+# CONSTANTS
+# --------------------------------------
+
+# Maximum Hamming distance between the hashes of two near-duplicate frames
+MAX_DISTANCE = 4
+
+# --------------------------------------
+# FUNCTIONS
+# --------------------------------------
+
+def read_reduced(path: Path) -> np.ndarray:
+    """Decode an image in grayscale at 1/8 of its resolution."""
+    return cv2.imread(str(path), cv2.IMREAD_REDUCED_GRAYSCALE_8)
+
+
+def bits_to_hash(bits: np.ndarray) -> np.uint64:
+    """Pack 64 booleans into a 64-bit hash, first bit most significant."""
+    return np.packbits(bits.ravel()).view(">u8").astype(np.uint64)[0]
+
+
+def dhash(gray: np.ndarray) -> np.uint64:
+    """Difference hash: whether each pixel of a 9x8 thumbnail is brighter than its left neighbour."""
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    return bits_to_hash(small[:, 1:] > small[:, :-1])
+
+
+def phash(gray: np.ndarray) -> np.uint64:
+    """DCT hash: whether each of the 8x8 lowest frequencies of a 32x32 thumbnail is above their median."""
+    small = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:8, :8]
+    return bits_to_hash(low > np.median(low.ravel()[1:]))
+
+
+HASHES = {"dhash": dhash, "phash": phash}
+
+
+def hash_file(path: Path, method: str = "dhash") -> np.uint64:
+    """Hash an image file, None if it could not be read."""
+    gray = read_reduced(path)
+    if gray is None:
+        return None
+
+    return HASHES[method](gray)
+
+
+def hamming(hash: np.uint64, hashes: np.ndarray) -> np.ndarray:
+    """Return the Hamming distance between a hash and each of the given hashes."""
+    xor = np.bitwise_xor(np.asarray(hashes, dtype=np.uint64), np.uint64(hash))
+    return POPCOUNT[xor.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+
+class HashIndex:
+    """An index of the perceptual hashes of a dataset.
+
+    Attributes:
+        paths (list): The paths of the indexed images.
+        hashes (np.ndarray): The uint64 hash of each image.
+    """
+
+    def __init__(self, paths: list, hashes: np.ndarray) -> None:
+        self.paths = list(paths)
+        self.hashes = np.asarray(hashes, dtype=np.uint64)
+
+    @classmethod
+    def from_paths(cls, paths: list, method: str = "dhash", workers: int = None) -> "HashIndex":
+        """Hash the given images with a pool of threads, skipping the ones that cannot be read."""
+        paths = list(paths)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            hashes = list(executor.map(lambda path: hash_file(path, method), paths))
+
+        indexed = [(path, hash) for path, hash in zip(paths, hashes) if hash is not None]
+        return cls([path for path, _ in indexed], [hash for _, hash in indexed])
+
+    def lookup(self, hash: np.uint64, max_distance: int = MAX_DISTANCE) -> list:
+        """Return the paths of the images within max_distance of the given hash, nearest first."""
+        distances = hamming(hash, self.hashes)
+        matches = np.flatnonzero(distances <= max_distance)
+        return [self.paths[i] for i in matches[np.argsort(distances[matches], kind="stable")]]
+
+    def clusters(self, max_distance: int = MAX_DISTANCE) -> dict:
+        """Group near-duplicate images.
+
+        Images are visited in order: each one joins the first representative within max_distance,
+        or becomes the representative of a new cluster.
+
+        Returns:
+            dict: The members of each cluster, representative included, by representative path.
+        """
+        clusters = {}
+        representatives = []
+        representative_hashes = np.empty(len(self.hashes), dtype=np.uint64)
+
+        for path, hash in zip(self.paths, self.hashes):
+            if representatives:
+                distances = hamming(hash, representative_hashes[:len(representatives)])
+                nearest = int(np.argmax(distances <= max_distance))
+                if distances[nearest] <= max_distance:
+                    clusters[representatives[nearest]].append(path)
+                    continue
+
+            representative_hashes[len(representatives)] = hash
+            representatives.append(path)
+            clusters[path] = [path]
+
+        return clusters
+
+
+def save_clusters(clusters: dict, path: Path) -> None:
+    """Save the cluster membership as JSON, only clusters with more than one image."""
+    report = {str(rep): [str(member) for member in members] for rep, members in clusters.items() if len(members) > 1}
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
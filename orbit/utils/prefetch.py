@@ -0,0 +1,77 @@
+"""
+BOUNDED PREFETCHING IMAGE READER
+
+Read and decode the next images in background threads while the current one is being processed.
+OpenCV releases the GIL while reading and decoding, so disk or network I/O overlaps with the NumPy work.
+The number of decoded frames kept ready is bounded by a byte budget.
+"""
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+
+# --------------------------------------
+# CONSTANTS
+# --------------------------------------
+
+PREFETCH_WORKERS = 2
+PREFETCH_BYTES = 512 * 2**20  # about 13 full resolution BGR frames
+
+# --------------------------------------
+# LIB
+# --------------------------------------
+
+def read_color(path) -> "np.ndarray":
+    """Decode an image in BGR."""
+    return cv2.imread(str(path), cv2.IMREAD_COLOR)
+
+
+class PrefetchReader:
+    """Iterate over (path, image) pairs in order, decoding ahead in background threads.
+
+    The frames decoded ahead plus the one held by the caller stay within max_bytes, the size of a frame
+    being estimated from the last one decoded. At least one frame is always read ahead.
+
+    Attributes:
+        paths (list): The paths of the images to read.
+        read (callable): The function decoding an image from its path, None when it cannot be read.
+        workers (int): The number of reading threads.
+        max_bytes (int): The memory budget of the decoded frames.
+    """
+
+    def __init__(self, paths, read=read_color, workers: int = PREFETCH_WORKERS, max_bytes: int = PREFETCH_BYTES) -> None:
+        self.paths = list(paths)
+        self.read = read
+        self.workers = workers
+        self.max_bytes = max_bytes
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+    def __iter__(self):
+        paths = iter(self.paths)
+        pending = deque()
+        frame_bytes = None
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while True:
+                # Read ahead while the budget allows it, the frame held by the caller included
+                while len(pending) < self.workers or frame_bytes is not None:
+                    if pending and frame_bytes is not None and (len(pending) + 2) * frame_bytes > self.max_bytes:
+                        break
+
+                    path = next(paths, None)
+                    if path is None:
+                        break
+                    pending.append((path, executor.submit(self.read, path)))
+
+                if not pending:
+                    return
+
+                path, future = pending.popleft()
+                image = future.result()
+                if image is not None:
+                    frame_bytes = image.nbytes
+
+                yield path, image
@@ -0,0 +1,176 @@
+"""
+STREAMING RESULT WRITER
+
+Write the result of each ROI as soon as it is computed, one record per ROI:
+    {"path": "...", "latest_ndvi": 0.21, "historic": {"2019": 0.18, ...}, "vci": 57.3, "class": 0}
+
+Records are appended to a JSON lines file, flushed one by one so partial results survive crashes,
+and to a columnar file: Parquet when pyarrow is installed, else a NumPy .npz written when the writer is closed.
+"class" is the value of VegetationState, -1 when the VCI cannot be classified.
+"""
+
+import json
+from pathlib import Path
+
+import numpy as np
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet output is optional
+    pa = None
+
+# --------------------------------------
+# CONSTANTS
+# --------------------------------------
+
+NO_CLASS = -1
+
+# Records buffered before a Parquet row group is written
+ROW_GROUP_SIZE = 256
+
+# --------------------------------------
+# LIB
+# --------------------------------------
+
+def new_result(path: str, latest_ndvi: float, historic: dict, vci: float, vci_class) -> dict:
+    """Create the record of a ROI.
+
+    Args:
+        path (str): The path of the image of the ROI.
+        latest_ndvi (float): The mean NDVI of the image.
+        historic (dict): The mean NDVI of the ROI by year, None when unknown.
+        vci (float): The VCI of the ROI, None when it cannot be calculated.
+        vci_class (VegetationState): The class of the VCI, None when it cannot be classified.
+
+    """
+    return {
+        "path": str(path),
+        "latest_ndvi": float(latest_ndvi),
+        "historic": {str(year): None if value is None else float(value) for year, value in historic.items()},
+        "vci": None if vci is None else float(vci),
+        "class": NO_CLASS if vci_class is None else vci_class.value,
+    }
+
+
+class ResultWriter:
+    """Stream ROI records to <name>.ndjson and to <name>.parquet or <name>.npz.
+
+    Attributes:
+        out_dir (Path): The output folder.
+        name (str): The base name of the output files.
+        years (list): The historic years, the columns of the historic series in the columnar file.
+    """
+
+    def __init__(self, out_dir: Path, years: list, name: str = "main_results") -> None:
+        self.out_dir = Path(out_dir)
+        self.name = name
+        self.years = [str(year) for year in years]
+        self.columns = {"path": [], "latest_ndvi": [], "historic": [], "vci": [], "class": []}
+        self.count = 0
+
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+        self.json_file = open(self.out_dir / f"{name}.ndjson", "w")
+        self.parquet = None
+
+    @property
+    def columnar_path(self) -> Path:
+        """The path of the columnar output."""
+        return self.out_dir / f"{self.name}.{'parquet' if pa is not None else 'npz'}"
+
+    def write(self, record: dict) -> None:
+        """Append a record to the outputs."""
+        self.json_file.write(json.dumps(record) + "\n")
+        self.json_file.flush()
+
+        self.columns["path"].append(record["path"])
+        self.columns["latest_ndvi"].append(record["latest_ndvi"])
+        self.columns["historic"].append([record["historic"].get(year) for year in self.years])
+        self.columns["vci"].append(record["vci"])
+        self.columns["class"].append(record["class"])
+        self.count += 1
+
+        if pa is not None and len(self.columns["path"]) >= ROW_GROUP_SIZE:
+            self.write_row_group()
+
+    def arrays(self) -> dict:
+        """The buffered records as NumPy columns, None as NaN."""
+        historic = np.array(self.columns["historic"], dtype=np.float64).reshape(len(self.columns["path"]), len(self.years))
+        return {
+            "path": np.array(self.columns["path"], dtype=str),
+            "latest_ndvi": np.array(self.columns["latest_ndvi"], dtype=np.float64),
+            "historic": historic,
+            "vci": np.array(self.columns["vci"], dtype=np.float64),
+            "class": np.array(self.columns["class"], dtype=np.int8),
+        }
+
+    def write_row_group(self) -> None:
+        """Write the buffered records as a Parquet row group."""
+        columns = self.arrays()
+        table = pa.table({
+            "path": columns["path"],
+            "latest_ndvi": columns["latest_ndvi"],
+            **{f"ndvi_{year}": np.ascontiguousarray(columns["historic"][:, i]) for i, year in enumerate(self.years)},
+            "vci": columns["vci"],
+            "class": columns["class"],
+        })
+
+        if self.parquet is None:
+            self.parquet = pq.ParquetWriter(self.columnar_path, table.schema)
+        self.parquet.write_table(table)
+
+        for column in self.columns.values():
+            column.clear()
+
+    def close(self) -> None:
+        """Write the remaining records and close the outputs."""
+        if pa is not None:
+            if self.columns["path"] or self.parquet is None:
+                self.write_row_group()
+            self.parquet.close()
+        else:
+            np.savez(self.columnar_path, years=np.array(self.years), **self.arrays())
+
+        self.json_file.close()
+
+    def __enter__(self) -> "ResultWriter":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def load_results(path: Path) -> list:
+    """Load the records of a JSON lines result file, ignoring a last line cut by a crash."""
+    records = []
+    with open(path, "r") as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                break
+
+    return records
+
+
+def load_columns(path: Path) -> dict:
+    """Load a columnar result file as NumPy columns, the historic series as a (ROI, year) array.
+
+    Returns:
+        dict: The "path", "latest_ndvi", "historic", "vci" and "class" columns, and the "years" of the historic series.
+    """
+    path = Path(path)
+    if path.suffix == ".npz":
+        with np.load(path) as data:
+            return {name: data[name] for name in data.files}
+
+    table = pq.read_table(path)
+    years = [name[len("ndvi_"):] for name in table.column_names if name.startswith("ndvi_")]
+    return {
+        "path": np.array(table.column("path").to_pylist(), dtype=str),
+        "latest_ndvi": table.column("latest_ndvi").to_numpy(),
+        "historic": np.stack([table.column(f"ndvi_{year}").to_numpy() for year in years], axis=1),
+        "vci": table.column("vci").to_numpy(),
+        "class": table.column("class").to_numpy(),
+        "years": np.array(years),
+    }
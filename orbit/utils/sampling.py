@@ -0,0 +1,151 @@
+"""
+SAMPLED PERCENTAGE ESTIMATES
+
+The cloud and sea classifiers compare the percentage of cloud or water pixels of a frame with a threshold, which for
+most frames is obvious long before every pixel is counted. Blocks of pixels are drawn at random, or stratified so that
+every band of rows is visited in turn, and the percentage is estimated with a confidence interval after each batch
+of blocks. Sampling stops as soon as the interval lies entirely on one side of the threshold. Borderline frames,
+whose interval still straddles it once MAX_SAMPLED of the blocks are drawn, are left to the exact count, and so are
+the images kept when the classifier stores their masks, which the analysis of every kept image leaves out.
+
+The pixels of a block are neighbours and not independent, so the interval is the one of a ratio estimator over the
+sampled blocks, with the finite population correction of sampling without replacement. Z is wider than the usual
+1.96 as the interval is looked at after every batch.
+"""
+
+from math import sqrt
+
+import numpy as np
+
+# --------------------------------------
+# CONSTANTS
+# --------------------------------------
+
+RANDOM = "random"  # blocks drawn uniformly
+STRATIFIED = "stratified"  # one block of every band of rows in turn, drawn at random within the band
+
+BLOCK_SIZE = 64  # pixels
+BATCH_BLOCKS = 32  # blocks drawn between two looks at the interval
+MAX_SAMPLED = 0.25  # fraction of the blocks after which the frame is counted exactly
+Z = 3.0
+
+# The blocks drawn only depend on the size of the frame, so a frame always gets the same verdict
+SEED = 0
+
+# --------------------------------------
+# LIB
+# --------------------------------------
+
+def block_starts(shape: tuple, block_size: int = BLOCK_SIZE) -> tuple:
+    """The first row of each band of blocks and the first column of each block of a band."""
+    return np.arange(0, shape[0], block_size), np.arange(0, shape[1], block_size)
+
+
+def valid_counts(shape: tuple, region=None, block_size: int = BLOCK_SIZE) -> np.ndarray:
+    """The number of pixels of each block inside the valid region, from its row spans.
+
+    Returns:
+        np.ndarray: The (bands, blocks per band) counts.
+    """
+    row_starts, col_starts = block_starts(shape, block_size)
+    col_stops = np.minimum(col_starts + block_size, shape[1])
+
+    if region is None:
+        row_stops = np.minimum(row_starts + block_size, shape[0])
+        return np.outer(row_stops - row_starts, col_stops - col_starts)
+
+    overlap = np.minimum(region.spans[:, 1:], col_stops) - np.maximum(region.spans[:, :1], col_starts)
+    return np.add.reduceat(np.clip(overlap, 0, None), row_starts, axis=0)
+
+
+def block_order(counts: np.ndarray, mode: str = STRATIFIED, rng=None) -> np.ndarray:
+    """The flat indices of the non-empty blocks in the order they are drawn.
+
+    Args:
+        counts (np.ndarray): The (bands, blocks per band) valid pixel counts.
+        mode (str): RANDOM, or STRATIFIED to draw a block of every band before drawing a second one of any.
+        rng (np.random.Generator): The random generator.
+
+    """
+    rng = rng if rng is not None else np.random.default_rng(SEED)
+    blocks = rng.permutation(np.flatnonzero(counts))
+    if mode == RANDOM:
+        return blocks
+
+    # Group the shuffled blocks by band, then take the first block of every band, the second one, and so on,
+    # the bands in a random order so that the first batches are not all at the top of the frame
+    bands = blocks // counts.shape[1]
+    grouped = np.argsort(bands, kind="stable")
+    blocks, bands = blocks[grouped], bands[grouped]
+    rank = np.arange(len(blocks)) - np.searchsorted(bands, bands)
+
+    return blocks[np.lexsort((rng.permutation(counts.shape[0])[bands], rank))]
+
+
+def block_valid(region, excluded: np.ndarray, rows: slice, cols: slice) -> np.ndarray:
+    """The pixels of a block inside the valid region and not excluded, None when all of them are."""
+    valid = None
+    if region is not None:
+        columns = np.arange(cols.start, cols.stop)
+        spans = region.spans[rows]
+        valid = (columns >= spans[:, :1]) & (columns < spans[:, 1:])
+
+    if excluded is not None:
+        valid = ~excluded[rows, cols] if valid is None else valid & ~excluded[rows, cols]
+
+    return valid
+
+
+def ratio_interval(hits: np.ndarray, totals: np.ndarray, population: int, z: float = Z) -> tuple:
+    """Estimate the fraction of hits over the population of blocks from a sample of them.
+
+    Returns:
+        tuple: The estimate and the lower and upper bounds of its confidence interval.
+    """
+    count = len(hits)
+    fraction = hits.sum() / totals.sum()
+
+    residuals = hits - fraction * totals
+    variance = (residuals @ residuals) / (count - 1) / count / totals.mean() ** 2 * (1 - count / population)
+    half_width = z * sqrt(max(variance, 0))
+
+    return fraction, fraction - half_width, fraction + half_width
+
+
+def sampled_below(count, shape: tuple, threshold: float, mode: str = STRATIFIED, region=None, block_size: int = BLOCK_SIZE) -> tuple:
+    """Decide whether the percentage of a frame is below a threshold from sampled blocks.
+
+    Args:
+        count (callable): count(rows, cols) returning the hits and the total of the block of the given slices.
+        shape (tuple): The (height, width) of the frame.
+        threshold (float): The percentage compared with.
+        mode (str): RANDOM or STRATIFIED.
+        region (ValidRegion): The valid region of the frames, its empty blocks are never drawn.
+        block_size (int): The side of the blocks in pixels.
+
+    Returns:
+        tuple: Whether the percentage is below the threshold and its estimate, None when the frame is borderline.
+    """
+    row_starts, col_starts = block_starts(shape, block_size)
+    order = block_order(valid_counts(shape, region, block_size), mode)
+    limit = int(len(order) * MAX_SAMPLED)
+
+    hits, totals = np.zeros(len(order)), np.zeros(len(order))
+
+    for drawn in range(0, limit, BATCH_BLOCKS):
+        batch = order[drawn:drawn + BATCH_BLOCKS]
+        for i, block in enumerate(batch.tolist(), drawn):
+            top, left = row_starts[block // len(col_starts)], col_starts[block % len(col_starts)]
+            hits[i], totals[i] = count(slice(top, min(top + block_size, shape[0])), slice(left, min(left + block_size, shape[1])))
+
+        sampled = drawn + len(batch)
+        if sampled < 2 or not totals[:sampled].any():
+            continue
+
+        fraction, low, high = ratio_interval(hits[:sampled], totals[:sampled], len(order))
+        if high * 100 < threshold:
+            return True, round(fraction * 100, 1)
+        if low * 100 >= threshold:
+            return False, round(fraction * 100, 1)
+
+    return None
@@ -0,0 +1,118 @@
+"""
+COST- AND SELECTIVITY-AWARE ORDERING OF CLASSIFIER STAGES
+
+Each classifier stage only looks at the image itself, so the order of the stages does not change the final
+selection, only how many images every stage has to look at. Measuring the cost and the rejection rate of
+each stage on a sample lets the pipeline run first the stages that reject the most images per second spent.
+"""
+
+import time
+import random
+
+# --------------------------------------
+# CONSTANTS
+# --------------------------------------
+
+SAMPLE_SIZE = 20
+SAMPLE_SEED = 0
+
+# --------------------------------------
+# LIB
+# --------------------------------------
+
+class Stage:
+    """A classifier and the parameters to run it with.
+
+    Attributes:
+        classifier (BaseClassifier): The classifier, its images_path is set when the stage is run.
+        args (tuple): The parameters passed to the classifier.
+        label (str): The kind of images the stage removes, for logging.
+        cost (float): The measured seconds spent per image, read and classification included.
+        rejection (float): The measured fraction of images removed.
+    """
+
+    def __init__(self, classifier, args: tuple, label: str) -> None:
+        self.classifier = classifier
+        self.args = args
+        self.label = label
+        self.cost = None
+        self.rejection = None
+
+    @property
+    def commutative(self) -> bool:
+        """Whether the stage can be moved: it must not depend on masks stored by other stages."""
+        return not self.classifier.exclude
+
+    @property
+    def rank(self) -> float:
+        """Seconds spent per rejected image, the lower the earlier the stage should run."""
+        if not self.rejection:
+            return float("inf")
+
+        return self.cost / self.rejection
+
+    def run(self, manifest):
+        """Run the stage on the images of a manifest and return the manifest of the images kept."""
+        self.classifier.images_path = manifest
+        return self.classifier.start(*self.args)
+
+
+def profile_stages(stages: list, sample: list) -> None:
+    """Measure the cost and the rejection rate of each stage on a sample of images.
+
+    Every stage reads the images itself, as it does when it is run.
+
+    Args:
+        stages (list): The stages to measure.
+        sample (list): The paths of the sample images.
+
+    """
+    for stage in stages:
+        rejected = 0
+        start = time.perf_counter()
+
+        for path in sample:
+            keep, _ = stage.classifier.classify(path, stage.classifier.read(path), *stage.args)
+            rejected += not keep
+
+        stage.cost = (time.perf_counter() - start) / max(len(sample), 1)
+        stage.rejection = rejected / max(len(sample), 1)
+
+
+def expected_cost(stages: list) -> float:
+    """Expected seconds spent per input image when running the stages in the given order."""
+    total = 0
+    passing = 1
+
+    for stage in stages:
+        total += passing * stage.cost
+        passing *= 1 - stage.rejection
+
+    return total
+
+
+def order_stages(stages: list, paths: list, sample_size: int = SAMPLE_SIZE) -> list:
+    """Reorder commutative stages to minimise the expected total work.
+
+    Sorting independent filters by cost per rejected image minimises the expected cost.
+    Stages depending on other stages keep the given order.
+
+    Args:
+        stages (list): The stages in their default order.
+        paths (list): The paths of the images to be filtered, a sample of which is measured.
+        sample_size (int): How many images to measure.
+
+    Returns:
+        list: The stages in the order to run them.
+    """
+    if len(stages) < 2 or not all(stage.commutative for stage in stages):
+        return list(stages)
+
+    paths = list(paths)
+    sample = random.Random(SAMPLE_SEED).sample(paths, min(sample_size, len(paths)))
+    if not sample:
+        return list(stages)
+
+    profile_stages(stages, sample)
+
+    return sorted(stages, key=lambda stage: stage.rank)
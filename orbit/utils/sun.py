@@ -0,0 +1,73 @@
+"""
+SUN POSITION
+
+Compute where the Sun is overhead and how high it stands above the horizon of a ground point at given times,
+vectorised over any number of frames.
+
+The low-precision formulae of the Astronomical Almanac are accurate to about 0.01 degree over 1950-2050,
+far more than needed to tell night frames from daylight ones, and need no ephemeris file.
+"""
+
+import numpy as np
+
+# --------------------------------------
+# CONSTANTS
+# --------------------------------------
+
+UNIX_EPOCH_JD = 2440587.5  # Julian date of 1970-01-01 00:00 UTC
+J2000_JD = 2451545.0  # Julian date of 2000-01-01 12:00 UTC
+
+# --------------------------------------
+# LIB
+# --------------------------------------
+
+def subsolar_point(timestamps) -> tuple:
+    """Compute the point where the Sun is at the zenith.
+
+    Args:
+        timestamps: The UTC times in seconds since the epoch.
+
+    Returns:
+        tuple: The latitude and the longitude of the subsolar point at each time, in degrees.
+    """
+    n = np.asarray(timestamps, dtype=np.float64) / 86400 + UNIX_EPOCH_JD - J2000_JD
+
+    # Ecliptic longitude of the Sun from its mean longitude and mean anomaly
+    mean_longitude = 280.460 + 0.9856474 * n
+    mean_anomaly = np.radians(357.528 + 0.9856003 * n)
+    ecliptic_longitude = np.radians(mean_longitude + 1.915 * np.sin(mean_anomaly) + 0.020 * np.sin(2 * mean_anomaly))
+    obliquity = np.radians(23.439 - 0.0000004 * n)
+
+    # Equatorial coordinates
+    declination = np.arcsin(np.sin(obliquity) * np.sin(ecliptic_longitude))
+    right_ascension = np.degrees(np.arctan2(np.cos(obliquity) * np.sin(ecliptic_longitude), np.cos(ecliptic_longitude)))
+
+    # The subsolar longitude is the right ascension minus the Greenwich sidereal time
+    sidereal_time = 280.46061837 + 360.98564736629 * n
+    longitude = (right_ascension - sidereal_time + 180) % 360 - 180
+
+    return np.degrees(declination), longitude
+
+
+def solar_elevation(timestamps, latitude, longitude) -> np.ndarray:
+    """Compute the elevation of the Sun above the horizon of ground points, refraction aside.
+
+    Args:
+        timestamps: The UTC times in seconds since the epoch.
+        latitude: The latitude of each ground point in degrees.
+        longitude: The longitude of each ground point in degrees.
+
+    Returns:
+        np.ndarray: The elevation of the Sun in degrees, negative below the horizon.
+    """
+    sun_latitude, sun_longitude = map(np.radians, subsolar_point(timestamps))
+    latitude = np.radians(np.asarray(latitude, dtype=np.float64))
+    longitude = np.radians(np.asarray(longitude, dtype=np.float64))
+
+    # The Sun is overhead the subsolar point, its elevation is 90 degrees minus the angular distance to it
+    cos_distance = (
+        np.sin(latitude) * np.sin(sun_latitude)
+        + np.cos(latitude) * np.cos(sun_latitude) * np.cos(longitude - sun_longitude)
+    )
+
+    return np.degrees(np.arcsin(np.clip(cos_distance, -1, 1)))
@@ -0,0 +1,275 @@
+"""
+THRESHOLD SWEEP
+
+Evaluate grids of filter.py thresholds without running the classifiers again for every trial.
+
+Each image is decoded once to extract the statistics the classifiers depend on:
+    - the grayscale histogram, for DarkImageClassifier (mean intensity)
+    - the green histogram, for ThresholdClassifier (pixels above the pixel threshold)
+    - the joint (blue, red) histogram, for NDVIClassifier (NDVI only depends on the blue and red values of a pixel)
+The statistics are cached, then every combination of the grid is evaluated from cumulative sums of the histograms,
+with the same comparisons, rounding and denominators as the classifiers, stored masks aside.
+
+With the valid region of the frames stored by filter.py (see vignette.py), only the pixels inside it are counted,
+as the classifiers do.
+
+The report holds the number of images selected by each combination and, given a CSV of labels (name, selected),
+its precision and recall.
+"""
+
+import sys
+import csv
+import json
+import argparse
+from itertools import product
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from .ndvi import ndvi
+from .prefetch import PrefetchReader
+from .vignette import ValidRegion, gather_valid
+
+# --------------------------------------
+# CONSTANTS
+# --------------------------------------
+
+# Default grid, around the values of filter.py
+DEFAULT_GRID = {
+    "DARK_THRESHOLD": [20, 25, 30, 35, 40],
+    "PIXEL_THRESHOLD": [0.7, 0.73, 0.76, 0.79, 0.82],
+    "THRESHOLD": [16, 21, 26, 31, 36],
+    "NDVI_RANGE": [[-1, 0.05], [-1, 0.1], [-1, 0.15]],
+    "NDVI_THRESHOLD": [22.2, 27.2, 32.2, 37.2, 42.2],
+}
+
+REPORT_FIELDNAMES = ["dark_threshold", "pixel_threshold", "threshold", "ndvi_min", "ndvi_max", "ndvi_threshold", "selected", "precision", "recall"]
+
+# --------------------------------------
+# LIB
+# --------------------------------------
+
+def image_statistics(image: np.ndarray, region: ValidRegion = None) -> tuple:
+    """Extract the grayscale, green and joint (blue, red) histograms of a BGR image, inside the region if given."""
+    if region is not None and region.fits(image):
+        image = gather_valid(region, image)
+
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    gray_hist = np.bincount(gray.ravel(), minlength=256)
+    green_hist = np.bincount(image[:, :, 1].ravel(), minlength=256)
+
+    pairs = (image[:, :, 0].astype(np.uint16) << 8) | image[:, :, 2]
+    joint_hist = np.bincount(pairs.ravel(), minlength=65536)
+
+    return gray_hist, green_hist, joint_hist
+
+
+def extract_statistics(paths: list, region: ValidRegion = None) -> dict:
+    """Decode every image once and extract its statistics, inside the region if given.
+
+    Returns:
+        dict: The image "names" and their "gray" (n, 256), "green" (n, 256) and "joint" (n, 65536) histograms.
+    """
+    names, gray, green, joint = [], [], [], []
+
+    for path, image in PrefetchReader(paths):
+        if image is None:
+            continue
+
+        gray_hist, green_hist, joint_hist = image_statistics(image, region)
+        names.append(Path(path).name)
+        gray.append(gray_hist)
+        green.append(green_hist)
+        joint.append(joint_hist.astype(np.uint32))
+
+    return {
+        "names": np.array(names, dtype=str),
+        "gray": np.array(gray, dtype=np.int64).reshape(len(names), 256),
+        "green": np.array(green, dtype=np.int64).reshape(len(names), 256),
+        "joint": np.array(joint, dtype=np.uint32).reshape(len(names), 65536),
+    }
+
+
+def load_statistics(folder: Path, cache_path: Path, region: ValidRegion = None) -> dict:
+    """Load the statistics of the images of a folder from the cache, extracting them again if the images or the region changed."""
+    paths = sorted(folder.glob("*.jpg"))
+    spans = region.spans if region is not None else np.zeros((0, 2), dtype=np.int64)
+
+    if cache_path.exists():
+        with np.load(cache_path) as data:
+            stats = {name: data[name] for name in data.files}
+        if stats["names"].tolist() == [path.name for path in paths] and np.array_equal(stats.get("region", np.zeros((0, 2))), spans):
+            return stats
+
+    stats = extract_statistics(paths, region)
+    stats["region"] = spans
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    np.savez(cache_path, **stats)
+
+    return stats
+
+
+def pair_ndvi() -> np.ndarray:
+    """NDVI of every (blue, red) pair, indexed by blue << 8 | red, computed like NDVIClassifier on [0, 1] values."""
+    blue, red = np.divmod(np.arange(65536), 256)
+    pairs = np.zeros((256, 256, 3), dtype=np.uint8)
+    pairs[:, :, 0] = blue.reshape(256, 256)
+    pairs[:, :, 2] = red.reshape(256, 256)
+
+    return ndvi(np.array(pairs, dtype=float) / float(255)).ravel()
+
+
+def rounded_percentage(counts: np.ndarray, totals: np.ndarray) -> np.ndarray:
+    """Percentages rounded to one decimal with round(), as the classifiers do."""
+    return np.array([round((count / max(total, 1)) * 100, 1) for count, total in zip(counts.tolist(), totals.tolist())])
+
+
+class Sweep:
+    """Evaluate threshold combinations against the statistics of a set of images.
+
+    Attributes:
+        names (np.ndarray): The names of the images.
+        pixels (np.ndarray): The number of pixels of each image.
+    """
+
+    def __init__(self, stats: dict) -> None:
+        self.names = stats["names"]
+        self.pixels = stats["gray"].sum(axis=1)
+
+        # Mean intensity of each image
+        self.mean_gray = stats["gray"] @ np.arange(256) / np.maximum(self.pixels, 1)
+
+        # Pixels with a green value up to each level
+        self.green_cumulative = np.cumsum(stats["green"], axis=1)
+
+        # Pixels up to each NDVI value, the (blue, red) pairs sorted by NDVI
+        pair_values = pair_ndvi()
+        order = np.argsort(pair_values, kind="stable")
+        self.sorted_ndvi = pair_values[order]
+        self.ndvi_cumulative = np.concatenate([
+            np.zeros((len(self.names), 1), dtype=np.int64),
+            np.cumsum(stats["joint"][:, order], axis=1, dtype=np.int64),
+        ], axis=1)
+
+    def dark(self, threshold) -> np.ndarray:
+        """Images kept by DarkImageClassifier."""
+        return self.mean_gray > threshold
+
+    def cloud(self, pixel_threshold, percentage_threshold) -> np.ndarray:
+        """Images kept by ThresholdClassifier, cloud pixels having a green value above int(pixel_threshold * 255)."""
+        level = int(pixel_threshold * 255)
+        cloud_pixels = self.pixels - self.green_cumulative[:, level]
+
+        return rounded_percentage(cloud_pixels, self.pixels) < percentage_threshold
+
+    def sea(self, ndvi_range, percentage_threshold) -> np.ndarray:
+        """Images kept by NDVIClassifier, water pixels having an NDVI strictly within ndvi_range.
+
+        The percentage is taken over the number of channel values, three per pixel, as the classifier does.
+        """
+        start = np.searchsorted(self.sorted_ndvi, ndvi_range[0], side="right")
+        stop = np.searchsorted(self.sorted_ndvi, ndvi_range[1], side="left")
+        water_pixels = self.ndvi_cumulative[:, max(stop, start)] - self.ndvi_cumulative[:, start]
+
+        return rounded_percentage(water_pixels, self.pixels * 3) < percentage_threshold
+
+    def evaluate(self, grid: dict, labels: dict = None) -> list:
+        """Evaluate every combination of the grid.
+
+        Args:
+            grid (dict): The values of DARK_THRESHOLD, PIXEL_THRESHOLD, THRESHOLD, NDVI_RANGE and NDVI_THRESHOLD to try.
+            labels (dict): Whether each image should be selected by name, to compute precision and recall
+                over the labelled images.
+
+        Returns:
+            list: A report row per combination.
+        """
+        # Each stage only depends on its own parameters, so it is evaluated once per value
+        dark = {threshold: self.dark(threshold) for threshold in grid["DARK_THRESHOLD"]}
+        cloud = {
+            (pixel_threshold, threshold): self.cloud(pixel_threshold, threshold)
+            for pixel_threshold, threshold in product(grid["PIXEL_THRESHOLD"], grid["THRESHOLD"])
+        }
+        sea = {
+            (tuple(ndvi_range), threshold): self.sea(ndvi_range, threshold)
+            for ndvi_range, threshold in product(grid["NDVI_RANGE"], grid["NDVI_THRESHOLD"])
+        }
+
+        labelled = positive = None
+        if labels:
+            labelled = np.array([name in labels for name in self.names.tolist()])
+            positive = np.array([bool(labels.get(name)) for name in self.names.tolist()])
+
+        rows = []
+        for dark_threshold, (pixel_threshold, threshold), (ndvi_range, ndvi_threshold) in product(dark, cloud, sea):
+            selected = dark[dark_threshold] & cloud[pixel_threshold, threshold] & sea[ndvi_range, ndvi_threshold]
+
+            row = {
+                "dark_threshold": dark_threshold,
+                "pixel_threshold": pixel_threshold,
+                "threshold": threshold,
+                "ndvi_min": ndvi_range[0],
+                "ndvi_max": ndvi_range[1],
+                "ndvi_threshold": ndvi_threshold,
+                "selected": int(np.count_nonzero(selected)),
+                "precision": None,
+                "recall": None,
+            }
+
+            if labelled is not None:
+                true_positives = np.count_nonzero(selected & positive & labelled)
+                selected_labelled = np.count_nonzero(selected & labelled)
+                positives = np.count_nonzero(positive & labelled)
+                row["precision"] = true_positives / selected_labelled if selected_labelled else None
+                row["recall"] = true_positives / positives if positives else None
+
+            rows.append(row)
+
+        return rows
+
+
+def read_labels(path: Path) -> dict:
+    """Read a CSV of labels with a name and a selected column, selected being 1/0 or true/false."""
+    with open(path, "r", newline="") as f:
+        return {Path(row["name"]).name: row["selected"].strip().lower() in ("1", "true", "yes") for row in csv.DictReader(f)}
+
+
+def write_report(rows: list, path: Path) -> None:
+    """Write the report of a sweep as CSV."""
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=REPORT_FIELDNAMES)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def main(argc, argv):
+    parser = argparse.ArgumentParser(prog="sweep", description="Evaluate grids of filter.py thresholds")
+    parser.add_argument("path", type=Path, help="folder containing the images")
+    parser.add_argument("--grid", type=Path, default=None, help="JSON file with the values of each constant to try")
+    parser.add_argument("--labels", type=Path, default=None, help="CSV file with the name and selected columns")
+    parser.add_argument("--region", type=Path, default=None, help="valid region of the frames, e.g. masks/valid.<folder digest>.npz")
+    parser.add_argument("--stats", type=Path, default=Path("sweep_stats.npz"), help="cache of the image statistics")
+    parser.add_argument("--out", type=Path, default=Path("sweep.csv"), help="report file")
+    args = parser.parse_args(argv[1:argc])
+
+    # Check if the path exists
+    if not args.path.exists():
+        print("Path not found")
+        sys.exit(1)
+
+    grid = dict(DEFAULT_GRID)
+    if args.grid is not None:
+        with open(args.grid, "r") as f:
+            grid.update(json.load(f))
+
+    region = ValidRegion.load(args.region) if args.region is not None else None
+    sweep = Sweep(load_statistics(args.path, args.stats, region))
+    rows = sweep.evaluate(grid, read_labels(args.labels) if args.labels else None)
+    write_report(rows, args.out)
+
+    print(f"Evaluated {len(rows)} combinations over {len(sweep.names)} images, report saved to {args.out}")
+
+
+if __name__ == "__main__":
+    main(len(sys.argv), sys.argv)
@@ -0,0 +1,159 @@
+"""
+LOOP TELEMETRY
+
+Decode the ring buffer of loop timings written aboard the ISS by astro/main.py ('telemetry.ring'),
+and summarise it as percentiles per measure and as a timeline of the iterations.
+
+Each record is one iteration of the main loop: the light check, the ISS position, the capture and the journal write
+durations, the requested and the actual sleep, whose difference is the sleep drift, and the resident memory.
+The layout below must match the one of astro/main.py.
+"""
+
+import sys
+import csv
+import argparse
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+# --------------------------------------
+# CONSTANTS
+# --------------------------------------
+
+# File header: magic, version, record size, number of slots
+HEADER = np.dtype([("magic", "S4"), ("version", "<u2"), ("record_size", "<u2"), ("slots", "<u4")])
+MAGIC = b"TLMR"
+VERSION = 1
+
+# Records, packed as struct "<IIdBffffffQ"
+RECORD = np.dtype([
+    ("sequence", "<u4"),
+    ("image", "<u4"),
+    ("timestamp", "<f8"),
+    ("event", "u1"),
+    ("light", "<f4"),
+    ("position", "<f4"),
+    ("capture", "<f4"),
+    ("journal", "<f4"),
+    ("sleep", "<f4"),
+    ("slept", "<f4"),
+    ("rss", "<u8"),
+])
+
+EVENTS = {0: "dark", 1: "capture", 2: "error"}
+
+# Durations summarised, in seconds
+DURATIONS = ["light", "position", "capture", "journal"]
+PERCENTILES = [50, 90, 99]
+
+TIMELINE_FIELDNAMES = ["sequence", "time", "image", "event", "light", "position", "capture", "journal", "sleep", "drift", "rss_mb"]
+
+# --------------------------------------
+# LIB
+# --------------------------------------
+
+def read_records(path: Path) -> np.ndarray:
+    """Read the records of a ring buffer file, oldest first, leaving out the slots never written.
+
+    Raises:
+        ValueError: If the file is not a telemetry ring buffer of a known layout.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+
+    header = np.frombuffer(data, dtype=HEADER, count=1)[0]
+    if header["magic"] != MAGIC or header["version"] != VERSION or header["record_size"] != RECORD.itemsize:
+        raise ValueError(f"{path} is not a version {VERSION} telemetry file")
+
+    records = np.frombuffer(data, dtype=RECORD, count=int(header["slots"]), offset=HEADER.itemsize)
+    records = records[records["sequence"] > 0]
+
+    return records[np.argsort(records["sequence"], kind="stable")]
+
+
+def drift(records: np.ndarray) -> np.ndarray:
+    """The sleep drift of the iterations that slept, in seconds."""
+    slept = records["sleep"] > 0
+    return records["slept"][slept] - records["sleep"][slept]
+
+
+def summarise(records: np.ndarray) -> dict:
+    """Summarise the records.
+
+    Returns:
+        dict: The number of "records", of "missing" records (overwritten by the ring or dropped aboard) and of each event,
+        the "percentiles" of each duration and of the sleep drift over the iterations that measured them, and the
+        "rss" range in bytes.
+    """
+    summary = {
+        "records": len(records),
+        "missing": int(records["sequence"][-1] - records["sequence"][0] + 1 - len(records)) if len(records) else 0,
+        "events": {name: int(np.count_nonzero(records["event"] == event)) for event, name in EVENTS.items()},
+        "percentiles": {},
+        "rss": (int(records["rss"].min()), int(records["rss"].max())) if len(records) else (0, 0),
+    }
+
+    # Only the captures have a position, a capture and a journal duration
+    samples = {name: records[name][records[name] > 0] for name in DURATIONS}
+    samples["drift"] = drift(records)
+
+    for name, values in samples.items():
+        if len(values):
+            summary["percentiles"][name] = dict(zip(PERCENTILES + ["max"], np.percentile(values, PERCENTILES).tolist() + [float(values.max())]))
+
+    return summary
+
+
+def write_timeline(records: np.ndarray, path: Path) -> None:
+    """Write the iterations as CSV, durations in milliseconds."""
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=TIMELINE_FIELDNAMES)
+        writer.writeheader()
+
+        for record in records:
+            writer.writerow({
+                "sequence": int(record["sequence"]),
+                "time": datetime.fromtimestamp(record["timestamp"]).isoformat(sep=" "),
+                "image": int(record["image"]),
+                "event": EVENTS.get(int(record["event"]), int(record["event"])),
+                **{name: round(float(record[name]) * 1000, 3) for name in DURATIONS + ["sleep"]},
+                "drift": round(float(record["slept"] - record["sleep"]) * 1000, 3) if record["sleep"] > 0 else None,
+                "rss_mb": round(int(record["rss"]) / 2**20, 1),
+            })
+
+
+def main(argc, argv):
+    parser = argparse.ArgumentParser(prog="telemetry", description="Summarise the loop telemetry of the ISS run")
+    parser.add_argument("path", type=Path, help="telemetry.ring written by astro/main.py")
+    parser.add_argument("--timeline", type=Path, default=None, help="CSV file of the iterations")
+    args = parser.parse_args(argv[1:argc])
+
+    # Check if the path exists
+    if not args.path.exists():
+        print("Path not found")
+        sys.exit(1)
+
+    try:
+        records = read_records(args.path)
+    except ValueError as e:
+        print(e)
+        sys.exit(1)
+
+    summary = summarise(records)
+    print(f"{summary['records']} iterations, {summary['missing']} missing, "
+          + ", ".join(f"{count} {name}" for name, count in summary["events"].items()))
+
+    print(f"{'ms':<10}" + "".join(f"{f'p{p}' if p != 'max' else p:>10}" for p in PERCENTILES + ["max"]))
+    for name, values in summary["percentiles"].items():
+        print(f"{name:<10}" + "".join(f"{value * 1000:>10.1f}" for value in values.values()))
+
+    print(f"RSS {summary['rss'][0] / 2**20:.1f} to {summary['rss'][1] / 2**20:.1f} MB")
+
+    if args.timeline is not None:
+        write_timeline(records, args.timeline)
+        print(f"Timeline saved to {args.timeline}")
+
+
+if __name__ == "__main__":
+    main(len(sys.argv), sys.argv)
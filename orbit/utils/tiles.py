@@ -0,0 +1,212 @@
+"""
+TILE-LEVEL USABLE AREA
+
+Instead of keeping or removing a whole frame, score each fixed-size tile of it as the classifiers score frames:
+    dark    mean gray level of the tile, as DarkImageClassifier
+    cloud   percentage of pixels with a green value above the pixel threshold, as ThresholdClassifier
+    sea     percentage of water pixels over the channel values, as NDVIClassifier
+A tile is valid when it passes the three checks with the thresholds of the whole-frame classifiers and most of its
+pixels are inside the valid region of the frames. The frame is kept if enough of its tiles are valid, and only
+those tiles are taken into account by mean_ndvi and the VCI.
+
+The tiles are scored by bands of one tile row, processed in parallel threads as OpenCV and NumPy release the GIL.
+The grid of each image is stored next to its masks, e.g. masks/img_0005.3f9a0c1d2e4b5a69.tiles.npz.
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from .ndvi import ndvi
+from .masks import image_key
+
+# --------------------------------------
+# CONSTANTS
+# --------------------------------------
+
+TILE_SIZE = 256  # pixels
+
+# Fraction of the pixels of a tile that must be inside the valid region
+MIN_TILE_COVERAGE = 0.5
+
+SCORES = ["pixels", "dark", "cloud", "sea", "ndvi_sum"]
+
+# Kind of the tile grid among the masks of an image kept in memory
+TILES = "tiles"
+
+# --------------------------------------
+# LIB
+# --------------------------------------
+
+def tiles_path(masks_dir: Path, image_path: Path) -> Path:
+    """Return the path of the tile grid of an image, named as its masks, e.g. masks/img_0005.3f9a0c1d2e4b5a69.tiles.npz"""
+    return Path(masks_dir) / f"{image_key(image_path)}.tiles.npz"
+
+
+def tile_sums(values: np.ndarray, starts: np.ndarray) -> np.ndarray:
+    """Sum a band of values over each tile, the tiles of the band starting at the given columns."""
+    return np.add.reduceat(values.sum(axis=0, dtype=np.float64), starts)
+
+
+class TileGrid:
+    """The scores and the validity of the tiles of a frame.
+
+    Attributes:
+        tile_size (int): The side of the tiles in pixels, the last row and column of tiles may be smaller.
+        height (int): The height of the frame in pixels.
+        width (int): The width of the frame in pixels.
+        pixels (np.ndarray): The number of pixels of each tile inside the valid region.
+        dark (np.ndarray): The mean gray level of each tile.
+        cloud (np.ndarray): The percentage of cloud pixels of each tile.
+        sea (np.ndarray): The percentage of water pixels of each tile, over its channel values.
+        ndvi_sum (np.ndarray): The sum of the NDVI of the pixels of each tile.
+        valid (np.ndarray): Whether each tile is usable, once judged.
+    """
+
+    def __init__(self, tile_size: int, height: int, width: int, scores: dict, valid: np.ndarray = None) -> None:
+        self.tile_size = tile_size
+        self.height = height
+        self.width = width
+        for name in SCORES:
+            setattr(self, name, scores[name])
+        self.valid = valid
+
+    @classmethod
+    def load(cls, path: Path) -> "TileGrid":
+        """Load a stored grid, None if it does not exist."""
+        if not Path(path).exists():
+            return None
+
+        with np.load(path) as data:
+            return cls(int(data["tile_size"]), int(data["height"]), int(data["width"]), {name: data[name] for name in SCORES}, data["valid"])
+
+    def save(self, path: Path) -> None:
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        np.savez(
+            path,
+            tile_size=self.tile_size,
+            height=self.height,
+            width=self.width,
+            valid=self.valid,
+            **{name: getattr(self, name) for name in SCORES},
+        )
+
+    @property
+    def shape(self) -> tuple:
+        """The (rows, columns) of tiles."""
+        return self.pixels.shape
+
+    def fits(self, image: np.ndarray) -> bool:
+        """Whether the grid was computed for frames of the size of the image."""
+        return image.shape[:2] == (self.height, self.width)
+
+    def judge(self, dark_threshold, cloud_threshold, sea_threshold, min_coverage: float = MIN_TILE_COVERAGE) -> np.ndarray:
+        """Set and return the validity of the tiles, with the thresholds of the whole-frame classifiers."""
+        rows = np.minimum(self.tile_size, self.height - np.arange(self.shape[0]) * self.tile_size)
+        columns = np.minimum(self.tile_size, self.width - np.arange(self.shape[1]) * self.tile_size)
+        coverage = self.pixels / np.outer(rows, columns)
+
+        self.valid = (
+            (coverage >= min_coverage)
+            & (self.dark > dark_threshold)
+            & (self.cloud < cloud_threshold)
+            & (self.sea < sea_threshold)
+        )
+        return self.valid
+
+    @property
+    def valid_fraction(self) -> float:
+        """The fraction of the pixels of the valid region that are in valid tiles."""
+        return float(self.pixels[self.valid].sum() / max(self.pixels.sum(), 1))
+
+    def mean_ndvi(self) -> float:
+        """The mean NDVI over the valid tiles, None if none is valid."""
+        pixels = self.pixels[self.valid].sum()
+        return float(self.ndvi_sum[self.valid].sum() / pixels) if pixels else None
+
+    def invalid_pixels(self) -> np.ndarray:
+        """A (height, width) boolean mask set on the pixels of the invalid tiles."""
+        invalid = np.repeat(np.repeat(~self.valid, self.tile_size, axis=0), self.tile_size, axis=1)
+        return invalid[:self.height, :self.width]
+
+
+def score_band(image: np.ndarray, valid: np.ndarray, starts: np.ndarray, pixel_threshold, ndvi_range) -> tuple:
+    """Score the tiles of a band of one tile row.
+
+    Args:
+        image (np.ndarray): The BGR band.
+        valid (np.ndarray): The pixels of the band inside the valid region, None for all of them.
+        starts (np.ndarray): The first column of each tile.
+        pixel_threshold: The threshold of ThresholdClassifier on the green value of a pixel, between 0 and 1.
+        ndvi_range: The NDVI range of the water pixels of NDVIClassifier.
+
+    Returns:
+        tuple: The pixels, gray sum, cloud pixels, water pixels and NDVI sum of each tile of the band,
+        and the cloud and water masks of the band.
+    """
+    if valid is None:
+        valid = np.ones(image.shape[:2], dtype=bool)
+
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    cloud = image[:, :, 1] > int(pixel_threshold * 255)
+    ndvi_values = ndvi(np.array(image, dtype=float) / float(255))
+    water = (ndvi_values > ndvi_range[0]) & (ndvi_values < ndvi_range[1])
+
+    return (
+        tile_sums(valid, starts),
+        tile_sums(np.where(valid, gray, 0), starts),
+        tile_sums(cloud & valid, starts),
+        tile_sums(water & valid, starts),
+        tile_sums(np.where(valid, ndvi_values, 0), starts),
+        cloud,
+        water,
+    )
+
+
+def score_tiles(image: np.ndarray, pixel_threshold, ndvi_range, region=None, tile_size: int = TILE_SIZE, workers: int = None) -> tuple:
+    """Score every tile of a frame, one thread per band of tiles.
+
+    Args:
+        image (np.ndarray): The BGR frame.
+        pixel_threshold: The threshold of ThresholdClassifier on the green value of a pixel, between 0 and 1.
+        ndvi_range: The NDVI range of the water pixels of NDVIClassifier.
+        region (ValidRegion): The valid region of the frames, None to take every pixel into account.
+        tile_size (int): The side of the tiles in pixels.
+        workers (int): The number of threads, one per CPU by default.
+
+    Returns:
+        tuple: The TileGrid of the scores of the tiles, not judged yet, and the (height, width) cloud and water masks.
+    """
+    height, width = image.shape[:2]
+    valid = region.mask if region is not None and region.fits(image) else None
+    starts = np.arange(0, width, tile_size)
+    bands = range(0, height, tile_size)
+
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        scores = list(executor.map(
+            lambda top: score_band(
+                image[top:top + tile_size],
+                valid[top:top + tile_size] if valid is not None else None,
+                starts,
+                pixel_threshold,
+                ndvi_range,
+            ),
+            bands,
+        ))
+
+    pixels, gray, cloud, water, ndvi_sum = (np.array(values) for values in list(zip(*scores))[:5])
+    cloud_mask, water_mask = (np.concatenate(masks) for masks in list(zip(*scores))[5:])
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        grid = TileGrid(tile_size, height, width, {
+            "pixels": pixels.astype(np.int64),
+            "dark": np.nan_to_num(gray / pixels),
+            "cloud": np.nan_to_num(np.round(cloud / pixels * 100, 1)),
+            "sea": np.nan_to_num(np.round(water / (pixels * 3) * 100, 1)),
+            "ndvi_sum": ndvi_sum,
+        })
+
+    return grid, cloud_mask, water_mask
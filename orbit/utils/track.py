@@ -0,0 +1,168 @@
+"""
+ISS GROUND TRACK
+
+Reconstruct the ground track of a whole mission from the EXIF data of its images:
+position and time of each frame, and the ground speed and heading between consecutive frames.
+"""
+
+import csv
+import json
+from pathlib import Path
+
+import numpy as np
+
+from .catalog import Catalog, capture_time
+
+# --------------------------------------
+# CONSTANTS
+# --------------------------------------
+
+EARTH_RADIUS = 6371 * 10**3  # meters
+
+FIELDNAMES = ["path", "time", "latitude", "longitude", "speed", "heading"]
+
+# --------------------------------------
+# FUNCTIONS
+# --------------------------------------
+
+def read_positions(paths: list, catalog: Catalog = None) -> dict:
+    """Read time and position of each image from the catalog, skipping images without them.
+
+    The images missing from the catalog or modified since are ingested first.
+
+    Returns:
+        dict: The "path", "time" (datetime), "latitude", "longitude" and "exif_heading" lists, sorted by time,
+        the heading saved at capture time being None for the images taken before it was saved.
+    """
+    own_catalog = catalog is None
+    if own_catalog:
+        catalog = Catalog()
+
+    catalog.ingest(paths)
+    entries = catalog.lookup(paths)
+    if own_catalog:
+        catalog.close()
+
+    frames = []
+    for path, row in zip(paths, entries):
+        if row["time"] is None or row["latitude"] is None:
+            continue
+
+        frames.append((capture_time(row), str(path), row["latitude"], row["longitude"], row["heading"]))
+
+    frames.sort()
+    return {
+        "path": [frame[1] for frame in frames],
+        "time": [frame[0] for frame in frames],
+        "latitude": [frame[2] for frame in frames],
+        "longitude": [frame[3] for frame in frames],
+        "exif_heading": [frame[4] for frame in frames],
+    }
+
+
+def speed_and_heading(latitude: np.ndarray, longitude: np.ndarray, seconds: np.ndarray) -> tuple:
+    """Compute the ground speed and heading between consecutive frames in one vectorized pass.
+
+    Each frame gets the values of the segment leading to it, the first frame those of the first segment.
+
+    Args:
+        latitude (np.ndarray): the latitude of each frame in degrees.
+        longitude (np.ndarray): the longitude of each frame in degrees.
+        seconds (np.ndarray): the time of each frame in seconds.
+
+    Returns:
+        tuple: The ground speed in m/s and the heading in degrees clockwise from north of each frame,
+        NaN where undefined.
+    """
+    count = len(latitude)
+    if count < 2:
+        return np.full(count, np.nan), np.full(count, np.nan)
+
+    lat = np.radians(latitude)
+    lon = np.radians(longitude)
+    lat1, lat2 = lat[:-1], lat[1:]
+    delta_lon = lon[1:] - lon[:-1]
+
+    # Haversine distance
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(delta_lon / 2) ** 2
+    distance = 2 * EARTH_RADIUS * np.arcsin(np.sqrt(a))
+
+    # Initial bearing
+    y = np.sin(delta_lon) * np.cos(lat2)
+    x = np.cos(lat1) * np.sin(lat2) - np.sin(lat1) * np.cos(lat2) * np.cos(delta_lon)
+    heading = np.degrees(np.arctan2(y, x)) % 360
+
+    elapsed = np.diff(seconds).astype(float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        speed = np.where(elapsed > 0, distance / elapsed, np.nan)
+    heading = np.where(distance > 0, heading, np.nan)
+
+    return np.concatenate([speed[:1], speed]), np.concatenate([heading[:1], heading])
+
+
+def ground_track(paths: list) -> dict:
+    """Read the ground track of the given images.
+
+    Returns:
+        dict: The FIELDNAMES columns, sorted by time.
+    """
+    track = read_positions(paths)
+    seconds = np.array([time.timestamp() for time in track["time"]])
+    track["speed"], track["heading"] = speed_and_heading(np.array(track["latitude"]), np.array(track["longitude"]), seconds)
+
+    # The heading saved at capture time is exact, the one between frames only where it is missing
+    exif_heading = np.array(track.pop("exif_heading"), dtype=np.float64)
+    track["heading"] = np.where(np.isnan(exif_heading), track["heading"], exif_heading)
+
+    return track
+
+
+def rows(track: dict):
+    """Iterate over the frames of a track as dictionaries, times as ISO strings and NaN as None."""
+    for i in range(len(track["path"])):
+        row = {name: track[name][i] for name in FIELDNAMES}
+        row["time"] = row["time"].isoformat()
+        for name in ("speed", "heading"):
+            row[name] = None if np.isnan(row[name]) else float(row[name])
+        yield row
+
+
+def write_csv(track: dict, path: Path) -> None:
+    """Write a track as CSV, one row per frame."""
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=FIELDNAMES)
+        writer.writeheader()
+        writer.writerows(rows(track))
+
+
+def write_geojson(track: dict, path: Path) -> None:
+    """Write a track as a GeoJSON FeatureCollection: a LineString of the whole track and a Point per frame."""
+    features = []
+    coordinates = [[lon, lat] for lat, lon in zip(track["latitude"], track["longitude"])]
+
+    if len(coordinates) > 1:
+        features.append({
+            "type": "Feature",
+            "geometry": {"type": "LineString", "coordinates": coordinates},
+            "properties": {"start": track["time"][0].isoformat(), "end": track["time"][-1].isoformat()},
+        })
+
+    for row in rows(track):
+        features.append({
+            "type": "Feature",
+            "geometry": {"type": "Point", "coordinates": [row["longitude"], row["latitude"]]},
+            "properties": {name: row[name] for name in ("path", "time", "speed", "heading")},
+        })
+
+    with open(path, "w") as f:
+        json.dump({"type": "FeatureCollection", "features": features}, f)
+
+
+def read_headings(path: Path) -> dict:
+    """Read the heading of each image from a track CSV.
+
+    Returns:
+        dict: The heading in degrees by image file name, images without heading left out.
+    """
+    with open(path, "r", newline="") as f:
+        return {Path(row["path"]).name: float(row["heading"]) for row in csv.DictReader(f) if row["heading"]}
@@ -0,0 +1,160 @@
+"""
+PER-PIXEL VCI RASTERS
+
+Keep running per-pixel NDVI minimum and maximum rasters for the footprint of each ROI, so that a new year
+is added without reprocessing the old ones, and compute memory-mapped VCI and class code rasters from them.
+
+Layout of a ROI folder:
+    years.json      the years already included in the minimum and maximum
+    ndvi_min.npy    per-pixel minimum NDVI (float32)
+    ndvi_max.npy    per-pixel maximum NDVI (float32)
+    vci.npy         per-pixel VCI between 0 and 100, NaN where undefined (float32)
+    vci_class.npy   per-pixel VegetationState value, NODATA where undefined (uint8)
+"""
+
+import json
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from .vci import VegetationState
+
+# --------------------------------------
+# CONSTANTS
+# --------------------------------------
+
+NODATA = 255
+
+# Lower VCI bound of each class, from the most to the least severe drought
+CLASS_BOUNDS = [10, 20, 30, 40]
+CLASS_CODES = np.array([
+    VegetationState.EXTREME_DROUGHT.value,
+    VegetationState.SEVERE_DROUGHT.value,
+    VegetationState.DROUGHT.value,
+    VegetationState.LIGHT_DROUGHT.value,
+    VegetationState.NORMAL.value,
+], dtype=np.uint8)
+
+# Rows processed at once when writing the output rasters
+CHUNK_ROWS = 512
+
+# --------------------------------------
+# LIB
+# --------------------------------------
+
+def vci_classify_raster(vci: np.ndarray) -> np.ndarray:
+    """Classify a VCI raster with the same ranges as vci_classify.
+
+    Return a uint8 raster of VegetationState values, NODATA where the VCI is NaN.
+    """
+    codes = CLASS_CODES[np.digitize(np.nan_to_num(vci, nan=0), CLASS_BOUNDS)]
+    codes[np.isnan(vci)] = NODATA
+    return codes
+
+
+class HistoricRange:
+    """The per-pixel NDVI range observed over the years on the footprint of a ROI.
+
+    Attributes:
+        roi_dir (Path): The folder containing the rasters of the ROI.
+        years (list): The years already included.
+    """
+
+    def __init__(self, roi_dir: Path) -> None:
+        """Open the rasters of a ROI, creating its folder if needed.
+
+        Args:
+            roi_dir (Path): The folder containing the rasters of the ROI.
+
+        """
+        self.roi_dir = roi_dir
+        self.roi_dir.mkdir(parents=True, exist_ok=True)
+
+        years_file = self.roi_dir / "years.json"
+        self.years = json.loads(years_file.read_text()) if years_file.exists() else []
+
+    @property
+    def shape(self) -> tuple:
+        """The shape of the rasters, None before the first year is added."""
+        if not self.years:
+            return None
+
+        return np.load(self.roi_dir / "ndvi_min.npy", mmap_mode="r").shape
+
+    def update(self, year: int, ndvi_raster: np.ndarray) -> bool:
+        """Include the NDVI raster of a year in the running minimum and maximum.
+
+        The first raster sets the grid of the ROI, the following ones are resampled to it.
+
+        Args:
+            year (int): the year of the raster.
+            ndvi_raster (np.ndarray): the per-pixel NDVI over the footprint of the ROI.
+
+        Returns:
+            bool: False if the year was already included and nothing was done.
+        """
+        if year in self.years:
+            return False
+
+        ndvi_raster = np.asarray(ndvi_raster, dtype=np.float32)
+
+        if not self.years:
+            np.save(self.roi_dir / "ndvi_min.npy", ndvi_raster)
+            np.save(self.roi_dir / "ndvi_max.npy", ndvi_raster)
+        else:
+            height, width = self.shape
+            if ndvi_raster.shape != (height, width):
+                ndvi_raster = cv2.resize(ndvi_raster, (width, height), interpolation=cv2.INTER_AREA)
+
+            ndvi_min = np.load(self.roi_dir / "ndvi_min.npy", mmap_mode="r+")
+            ndvi_max = np.load(self.roi_dir / "ndvi_max.npy", mmap_mode="r+")
+
+            # fmin and fmax ignore NaN, so a pixel missing in one year keeps the range of the others
+            np.fmin(ndvi_min, ndvi_raster, out=ndvi_min)
+            np.fmax(ndvi_max, ndvi_raster, out=ndvi_max)
+            ndvi_min.flush()
+            ndvi_max.flush()
+
+        self.years.append(year)
+        (self.roi_dir / "years.json").write_text(json.dumps(sorted(self.years)))
+
+        return True
+
+    def vci(self, ndvi_raster: np.ndarray) -> tuple:
+        """Compute the per-pixel VCI of an NDVI raster and its class codes.
+
+        Args:
+            ndvi_raster (np.ndarray): the per-pixel NDVI to evaluate, resampled to the grid of the ROI if needed.
+
+        Returns:
+            tuple: The memory-mapped VCI and class code rasters.
+        """
+        height, width = self.shape
+        ndvi_raster = np.asarray(ndvi_raster, dtype=np.float32)
+        if ndvi_raster.shape != (height, width):
+            ndvi_raster = cv2.resize(ndvi_raster, (width, height), interpolation=cv2.INTER_AREA)
+
+        ndvi_min = np.load(self.roi_dir / "ndvi_min.npy", mmap_mode="r")
+        ndvi_max = np.load(self.roi_dir / "ndvi_max.npy", mmap_mode="r")
+
+        vci = np.lib.format.open_memmap(self.roi_dir / "vci.npy", mode="w+", dtype=np.float32, shape=(height, width))
+        codes = np.lib.format.open_memmap(self.roi_dir / "vci_class.npy", mode="w+", dtype=np.uint8, shape=(height, width))
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            for row in range(0, height, CHUNK_ROWS):
+                rows = slice(row, row + CHUNK_ROWS)
+                low = ndvi_min[rows]
+                span = ndvi_max[rows] - low
+
+                chunk = (ndvi_raster[rows] - low) / span * 100
+                chunk[span <= 0] = np.nan
+                np.clip(chunk, 0, 100, out=chunk)
+
+                vci[rows] = chunk
+                codes[rows] = vci_classify_raster(chunk)
+
+        vci.flush()
+        codes.flush()
+
+        return vci, codes
@@ -0,0 +1,226 @@
+"""
+PORTHOLE AND VIGNETTE VALID REGION
+
+Frames taken through the window of the ISS have a dark border where the porthole frame is, and vignetted corners.
+Those pixels are the same for every frame of a mission, so the region of valid pixels is estimated once from a sample
+of the frames of a folder, stored for that folder, and the classifiers and mean_ndvi only read the pixels inside it.
+
+The region is stored as row spans, the first and the end column of the valid pixels of each row: the porthole being
+convex, each row holds a single run of valid pixels, read as one contiguous slice.
+"""
+
+import sys
+import random
+import hashlib
+import argparse
+from pathlib import Path
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from .prefetch import PrefetchReader
+
+# --------------------------------------
+# CONSTANTS
+# --------------------------------------
+
+# Name of the region file of a folder of frames in the masks folder, from the digest of its path
+VALID_REGION_FILE = "valid.{}.npz"
+
+# Masks folder of filter.py and main.py
+DEFAULT_MASKS_DIR = Path(__file__).parent.parent.resolve() / "masks"
+
+SAMPLE_SIZE = 20
+SAMPLE_SEED = 0
+
+# Gray level under which a pixel is dead, in most of the sampled frames
+DEAD_LEVEL = 20
+# Percentile of the gray levels of a pixel over the sampled frames compared with DEAD_LEVEL: a pixel is live when
+# brighter in more than 100 - DEAD_PERCENTILE percent of the frames, so a dead one is bright in at most a quarter of them
+DEAD_PERCENTILE = 75
+
+# Size of the structuring element removing specks and small gaps, at the reduced scale
+MORPHOLOGY_SIZE = 9
+
+# --------------------------------------
+# LIB
+# --------------------------------------
+
+def read_reduced(path: Path) -> np.ndarray:
+    """Decode an image in grayscale at 1/4 of its resolution."""
+    return cv2.imread(str(path), cv2.IMREAD_REDUCED_GRAYSCALE_4)
+
+
+def region_path(masks_dir: Path, folder: Path) -> Path:
+    """Return the path of the valid region of the frames of a folder stored in a masks folder."""
+    digest = hashlib.blake2b(str(Path(folder).resolve()).encode(), digest_size=8).hexdigest()
+    return Path(masks_dir) / VALID_REGION_FILE.format(digest)
+
+
+class ValidRegion:
+    """The region of the valid pixels of the frames of a mission, as one run of columns per row.
+
+    Attributes:
+        spans (np.ndarray): The (height, 2) start and end columns of the valid pixels of each row, equal for empty rows.
+        width (int): The width of the frames in pixels.
+    """
+
+    def __init__(self, spans: np.ndarray, width: int) -> None:
+        self.spans = np.asarray(spans, dtype=np.int64)
+        self.width = int(width)
+
+        # Non-empty rows and the offset of their pixels in a gathered array
+        lengths = self.spans[:, 1] - self.spans[:, 0]
+        self.rows = [(row, start, stop) for row, (start, stop) in enumerate(self.spans.tolist()) if stop > start]
+        self.offsets = np.concatenate([[0], np.cumsum(lengths[lengths > 0])])
+
+    @classmethod
+    def from_mask(cls, mask: np.ndarray) -> "ValidRegion":
+        """Build the region from a boolean mask, each row spanning from its first to its last valid pixel."""
+        height, width = mask.shape
+        valid_rows = mask.any(axis=1)
+
+        start = np.where(valid_rows, mask.argmax(axis=1), 0)
+        stop = np.where(valid_rows, width - mask[:, ::-1].argmax(axis=1), 0)
+
+        return cls(np.column_stack([start, stop]), width)
+
+    @classmethod
+    def load(cls, path: Path) -> "ValidRegion":
+        """Load a stored region, None if it does not exist."""
+        if not Path(path).exists():
+            return None
+
+        with np.load(path) as data:
+            return cls(data["spans"], int(data["width"]))
+
+    def save(self, path: Path) -> None:
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        np.savez(path, spans=self.spans.astype(np.int32), width=self.width)
+
+    @property
+    def shape(self) -> tuple:
+        """The (height, width) of the frames."""
+        return len(self.spans), self.width
+
+    @property
+    def count(self) -> int:
+        """The number of valid pixels."""
+        return int(self.offsets[-1])
+
+    @property
+    def mask(self) -> np.ndarray:
+        """The region as a (height, width) boolean mask."""
+        columns = np.arange(self.width)
+        return (columns >= self.spans[:, :1]) & (columns < self.spans[:, 1:])
+
+    def fits(self, image: np.ndarray) -> bool:
+        """Whether the region was estimated for frames of the size of the image."""
+        return image.shape[:2] == self.shape
+
+    def gather(self, image: np.ndarray) -> np.ndarray:
+        """Copy the valid pixels of an image, row after row, one slice per row.
+
+        Returns:
+            np.ndarray: The (count,) values of a single-channel image, or the (count, channels) pixels of a color one.
+        """
+        if not self.rows:
+            return image[:0, :0].reshape((0,) + image.shape[2:])
+
+        return np.concatenate([image[row, start:stop] for row, start, stop in self.rows])
+
+    def scatter(self, values: np.ndarray, fill=0) -> np.ndarray:
+        """Place gathered values back in a (height, width) array, fill outside the region."""
+        out = np.full(self.shape + values.shape[1:], fill, dtype=values.dtype)
+        for (row, start, stop), offset in zip(self.rows, self.offsets[:-1].tolist()):
+            out[row, start:stop] = values[offset:offset + stop - start]
+
+        return out
+
+
+def gather_valid(region: ValidRegion, array: np.ndarray) -> np.ndarray:
+    """The pixels of an image or mask inside the region, as a (1, count) image OpenCV and ndvi() work on as on the
+    whole frame, or the array itself without a region."""
+    if region is None:
+        return array
+
+    return region.gather(array)[np.newaxis]
+
+
+def scatter_valid(region: ValidRegion, values: np.ndarray, fill=0) -> np.ndarray:
+    """Bring values computed by gather_valid() back to the frame size, or return them as they are without a region."""
+    if region is None:
+        return values
+
+    return region.scatter(values[0], fill)
+
+
+def estimate_region(paths: list, sample_size: int = SAMPLE_SIZE) -> ValidRegion:
+    """Estimate the valid region from a sample of frames.
+
+    A pixel is dead if it stays under DEAD_LEVEL in at least three quarters of the sampled frames. The region is
+    the largest connected area of live pixels, cleaned of specks and slightly eroded, estimated at 1/4 scale and
+    brought back to the frame size.
+
+    Returns:
+        ValidRegion: The region, None if no frame could be decoded or no pixel is live.
+    """
+    paths = list(paths)
+    sample = random.Random(SAMPLE_SEED).sample(paths, min(sample_size, len(paths)))
+
+    decoded = [(path, frame) for path, frame in PrefetchReader(sample, read_reduced) if frame is not None]
+    if not decoded:
+        return None
+    frames = [frame for _, frame in decoded]
+
+    # Full (width, height) of the frames, read from the header of one of them
+    with Image.open(decoded[0][0]) as image:
+        size = image.size
+
+    live = np.percentile(np.stack(frames), DEAD_PERCENTILE, axis=0) > DEAD_LEVEL
+    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (MORPHOLOGY_SIZE, MORPHOLOGY_SIZE))
+    live = cv2.morphologyEx(live.astype(np.uint8), cv2.MORPH_OPEN, kernel)
+    live = cv2.morphologyEx(live, cv2.MORPH_CLOSE, kernel)
+
+    # Keep the porthole, the largest area of live pixels
+    count, labels, stats, _ = cv2.connectedComponentsWithStats(live, connectivity=8)
+    if count < 2:
+        return None
+    porthole = labels == 1 + np.argmax(stats[1:, cv2.CC_STAT_AREA])
+
+    # Keep a margin inside the edge of the porthole, blurred by the compression and the reduced decode
+    porthole = cv2.erode(porthole.astype(np.uint8), np.ones((3, 3), np.uint8))
+
+    mask = cv2.resize(porthole, size, interpolation=cv2.INTER_NEAREST).astype(bool)
+    return ValidRegion.from_mask(mask)
+
+
+def main(argc, argv):
+    parser = argparse.ArgumentParser(prog="vignette", description="Estimate the valid region of the frames of a mission")
+    parser.add_argument("path", type=Path, help="folder containing the images")
+    parser.add_argument("--out", type=Path, default=None, help="region file, the one of the folder in the masks folder by default")
+    parser.add_argument("--sample", type=int, default=SAMPLE_SIZE, help="number of frames sampled")
+    parser.add_argument("--preview", type=Path, default=None, help="PNG image of the region")
+    args = parser.parse_args(argv[1:argc])
+
+    # Check if the path exists
+    if not args.path.exists():
+        print("Path not found")
+        sys.exit(1)
+
+    region = estimate_region(sorted(args.path.glob("*.jpg")), args.sample)
+    if region is None:
+        print("No valid pixels found")
+        sys.exit(1)
+
+    out = args.out if args.out is not None else region_path(DEFAULT_MASKS_DIR, args.path)
+    region.save(out)
+    print(f"{region.count / (region.shape[0] * region.shape[1]):.1%} of the {region.shape[1]}x{region.shape[0]} pixels are valid, region saved to {out}")
+
+    if args.preview is not None:
+        cv2.imwrite(str(args.preview), region.mask.astype(np.uint8) * 255)
+
+
+if __name__ == "__main__":
+    main(len(sys.argv), sys.argv)
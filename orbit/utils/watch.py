@@ -0,0 +1,165 @@
+"""
+WATCH A FOLDER FOR NEW IMAGES
+
+Yield the images written into a folder as soon as they are complete, through inotify on Linux
+and by polling the folder anywhere else.
+"""
+
+import os
+import sys
+import time
+import select
+import struct
+import ctypes
+import ctypes.util
+from pathlib import Path
+
+# --------------------------------------
+# CONSTANTS
+# --------------------------------------
+
+# inotify events meaning that a file is complete: its writer closed it, or it was renamed into the folder
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+
+EVENT_HEADER = struct.Struct("iIII")  # wd, mask, cookie, len
+
+JPEG_END = b"\xff\xd9"
+
+# --------------------------------------
+# FUNCTIONS
+# --------------------------------------
+
+def is_complete_jpeg(path: Path) -> bool:
+    """Check whether a JPEG file ends with the end of image marker."""
+    try:
+        with open(path, "rb") as f:
+            f.seek(-2, os.SEEK_END)
+            return f.read(2) == JPEG_END
+    except OSError:
+        return False
+
+
+def load_inotify():
+    """Load the inotify functions of the C library, None if they are not available."""
+    if not sys.platform.startswith("linux"):
+        return None
+
+    libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    if not hasattr(libc, "inotify_init1"):
+        return None
+
+    libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    return libc
+
+
+class FolderWatcher:
+    """Yield the complete images of a folder, the ones already there first and then the new ones as they arrive.
+
+    Attributes:
+        path (Path): The watched folder.
+        pattern (str): The glob pattern of the images.
+        poll_interval (float): Seconds between two scans when polling, and maximum wait for an inotify event.
+        use_inotify (bool): Whether inotify is used, False when falling back to polling.
+    """
+
+    def __init__(self, path: Path, pattern: str = "*.jpg", poll_interval: float = 1.0, use_inotify: bool = True) -> None:
+        self.path = path
+        self.pattern = pattern
+        self.poll_interval = poll_interval
+        self.running = True
+
+        self.libc = load_inotify() if use_inotify else None
+        self.fd = -1
+
+        if self.libc is not None:
+            self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+            if self.fd >= 0 and self.libc.inotify_add_watch(self.fd, str(path).encode(), IN_CLOSE_WRITE | IN_MOVED_TO) < 0:
+                self.release()
+
+    @property
+    def use_inotify(self) -> bool:
+        return self.fd >= 0
+
+    def close(self) -> None:
+        """Stop watching the folder, the iteration ends within poll_interval seconds."""
+        self.running = False
+
+    def release(self) -> None:
+        """Release the inotify file descriptor."""
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+    def __iter__(self):
+        """Yield (path, detection time) for each complete image, detection time being a time.monotonic() value."""
+        pending = {}  # images still being written, by path, with their last seen size
+        seen = set()
+
+        try:
+            # Images already in the folder
+            for path in sorted(self.path.glob(self.pattern)):
+                if is_complete_jpeg(path):
+                    seen.add(path)
+                    yield path, time.monotonic()
+                else:
+                    pending[path] = -1
+
+            yield from self.watch(pending, seen)
+        finally:
+            self.release()
+
+    def watch(self, pending: dict, seen: set):
+        """Yield the images arriving in the folder until close() is called."""
+        while self.running:
+            if self.use_inotify:
+                candidates = self.read_events()
+            else:
+                time.sleep(self.poll_interval)
+                candidates = [path for path in self.path.glob(self.pattern) if path not in seen]
+
+            detected = time.monotonic()
+            candidates = set(candidates) | set(pending)
+
+            for path in sorted(candidates):
+                if path in seen or not path.match(self.pattern):
+                    continue
+
+                # When polling, a file is complete once its size stopped changing and it ends like a JPEG
+                try:
+                    size = path.stat().st_size
+                except OSError:
+                    pending.pop(path, None)
+                    continue
+
+                stable = self.use_inotify or pending.get(path) == size
+                if stable and is_complete_jpeg(path):
+                    pending.pop(path, None)
+                    seen.add(path)
+                    yield path, detected
+                else:
+                    pending[path] = size
+
+    def read_events(self) -> list:
+        """Wait for inotify events and return the paths of the files they are about."""
+        readable, _, _ = select.select([self.fd], [], [], self.poll_interval)
+        if not readable:
+            return []
+
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+
+        paths = []
+        offset = 0
+        while offset < len(data):
+            _, _, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b"\0").decode()
+            offset += length
+
+            if name:
+                paths.append(self.path / name)
+
+        return paths
@@ -0,0 +1,350 @@
+"""
+LEASE WORK QUEUE
+
+Spread the processing of image sets over several worker processes, on one host or on several hosts
+sharing a file system, through a job table in a SQLite database.
+
+    enqueue   the images of one or more folders are added to the table, with the task to run on them
+    work      workers claim batches of images with a lease, renewed by a heartbeat while they process them;
+              the images of a worker that stopped are claimed again once its lease expired
+    merge     the result of every image is written back as a JSON lines file
+
+Tasks are the per-image work of a program, given by its queue_task() function:
+    filter    the manifest record of each image (filter.py), near-duplicates aside
+    analyse   the mean NDVI of each image (main.py)
+
+The database uses the rollback journal rather than WAL, which needs shared memory that network file systems lack.
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import sqlite3
+import argparse
+import importlib
+import threading
+from multiprocessing import Process
+from pathlib import Path
+
+from .manifest import Manifest, LINK
+from .prefetch import PrefetchReader
+
+# --------------------------------------
+# CONSTANTS
+# --------------------------------------
+
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+
+# Module of the program providing queue_task() for each task
+TASKS = {
+    "filter": "filter",
+    "analyse": "main",
+}
+
+BATCH_SIZE = 16
+LEASE_SECONDS = 120
+MAX_ATTEMPTS = 3
+
+# Seconds to wait before claiming again when the other images are leased by other workers
+IDLE_SECONDS = 5
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    path TEXT PRIMARY KEY,
+    state TEXT NOT NULL DEFAULT 'pending',
+    worker TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    result TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, lease_expires);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# --------------------------------------
+# LIB
+# --------------------------------------
+
+def worker_name() -> str:
+    """A name unique to the current process across hosts."""
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class WorkQueue:
+    """A job table of images in a SQLite database.
+
+    A connection is not shared between threads or processes, each one opens its own WorkQueue.
+
+    Attributes:
+        db_path (Path): The path of the database.
+    """
+
+    def __init__(self, db_path: Path, timeout: float = 60) -> None:
+        self.db_path = Path(db_path)
+        self.connection = sqlite3.connect(str(self.db_path), timeout=timeout, isolation_level=None)
+        self.connection.executescript(SCHEMA)
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def transaction(self):
+        """Run the statements of a with block in a write transaction, locking the database from its start."""
+        return Transaction(self.connection)
+
+    @property
+    def task(self) -> str:
+        """The task to run on the images."""
+        row = self.connection.execute("SELECT value FROM meta WHERE key = 'task'").fetchone()
+        return row[0] if row else None
+
+    def enqueue(self, paths: list, task: str) -> int:
+        """Add images to the queue, the ones already queued are left as they are.
+
+        Returns:
+            int: The number of images added.
+        """
+        with self.transaction() as cursor:
+            current = self.task
+            if current is not None and current != task:
+                raise ValueError(f"The queue runs the {current} task, not {task}")
+
+            cursor.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('task', ?)", (task,))
+            before = cursor.execute("SELECT COUNT(*) FROM jobs").fetchone()[0]
+            cursor.executemany("INSERT OR IGNORE INTO jobs (path) VALUES (?)", [(str(path),) for path in paths])
+            return cursor.execute("SELECT COUNT(*) FROM jobs").fetchone()[0] - before
+
+    def claim(self, worker: str, batch_size: int = BATCH_SIZE, lease_seconds: float = LEASE_SECONDS, max_attempts: int = MAX_ATTEMPTS) -> list:
+        """Lease a batch of pending images, or of images whose lease expired.
+
+        An image whose lease expired max_attempts times is marked failed instead, as it may be the one stopping
+        the workers processing it.
+
+        Returns:
+            list: The paths of the images leased to the worker.
+        """
+        now = time.time()
+        with self.transaction() as cursor:
+            cursor.execute(
+                "UPDATE jobs SET state = ?, error = ?, lease_expires = NULL WHERE state = ? AND lease_expires < ? AND attempts >= ?",
+                (FAILED, "lease expired", LEASED, now, max_attempts),
+            )
+            paths = [row[0] for row in cursor.execute(
+                "SELECT path FROM jobs WHERE state = ? OR (state = ? AND lease_expires < ? AND attempts < ?) ORDER BY path LIMIT ?",
+                (PENDING, LEASED, now, max_attempts, batch_size),
+            )]
+            cursor.executemany(
+                "UPDATE jobs SET state = ?, worker = ?, lease_expires = ?, attempts = attempts + 1 WHERE path = ?",
+                [(LEASED, worker, now + lease_seconds, path) for path in paths],
+            )
+
+        return paths
+
+    def heartbeat(self, worker: str, lease_seconds: float = LEASE_SECONDS) -> int:
+        """Extend the leases of a worker.
+
+        Returns:
+            int: The number of images still leased to the worker.
+        """
+        with self.transaction() as cursor:
+            cursor.execute(
+                "UPDATE jobs SET lease_expires = ? WHERE state = ? AND worker = ?",
+                (time.time() + lease_seconds, LEASED, worker),
+            )
+            return cursor.rowcount
+
+    def complete(self, worker: str, results: dict) -> int:
+        """Store the results of images leased to a worker, ignoring the ones whose lease was lost.
+
+        Args:
+            worker (str): The name of the worker.
+            results (dict): The JSON serialisable result of each image by path.
+
+        Returns:
+            int: The number of results stored.
+        """
+        with self.transaction() as cursor:
+            cursor.executemany(
+                "UPDATE jobs SET state = ?, result = ?, lease_expires = NULL WHERE path = ? AND state = ? AND worker = ?",
+                [(DONE, json.dumps(result), str(path), LEASED, worker) for path, result in results.items()],
+            )
+            return cursor.rowcount
+
+    def fail(self, worker: str, path: Path, error: str, max_attempts: int = MAX_ATTEMPTS) -> None:
+        """Give an image back to the queue after an error, or mark it failed after max_attempts."""
+        with self.transaction() as cursor:
+            cursor.execute(
+                "UPDATE jobs SET state = CASE WHEN attempts >= ? THEN ? ELSE ? END, error = ?, lease_expires = NULL "
+                "WHERE path = ? AND state = ? AND worker = ?",
+                (max_attempts, FAILED, PENDING, error, str(path), LEASED, worker),
+            )
+
+    def progress(self) -> dict:
+        """The number of images in each state."""
+        counts = dict.fromkeys([PENDING, LEASED, DONE, FAILED], 0)
+        counts.update(self.connection.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall())
+        return counts
+
+    def results(self):
+        """Iterate over the (path, result) of the images done, in path order."""
+        for path, result in self.connection.execute("SELECT path, result FROM jobs WHERE state = ? ORDER BY path", (DONE,)):
+            yield path, json.loads(result)
+
+
+class Transaction:
+    """Context manager running a write transaction, committed on success and rolled back on error."""
+
+    def __init__(self, connection: sqlite3.Connection) -> None:
+        self.connection = connection
+
+    def __enter__(self) -> sqlite3.Cursor:
+        self.cursor = self.connection.cursor()
+        self.cursor.execute("BEGIN IMMEDIATE")
+        return self.cursor
+
+    def __exit__(self, exc_type, *exc) -> None:
+        self.cursor.execute("ROLLBACK" if exc_type else "COMMIT")
+
+
+class Heartbeat(threading.Thread):
+    """Background thread renewing the leases of a worker every third of the lease duration."""
+
+    def __init__(self, db_path: Path, worker: str, lease_seconds: float) -> None:
+        super().__init__(daemon=True)
+        self.db_path = db_path
+        self.worker = worker
+        self.lease_seconds = lease_seconds
+        self.stopped = threading.Event()
+
+    def run(self) -> None:
+        queue = WorkQueue(self.db_path)
+        try:
+            while not self.stopped.wait(self.lease_seconds / 3):
+                queue.heartbeat(self.worker, self.lease_seconds)
+        finally:
+            queue.close()
+
+    def stop(self) -> None:
+        self.stopped.set()
+        self.join()
+
+
+def run_worker(db_path: Path, batch_size: int = BATCH_SIZE, lease_seconds: float = LEASE_SECONDS) -> int:
+    """Process batches of images from the queue until none is pending or leased anymore.
+
+    Returns:
+        int: The number of images processed by the worker.
+    """
+    queue = WorkQueue(db_path)
+    worker = worker_name()
+    process = importlib.import_module(TASKS[queue.task]).queue_task()
+
+    heartbeat = Heartbeat(db_path, worker, lease_seconds)
+    heartbeat.start()
+
+    processed = 0
+    try:
+        while True:
+            paths = queue.claim(worker, batch_size, lease_seconds)
+            if not paths:
+                if queue.progress()[LEASED] == 0:
+                    break
+                # Images leased by other workers are claimed again if their lease expires
+                time.sleep(min(IDLE_SECONDS, lease_seconds))
+                continue
+
+            results = {}
+            for path, image in PrefetchReader(paths):
+                try:
+                    if image is None:
+                        raise ValueError("image could not be decoded")
+                    results[path] = process(Path(path), image)
+                except Exception as e:
+                    queue.fail(worker, path, repr(e))
+
+            processed += queue.complete(worker, results)
+    finally:
+        heartbeat.stop()
+        queue.close()
+
+    return processed
+
+
+def merge(db_path: Path, out_path: Path) -> int:
+    """Write the result of every image done as a JSON lines file, in path order.
+
+    Returns:
+        int: The number of results written.
+    """
+    queue = WorkQueue(db_path)
+    count = 0
+
+    with open(out_path, "w") as f:
+        for path, result in queue.results():
+            f.write(json.dumps(result) + "\n")
+            count += 1
+
+    queue.close()
+    return count
+
+
+def main(argc, argv):
+    parser = argparse.ArgumentParser(prog="queue", description="Spread the processing of images over several workers")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    enqueue_parser = commands.add_parser("enqueue", help="add the images of folders to the queue")
+    enqueue_parser.add_argument("db", type=Path, help="queue database")
+    enqueue_parser.add_argument("task", choices=TASKS, help="task to run on the images")
+    enqueue_parser.add_argument("folders", type=Path, nargs="+", help="folders containing the images")
+
+    work_parser = commands.add_parser("work", help="process images until the queue is empty")
+    work_parser.add_argument("db", type=Path, help="queue database")
+    work_parser.add_argument("--processes", type=int, default=1, help="number of worker processes on this host")
+    work_parser.add_argument("--batch", type=int, default=BATCH_SIZE, help="images claimed at once")
+    work_parser.add_argument("--lease", type=float, default=LEASE_SECONDS, help="lease duration in seconds")
+
+    status_parser = commands.add_parser("status", help="show the number of images in each state")
+    status_parser.add_argument("db", type=Path, help="queue database")
+
+    merge_parser = commands.add_parser("merge", help="write the results as JSON lines")
+    merge_parser.add_argument("db", type=Path, help="queue database")
+    merge_parser.add_argument("out", type=Path, help="output file, a manifest for the filter task")
+    merge_parser.add_argument("--select", type=Path, default=None, help="folder to link the selected images into (filter task)")
+
+    args = parser.parse_args(argv[1:argc])
+
+    if args.command == "enqueue":
+        paths = [path for folder in args.folders for path in sorted(folder.glob("*.jpg"))]
+        try:
+            print(f"Queued {WorkQueue(args.db).enqueue(paths, args.task)} new images")
+        except ValueError as e:
+            print(e)
+            sys.exit(1)
+
+    elif args.command == "work":
+        workers = [Process(target=run_worker, args=(args.db, args.batch, args.lease)) for _ in range(args.processes)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        print(WorkQueue(args.db).progress())
+
+    elif args.command == "status":
+        print(WorkQueue(args.db).progress())
+
+    elif args.command == "merge":
+        print(f"Merged {merge(args.db, args.out)} results into {args.out}")
+        if args.select is not None:
+            Manifest.load(args.out).selected().materialise(args.select, LINK)
+
+
+if __name__ == "__main__":
+    main(len(sys.argv), sys.argv)